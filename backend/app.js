@@ -56,6 +56,51 @@ function deleteAllUsers() {
     });
 }
 
+// Ficheiros acima deste tamanho vão em partes por /uploads (retomável)
+const CHUNKED_UPLOAD_THRESHOLD = 8 * 1024 * 1024;
+const CHUNKED_UPLOAD_RETRIES   = 5;
+
+async function uploadFileChunked(username, file) {
+  const user = encodeURIComponent(username);
+  let res = await fetch("/uploads", {
+    method: "POST",
+    headers: { "Content-Type": "application/json" },
+    body: JSON.stringify({ username, filename: file.name, size: file.size }),
+  });
+  let session = await res.json();
+  if (!res.ok) return session;
+
+  let failures = 0;
+  while (session.received < session.size) {
+    const start = session.received;
+    const chunk = file.slice(start, start + session.chunk_size);
+    try {
+      res = await fetch(`/uploads/${session.upload_id}?username=${user}&offset=${start}`, {
+        method: "PUT",
+        body: chunk,
+      });
+      // 409 também traz o offset correto
+      if (!res.ok && res.status !== 409) return await res.json();
+      session = await res.json();
+      failures = 0;
+    } catch (err) {
+      // ligação caiu: pergunta ao servidor onde retomar
+      if (++failures > CHUNKED_UPLOAD_RETRIES) throw err;
+      await new Promise(r => setTimeout(r, 1000 * failures));
+      const status = await fetch(`/uploads/${session.upload_id}?username=${user}`);
+      if (!status.ok) return status.json();
+      session = await status.json();
+    }
+  }
+
+  res = await fetch(`/uploads/${session.upload_id}/complete`, {
+    method: "POST",
+    headers: { "Content-Type": "application/json" },
+    body: JSON.stringify({ username }),
+  });
+  return res.json();
+}
+
 // Upload de arquivo
 function uploadFile() {
   const username  = localStorage.getItem("loggedUser");
@@ -65,15 +110,21 @@ function uploadFile() {
     return;
   }
 
-  const formData = new FormData();
-  formData.append("file", fileInput.files[0]);
-  formData.append("username", username);
+  const file = fileInput.files[0];
+  let upload;
+  if (file.size > CHUNKED_UPLOAD_THRESHOLD) {
+    upload = uploadFileChunked(username, file);
+  } else {
+    const formData = new FormData();
+    formData.append("file", file);
+    formData.append("username", username);
+    upload = fetch(`/upload?username=${encodeURIComponent(username)}`, {
+      method: "POST",
+      body: formData,
+    }).then(res => res.json());
+  }
 
-  fetch("/upload", {
-    method: "POST",
-    body: formData,
-  })
-    .then(res => res.json())
+  upload
     .then(data => {
       alert(data.message || "Upload feito!");
       listFiles();
@@ -212,6 +263,9 @@ function setupJobForm() {
     if (inputFile.files.length > 0) {
       formData.append("input", inputFile.files[0]);
     }
+    if (document.getElementById("cacheResult").checked) {
+      formData.append("cache", "1");
+    }
 
     fetch("/submit-job", {
       method: "POST",
@@ -221,6 +275,7 @@ function setupJobForm() {
       .then(data => {
         alert(data.message || "Job executado.");
         loadJobs();
+        if (data.job_id && !data.cached) watchJob(username, data.job_id);
       })
       .catch(err => {
         console.error("Erro ao submeter job:", err);
@@ -228,6 +283,17 @@ function setupJobForm() {
   });
 }
 
+// Recebe (via Server-Sent Events) o aviso de conclusão do job e atualiza a lista
+function watchJob(username, jobId) {
+  const params = new URLSearchParams({ username: username, job_id: jobId });
+  const source = new EventSource(`/job-events?${params}`);
+  source.addEventListener("done", () => {
+    source.close();
+    loadJobs();
+  });
+  source.addEventListener("timeout", () => source.close());
+}
+
 // Carrega resultados dos jobs para a lista (<ul id="jobResults">)
 function loadJobs() {
   const username = localStorage.getItem("loggedUser");
@@ -236,14 +302,18 @@ function loadJobs() {
 
   fetch(`/jobs/${username}`)
     .then(res => res.json())
-    .then(jobs => {
+    .then(data => {
+      const jobs = data.jobs;
       jobList.innerHTML = "";
       if (!Array.isArray(jobs) || jobs.length === 0) {
         jobList.innerHTML = "<li>Nenhum job executado ainda.</li>";
       } else {
         jobs.forEach(job => {
           const li = document.createElement("li");
-          li.innerHTML = `<strong>${job.job}</strong><pre>${job.output}</pre>`;
+          const usage = job.cpu_time_ms != null
+            ? ` — CPU ${job.cpu_time_ms} ms, memória ${(job.peak_memory / (1024 * 1024)).toFixed(1)} MB`
+            : "";
+          li.innerHTML = `<strong>${job.job}</strong> (${job.status}${usage})<pre>${job.output}</pre>`;
           jobList.appendChild(li);
         });
       }
@@ -253,6 +323,32 @@ function loadJobs() {
     });
 }
 
+// Containers em preparação (pull da imagem em background): atualiza o
+// estado até ficarem RUNNING ou ERROR e recarrega a página para os botões
+const CONTAINER_POLL_MS = 2000;
+
+function watchContainers() {
+  document.querySelectorAll(".container-status[data-provisioning]").forEach(pollContainer);
+}
+
+function pollContainer(cell) {
+  fetch(`/containers/${cell.dataset.containerId}/status`, { credentials: "same-origin" })
+    .then(res => res.json())
+    .then(c => {
+      const progress = c.status === "PULLING" && c.progress != null ? ` ${c.progress}%` : "";
+      cell.textContent = `${c.status}${progress}${c.detail ? " — " + c.detail : ""}`;
+      if (["BUILDING", "PULLING", "STARTING"].includes(c.status)) {
+        setTimeout(() => pollContainer(cell), CONTAINER_POLL_MS);
+      } else {
+        window.location.reload();
+      }
+    })
+    .catch(err => {
+      console.error("Erro ao consultar container:", err);
+      setTimeout(() => pollContainer(cell), CONTAINER_POLL_MS * 5);
+    });
+}
+
 // Busca e exibe a lista de databases no <ul id="dbList"> e no <select id="dbSelect">
 async function fetchDatabases() {
   const listError = document.getElementById('listErrorDb');
@@ -443,6 +539,9 @@ document.addEventListener("DOMContentLoaded", () => {
     fetchDatabases();
   }
 
+  // Containers ainda em preparação
+  watchContainers();
+
   // Upload de arquivo (<form id="uploadForm">)
   const uploadForm = document.getElementById("uploadForm");
   if (uploadForm) {
@@ -0,0 +1,100 @@
+"""
+Armazenamento de scripts e inputs endereçado por conteúdo (sha256).
+
+Os ficheiros ficam em BLOB_DIR/<2 primeiros hex>/<digest>, num volume
+partilhado pelo backend, worker e executor; os jobs levam só o digest.
+Conteúdo igual é gravado uma única vez e os blobs nunca são alterados
+depois de escritos (a escrita é feita num temporário + rename atómico).
+
+O mtime de um blob é o do último upload com esse conteúdo; collect_garbage
+apaga os que não são enviados há mais de BLOB_TTL e que nenhum job por
+terminar referencia.
+"""
+import hashlib
+import os
+import re
+import tempfile
+import time
+
+BLOB_DIR     = os.environ.get("BLOB_DIR", "/app/blobs")
+BLOB_TTL     = int(os.environ.get("BLOB_TTL_SECONDS", str(7 * 24 * 3600)))
+BLOB_TMP_TTL = 3600   # temporários de uploads interrompidos
+CHUNK_SIZE   = 1024 * 1024
+
+DIGEST_RE = re.compile(r"^[0-9a-f]{64}$")
+
+
+def is_digest(value) -> bool:
+    return bool(value) and DIGEST_RE.match(value) is not None
+
+
+def blob_path(digest: str) -> str:
+    if not is_digest(digest):
+        raise ValueError(f"digest inválido: {digest!r}")
+    return os.path.join(BLOB_DIR, digest[:2], digest)
+
+
+def exists(digest: str) -> bool:
+    return os.path.exists(blob_path(digest))
+
+
+def put_stream(stream) -> str:
+    """Grava o conteúdo de `stream` (lido por blocos) e devolve o digest."""
+    tmp_dir = os.path.join(BLOB_DIR, "tmp")
+    os.makedirs(tmp_dir, exist_ok=True)
+    digest = hashlib.sha256()
+    fd, tmp_path = tempfile.mkstemp(dir=tmp_dir)
+    try:
+        with os.fdopen(fd, "wb") as f:
+            for chunk in iter(lambda: stream.read(CHUNK_SIZE), b""):
+                digest.update(chunk)
+                f.write(chunk)
+        digest = digest.hexdigest()
+        path = blob_path(digest)
+        try:
+            # já existe (mesmo conteúdo): só o protege do collect_garbage
+            os.utime(path)
+            os.remove(tmp_path)
+        except FileNotFoundError:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            os.chmod(tmp_path, 0o444)
+            os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return digest
+
+
+def put_file(path: str) -> str:
+    with open(path, "rb") as f:
+        return put_stream(f)
+
+
+def collect_garbage(keep, max_age: int = BLOB_TTL):
+    """
+    Apaga os blobs com mais de `max_age` s que não estão em `keep` (digests
+    ainda referenciados) e os temporários abandonados. Devolve
+    (blobs apagados, bytes libertados).
+    """
+    if not os.path.isdir(BLOB_DIR):
+        return 0, 0
+    now     = time.time()
+    removed = freed = 0
+    for shard in os.scandir(BLOB_DIR):
+        if not shard.is_dir():
+            continue
+        is_tmp = shard.name == "tmp"
+        cutoff = now - (BLOB_TMP_TTL if is_tmp else max_age)
+        for entry in os.scandir(shard.path):
+            try:
+                st = entry.stat()
+                if st.st_mtime >= cutoff or (not is_tmp and entry.name in keep):
+                    continue
+                os.remove(entry.path)
+            except FileNotFoundError:
+                continue
+            if not is_tmp:
+                removed += 1
+                freed   += st.st_size
+    return removed, freed
@@ -0,0 +1,79 @@
+import json
+import os
+import time
+
+import redis
+
+# Logs dos builds de /build-image, via Redis (escritos pelo image_builder
+# e lidos pelo SSE /builds/<build_id>/logs):
+#   - build-log:<build_id>    lista com as linhas do docker build
+#   - build-done:<build_id>   estado final (succeeded/failed), quando termina
+#   - build-events:<build_id> canal pub/sub que acorda quem está a ler
+REDIS_URL         = os.environ.get("REDIS_URL", "redis://redis:6379/0")
+BUILD_LOG_TTL     = 24 * 3600
+BUILD_LOG_MAX     = 10000   # primeiras linhas guardadas por build (offsets estáveis)
+
+redis_client = redis.Redis.from_url(REDIS_URL)
+
+
+def _log_key(build_id: str) -> str:
+    return f"build-log:{build_id}"
+
+
+def _done_key(build_id: str) -> str:
+    return f"build-done:{build_id}"
+
+
+def _channel(build_id: str) -> str:
+    return f"build-events:{build_id}"
+
+
+def append_build_log(build_id: str, lines):
+    lines = [line for line in lines if line]
+    if not lines:
+        return
+    pipe = redis_client.pipeline()
+    pipe.rpush(_log_key(build_id), *lines)
+    pipe.ltrim(_log_key(build_id), 0, BUILD_LOG_MAX - 1)
+    pipe.expire(_log_key(build_id), BUILD_LOG_TTL)
+    pipe.publish(_channel(build_id), "log")
+    pipe.execute()
+
+
+def finish_build_log(build_id: str, status: str):
+    pipe = redis_client.pipeline()
+    pipe.set(_done_key(build_id), json.dumps({"status": status}), ex=BUILD_LOG_TTL)
+    pipe.publish(_channel(build_id), "done")
+    pipe.execute()
+
+
+def read_build_log(build_id: str, start: int = 0):
+    """(linhas a partir de `start`, estado final ou None se ainda a correr)."""
+    pipe = redis_client.pipeline()
+    pipe.lrange(_log_key(build_id), start, -1)
+    pipe.get(_done_key(build_id))
+    lines, done = pipe.execute()
+    return [line.decode("utf-8", "replace") for line in lines], \
+        json.loads(done)["status"] if done else None
+
+
+def wait_build_log(build_id: str, start: int, timeout: float):
+    """
+    Como read_build_log, mas espera até `timeout` segundos por linhas
+    novas. Subscreve antes de ler para não perder uma publicação feita
+    entre as duas operações.
+    """
+    pubsub = redis_client.pubsub(ignore_subscribe_messages=True)
+    pubsub.subscribe(_channel(build_id))
+    try:
+        lines, done = read_build_log(build_id, start)
+        if lines or done:
+            return lines, done
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            # a confirmação do subscribe também acorda o get_message
+            if pubsub.get_message(timeout=deadline - time.monotonic()):
+                break
+        return read_build_log(build_id, start)
+    finally:
+        pubsub.close()
@@ -0,0 +1,256 @@
+"""
+Pool de containers pré-criados para /run-job.
+
+Criar e arrancar um container por pedido custa segundos, mesmo para um
+`echo` numa imagem que já está no disco. Aqui cada imagem de
+CONTAINER_POOL_IMAGES tem até CONTAINER_POOL_SIZE containers já
+arrancados e pausados (processo principal inerte, sem CPU). Um pedido:
+
+1. reclama um container pausado da imagem (unpause: milissegundos);
+2. corre o comando com exec; passados CONTAINER_POOL_EXEC_TIMEOUT s o
+   backend remove o container (não depende de nenhum binário da imagem);
+3. devolve-o ao pool (pause) ou recicla-o (remove) ao fim de
+   CONTAINER_POOL_MAX_USES usos ou se algo correu mal.
+
+Por omissão cada container é usado uma só vez (nada do job anterior
+fica visível ao seguinte); o custo de criar o substituto sai do pedido
+e passa para a thread `maintainer`, que repõe o pool. Limites:
+
+- no máximo CONTAINER_POOL_MAX containers do pool (pausados + em uso);
+- os pausados de uma imagem sem pedidos há mais de
+  CONTAINER_POOL_IDLE_SECONDS são removidos e a imagem só volta a ter
+  pool depois do próximo pedido.
+"""
+import os
+import shlex
+import threading
+import time
+import uuid
+from collections import deque
+
+import docker
+
+import image_pull
+
+CONTAINER_POOL_IMAGES       = [i.strip() for i in os.environ.get("CONTAINER_POOL_IMAGES", "ubuntu:20.04").split(",") if i.strip()]
+CONTAINER_POOL_SIZE         = int(os.environ.get("CONTAINER_POOL_SIZE", "2"))
+CONTAINER_POOL_MAX          = int(os.environ.get("CONTAINER_POOL_MAX", "16"))
+CONTAINER_POOL_IDLE_SECONDS = int(os.environ.get("CONTAINER_POOL_IDLE_SECONDS", "600"))
+CONTAINER_POOL_MAX_USES     = int(os.environ.get("CONTAINER_POOL_MAX_USES", "1"))
+CONTAINER_POOL_EXEC_TIMEOUT = int(os.environ.get("CONTAINER_POOL_EXEC_TIMEOUT", "60"))
+
+# Label dos containers do pool (para os encontrar depois de um reinício)
+POOL_LABEL = "mycloud.pool"
+
+
+class PooledContainer:
+    def __init__(self, container, image):
+        self.container = container
+        self.image     = image
+        self.uses      = 0
+
+
+class ContainerPool:
+    def __init__(self, client, images=CONTAINER_POOL_IMAGES, size=CONTAINER_POOL_SIZE,
+                 max_containers=CONTAINER_POOL_MAX, idle_seconds=CONTAINER_POOL_IDLE_SECONDS,
+                 max_uses=CONTAINER_POOL_MAX_USES, create_kwargs=None):
+        self.client         = client
+        self.size           = size
+        self.max_containers = max_containers
+        self.idle_seconds   = idle_seconds
+        self.max_uses       = max_uses
+        self.create_kwargs  = create_kwargs or {}
+        self.idle           = {image: deque() for image in images}   # imagem -> pausados
+        self.demand         = {image: time.monotonic() for image in images}   # último pedido
+        self.in_use         = 0
+        self.lock           = threading.Lock()
+        self.wake           = threading.Event()
+        self.counters       = {"hits": 0, "misses": 0, "created": 0, "recycled": 0,
+                               "expired": 0, "errors": 0}
+
+    def pooled(self, image):
+        return image in self.idle
+
+    def total(self):
+        return self.in_use + sum(len(q) for q in self.idle.values())
+
+    def claim(self, image):
+        """Container pausado de `image`, já em execução, ou None (pool vazio)."""
+        while True:
+            with self.lock:
+                self.demand[image] = time.monotonic()
+                queue = self.idle[image]
+                if not queue:
+                    self.counters["misses"] += 1
+                    self.wake.set()
+                    return None
+                entry = queue.pop()   # o pausado mais recente
+                self.in_use += 1
+            self.wake.set()
+            try:
+                entry.container.unpause()
+                with self.lock:
+                    self.counters["hits"] += 1
+                return entry
+            except docker.errors.APIError:
+                # removido por fora ou daemon reiniciado: tenta o seguinte
+                self.discard(entry)
+
+    def release(self, entry, healthy=True):
+        """Devolve o container ao pool (pausado) ou recicla-o."""
+        entry.uses += 1
+        if healthy and entry.uses < self.max_uses:
+            try:
+                entry.container.pause()
+                with self.lock:
+                    self.in_use -= 1
+                    self.idle[entry.image].append(entry)
+                return
+            except docker.errors.APIError:
+                pass
+        self.discard(entry, recycled=True)
+
+    def discard(self, entry, recycled=False):
+        with self.lock:
+            self.in_use -= 1
+            self.counters["recycled" if recycled else "errors"] += 1
+        self.remove(entry.container)
+        self.wake.set()
+
+    def remove(self, container):
+        try:
+            container.remove(force=True)
+        except docker.errors.APIError:
+            pass
+
+    def execute(self, entry, cmd, out, timeout=CONTAINER_POOL_EXEC_TIMEOUT):
+        """
+        Corre `cmd` no container reclamado `entry`, escreve o output em
+        `out` (ficheiro binário) à medida que chega e devolve o exit code,
+        ou None se passou `timeout` s: nesse caso o container é removido,
+        o que acaba com o exec. O container é sempre devolvido ou reciclado.
+        """
+        api       = self.client.api
+        argv      = shlex.split(cmd) if isinstance(cmd, str) else list(cmd)
+        timed_out = threading.Event()
+
+        def kill():
+            timed_out.set()
+            self.remove(entry.container)
+
+        timer   = threading.Timer(timeout, kill) if timeout else None
+        healthy = False
+        try:
+            exec_id = api.exec_create(entry.container.id, argv)["Id"]
+            if timer:
+                timer.daemon = True
+                timer.start()
+            try:
+                for chunk in api.exec_start(exec_id, stream=True):
+                    out.write(chunk)
+            except (docker.errors.APIError, OSError):
+                # a ligação cai quando o container é removido pelo timeout
+                if not timed_out.is_set():
+                    raise
+            if timed_out.is_set():
+                return None
+            exit_code = api.exec_inspect(exec_id)["ExitCode"]
+            healthy   = True
+            return exit_code
+        finally:
+            if timer:
+                timer.cancel()
+            self.release(entry, healthy and not timed_out.is_set())
+
+    def create(self, image):
+        """Cria, arranca e pausa um container de `image` para o pool."""
+        image_pull.ensure_image(self.client, image)
+        container = self.client.containers.run(
+            image=image,
+            name=f"pool_{uuid.uuid4().hex[:12]}",
+            command=["tail", "-f", "/dev/null"],
+            labels={POOL_LABEL: image},
+            init=True,
+            detach=True,
+            **self.create_kwargs
+        )
+        try:
+            container.pause()
+        except docker.errors.APIError:
+            self.remove(container)
+            raise
+        return PooledContainer(container, image)
+
+    def fill(self):
+        """Repõe os pausados das imagens com pedidos recentes."""
+        for image in list(self.idle):
+            while True:
+                with self.lock:
+                    wanted = time.monotonic() - self.demand[image] < self.idle_seconds
+                    if not wanted or len(self.idle[image]) >= self.size \
+                            or self.total() >= self.max_containers:
+                        break
+                entry = self.create(image)
+                with self.lock:
+                    self.idle[image].append(entry)
+                    self.counters["created"] += 1
+
+    def expire_idle(self):
+        """Remove os pausados das imagens sem pedidos há mais de idle_seconds."""
+        cutoff  = time.monotonic() - self.idle_seconds
+        expired = []
+        with self.lock:
+            for image, queue in self.idle.items():
+                if self.demand[image] < cutoff:
+                    expired += queue
+                    queue.clear()
+            self.counters["expired"] += len(expired)
+        for entry in expired:
+            self.remove(entry.container)
+
+    def reap(self):
+        """No arranque: remove os containers de pool deixados por um backend anterior."""
+        for container in self.client.containers.list(all=True, filters={"label": POOL_LABEL}):
+            self.remove(container)
+
+    def stats(self):
+        now = time.monotonic()
+        with self.lock:
+            counters = dict(self.counters)
+            images   = {
+                image: {
+                    "idle":                len(queue),
+                    "seconds_since_claim": round(now - self.demand[image], 1),
+                }
+                for image, queue in self.idle.items()
+            }
+            in_use = self.in_use
+        claims = counters["hits"] + counters["misses"]
+        return {
+            **counters,
+            "hit_rate":       round(counters["hits"] / claims, 3) if claims else None,
+            "in_use":         in_use,
+            "size":           self.size,
+            "max_containers": self.max_containers,
+            "images":         images,
+        }
+
+    def maintainer(self, on_error=None):
+        """Ciclo para uma thread daemon: limpa o que sobrou, repõe e expira."""
+        try:
+            self.reap()
+        except docker.errors.DockerException as e:
+            if on_error:
+                on_error(e)
+        while True:
+            self.wake.clear()
+            try:
+                self.expire_idle()
+                self.fill()
+            except docker.errors.DockerException as e:
+                with self.lock:
+                    self.counters["errors"] += 1
+                if on_error:
+                    on_error(e)
+                time.sleep(5)
+            self.wake.wait(timeout=max(min(self.idle_seconds / 2, 60), 1))
@@ -0,0 +1,80 @@
+"""
+Tradução do estado dos containers Docker para Container.status, usada
+pelo reconciliador da tabela containers (container_reconciler em main.py).
+
+- eventos (docker events, type=container): start/die/destroy/... ->
+  (nome, status, exit code);
+- listagem completa (resync no arranque e periódico): State.Status ->
+  status;
+- docker stats (sem streaming): percentagem de CPU e memória usada.
+"""
+import re
+
+# State.Status do Docker -> Container.status ("created": ainda não
+# arrancou, o status atual mantém-se)
+DOCKER_STATUS = {
+    "running":    "RUNNING",
+    "restarting": "RUNNING",
+    "paused":     "PAUSED",
+    "exited":     "STOPPED",
+    "dead":       "STOPPED",
+}
+
+EXITED_RE = re.compile(r"^Exited \((-?\d+)\)")
+
+# Ação do evento -> Container.status
+EVENT_STATUS = {
+    "start":   "RUNNING",
+    "restart": "RUNNING",
+    "unpause": "RUNNING",
+    "pause":   "PAUSED",
+    "die":     "STOPPED",
+    "destroy": "DELETED",
+}
+
+
+def event_update(event):
+    """(nome, docker_id, status, exit code) de um evento, ou None se não muda o status."""
+    status = EVENT_STATUS.get(event.get("Action") or event.get("status"))
+    if not status:
+        return None
+    actor = event.get("Actor") or {}
+    attrs = actor.get("Attributes") or {}
+    exit_code = attrs.get("exitCode")
+    return (
+        attrs.get("name"),
+        actor.get("ID") or event.get("id"),
+        status,
+        int(exit_code) if exit_code not in (None, "") else None,
+    )
+
+
+def listed_update(item):
+    """
+    (nome, docker_id, status, exit code) de um item de
+    client.api.containers(all=True): uma só chamada para todos os
+    containers, mas o exit code só vem no texto ("Exited (137) 2 hours ago").
+    """
+    exited = EXITED_RE.match(item.get("Status") or "")
+    return (
+        (item.get("Names") or ["/"])[0].lstrip("/"),
+        item.get("Id"),
+        DOCKER_STATUS.get(item.get("State")),
+        int(exited.group(1)) if exited else None,
+    )
+
+
+def stats_usage(stats):
+    """(CPU em %, memória em bytes) de um docker stats com stream=False."""
+    cpu, precpu = stats.get("cpu_stats") or {}, stats.get("precpu_stats") or {}
+    cpu_delta = (cpu.get("cpu_usage") or {}).get("total_usage", 0) - \
+        (precpu.get("cpu_usage") or {}).get("total_usage", 0)
+    system_delta = cpu.get("system_cpu_usage", 0) - precpu.get("system_cpu_usage", 0)
+    cpus = cpu.get("online_cpus") or len((cpu.get("cpu_usage") or {}).get("percpu_usage") or []) or 1
+    cpu_percent = round(cpu_delta / system_delta * cpus * 100, 1) if system_delta > 0 and cpu_delta >= 0 else 0.0
+
+    memory = stats.get("memory_stats") or {}
+    # sem a page cache, como o docker stats (inactive_file no cgroup v2, cache no v1)
+    detail = memory.get("stats") or {}
+    cache  = detail.get("inactive_file", detail.get("cache", 0))
+    return cpu_percent, max(memory.get("usage", 0) - cache, 0)
@@ -0,0 +1,104 @@
+"""
+Cache de engines SQLAlchemy para as bases dos utilizadores (/db-query).
+
+Cada engine tem o seu pool de ligações ao Postgres; criar um por pedido
+obriga a um handshake TCP + autenticação a cada query e deixa pools por
+fechar. Aqui os engines são reutilizados por URL, com:
+
+- no máximo DB_ENGINE_CACHE_SIZE engines (o menos usado é descartado);
+- pools pequenos (DB_ENGINE_POOL_SIZE + DB_ENGINE_MAX_OVERFLOW ligações);
+- descarte dos engines sem uso há mais de DB_ENGINE_IDLE_SECONDS.
+"""
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from sqlalchemy import create_engine
+
+DB_ENGINE_CACHE_SIZE   = int(os.environ.get("DB_ENGINE_CACHE_SIZE", "32"))
+DB_ENGINE_IDLE_SECONDS = int(os.environ.get("DB_ENGINE_IDLE_SECONDS", "300"))
+DB_ENGINE_POOL_SIZE    = int(os.environ.get("DB_ENGINE_POOL_SIZE", "2"))
+DB_ENGINE_MAX_OVERFLOW = int(os.environ.get("DB_ENGINE_MAX_OVERFLOW", "3"))
+DB_ENGINE_POOL_TIMEOUT = int(os.environ.get("DB_ENGINE_POOL_TIMEOUT", "10"))
+
+
+class EngineCache:
+    def __init__(self, max_engines=DB_ENGINE_CACHE_SIZE, idle_seconds=DB_ENGINE_IDLE_SECONDS,
+                 connect_args=None):
+        self.max_engines  = max_engines
+        self.idle_seconds = idle_seconds
+        self.connect_args = connect_args or {}
+        self.engines      = OrderedDict()   # url -> (engine, último uso)
+        self.lock         = threading.Lock()
+        self.counters     = {"hits": 0, "misses": 0, "evictions": 0, "idle_disposals": 0}
+
+    def get(self, url):
+        """Engine para `url`, criado na primeira utilização."""
+        with self.lock:
+            entry = self.engines.pop(url, None)
+            if entry:
+                self.counters["hits"] += 1
+                engine = entry[0]
+            else:
+                self.counters["misses"] += 1
+                engine = create_engine(
+                    url,
+                    pool_size=DB_ENGINE_POOL_SIZE,
+                    max_overflow=DB_ENGINE_MAX_OVERFLOW,
+                    pool_timeout=DB_ENGINE_POOL_TIMEOUT,
+                    pool_recycle=self.idle_seconds,
+                    pool_pre_ping=True,
+                    connect_args=self.connect_args,
+                )
+            self.engines[url] = (engine, time.monotonic())
+
+            evicted = []
+            while len(self.engines) > self.max_engines:
+                _, (old, _) = self.engines.popitem(last=False)
+                evicted.append(old)
+                self.counters["evictions"] += 1
+        # dispose() fecha ligações; fora do lock para não bloquear os outros pedidos
+        for old in evicted:
+            old.dispose()
+        return engine
+
+    def dispose_idle(self):
+        cutoff = time.monotonic() - self.idle_seconds
+        with self.lock:
+            idle = [url for url, (_, used) in self.engines.items() if used < cutoff]
+            engines = [self.engines.pop(url)[0] for url in idle]
+            self.counters["idle_disposals"] += len(engines)
+        for engine in engines:
+            engine.dispose()
+
+    def stats(self):
+        with self.lock:
+            entries  = list(self.engines.items())
+            counters = dict(self.counters)
+        # sem o nome das bases: /metrics/db-engines é público
+        now   = time.monotonic()
+        pools = []
+        for _, (engine, used) in entries:
+            pool = engine.pool
+            pools.append({
+                "checked_out":  pool.checkedout(),
+                "checked_in":   pool.checkedin(),
+                "overflow":     max(pool.overflow(), 0),
+                "idle_seconds": round(now - used, 1),
+            })
+        lookups = counters["hits"] + counters["misses"]
+        return {
+            **counters,
+            "hit_rate":         round(counters["hits"] / lookups, 3) if lookups else None,
+            "engines":          len(entries),
+            "max_engines":      self.max_engines,
+            "open_connections": sum(p["checked_out"] + p["checked_in"] for p in pools),
+            "pools":            pools,
+        }
+
+    def sweeper(self):
+        """Ciclo para uma thread daemon: descarta engines inativos."""
+        while True:
+            time.sleep(max(self.idle_seconds / 2, 1))
+            self.dispose_idle()
@@ -1,11 +1,188 @@
 import requests
+import json
 import os
+import struct
+import time
 
-EXECUTOR_URL = os.environ.get("EXECUTOR_URL", "http://executor:8000/execute")
+import redis
+import urllib3
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
-def run_job(files: dict, data: dict, timeout: int = 30):
+from job_events import redis_client
+
+EXECUTOR_URL       = os.environ.get("EXECUTOR_URL", "http://executor:8000/execute")
+EXECUTOR_SUITE_URL = os.environ.get("EXECUTOR_SUITE_URL", EXECUTOR_URL + "-suite")
+
+# Ligações keep-alive ao executor por processo (cada processo do worker
+# Celery tem a sua sessão). Só falhas de ligação são repetidas: o pedido
+# não chegou ao executor, por isso não há risco de correr o job duas vezes.
+EXECUTOR_POOL_SIZE       = int(os.environ.get("EXECUTOR_POOL_SIZE", "4"))
+EXECUTOR_CONNECT_RETRIES = int(os.environ.get("EXECUTOR_CONNECT_RETRIES", "3"))
+
+# Cabeçalho de cada frame do streaming: tipo (1 byte) + tamanho (4 bytes)
+FRAME_HEADER = struct.Struct(">cI")
+
+# Latência das chamadas ao executor, agregada em Redis por todos os workers:
+# hash executor-latency:<endpoint> com contagens, somas e histograma (ms)
+LATENCY_KEY        = "executor-latency:{}"
+LATENCY_BUCKETS_MS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000)
+LATENCY_PHASES     = ("ttfb", "total")
+
+_session = None
+_session_pid = None
+
+
+def get_session():
+    """Sessão HTTP partilhada pelo processo (recriada após fork)."""
+    global _session, _session_pid
+    if _session is None or _session_pid != os.getpid():
+        retry = Retry(
+            total=EXECUTOR_CONNECT_RETRIES,
+            connect=EXECUTOR_CONNECT_RETRIES,
+            read=0,
+            status=0,
+            backoff_factor=0.2,
+        )
+        adapter = HTTPAdapter(
+            pool_connections=2,
+            pool_maxsize=EXECUTOR_POOL_SIZE,
+            pool_block=True,
+            max_retries=retry,
+        )
+        _session = requests.Session()
+        _session.mount("http://", adapter)
+        _session.mount("https://", adapter)
+        _session_pid = os.getpid()
+    return _session
+
+
+def record_latency(endpoint: str, phase: str, seconds: float):
+    """Acrescenta uma medição ao histograma; falhas do Redis são ignoradas."""
+    ms = seconds * 1000
+    bucket = next((b for b in LATENCY_BUCKETS_MS if ms <= b), "inf")
+    try:
+        pipe = redis_client.pipeline(transaction=False)
+        key = LATENCY_KEY.format(endpoint)
+        pipe.hincrby(key, f"{phase}_count", 1)
+        pipe.hincrbyfloat(key, f"{phase}_sum_ms", ms)
+        pipe.hincrby(key, f"{phase}_le_{bucket}", 1)
+        pipe.execute()
+    except redis.exceptions.RedisError:
+        pass
+
+
+def _record_status(endpoint: str, status):
+    try:
+        redis_client.hincrby(LATENCY_KEY.format(endpoint), f"status_{status}", 1)
+    except redis.exceptions.RedisError:
+        pass
+
+
+def _post(endpoint: str, url: str, files=None, data=None, **kwargs):
+    if not files:
+        # Pedido só com digests: o executor espera sempre multipart
+        files = {name: (None, str(value)) for name, value in data.items()}
+        data  = None
+    try:
+        response = get_session().post(url, files=files, data=data, **kwargs)
+    except requests.RequestException:
+        _record_status(endpoint, "error")
+        raise
+    _record_status(endpoint, response.status_code)
+    # elapsed: do envio do pedido até aos cabeçalhos da resposta
+    record_latency(endpoint, "ttfb", response.elapsed.total_seconds())
+    return response
+
+
+def run_job(files: dict, data: dict, timeout: int = 60, stream: bool = False):
     """
-    files: dict para multipart/form-data (script e input)
+    files: dict para multipart/form-data (script e input), ou None se o
+           script vai por digest em data; o corpo já foi enviado quando
+           esta função retorna, os ficheiros podem ser fechados
     data: dict com language, job_id, etc.
+    stream: pede o output em streaming (data['stream'] = '1') e não o
+            carrega em memória; ler com iter_frames(response)
+    """
+    if stream:
+        data = dict(data, stream='1')
+    return _post("execute", EXECUTOR_URL, files=files, data=data, timeout=timeout, stream=stream)
+
+
+def run_suite(files: list, data: dict, timeout: int = 60):
+    """
+    files: lista de tuplos multipart: ('file', ...) e um ('input', ...)
+           por caso de teste, ou None com script_digest/input_blobs em data
+    Resposta JSON com status e results (output, exit_code e duração por input).
+    """
+    started = time.monotonic()
+    response = _post("execute-suite", EXECUTOR_SUITE_URL, files=files, data=data, timeout=timeout)
+    record_latency("execute-suite", "total", time.monotonic() - started)
+    return response
+
+
+def latency_stats(endpoint: str) -> dict:
+    """Resumo do histograma: contagem, média e percentis aproximados (ms)."""
+    raw = {k.decode(): float(v) for k, v in redis_client.hgetall(LATENCY_KEY.format(endpoint)).items()}
+    stats = {
+        "status": {k[len("status_"):]: int(v) for k, v in raw.items() if k.startswith("status_")}
+    }
+    for phase in LATENCY_PHASES:
+        count = int(raw.get(f"{phase}_count", 0))
+        summary = {"count": count, "avg_ms": None, "p50_ms": None, "p95_ms": None, "p99_ms": None}
+        if count:
+            summary["avg_ms"] = round(raw[f"{phase}_sum_ms"] / count, 1)
+            for name, q in (("p50_ms", 0.5), ("p95_ms", 0.95), ("p99_ms", 0.99)):
+                # limite superior do primeiro bucket que cobre o percentil
+                seen = 0
+                for bucket in LATENCY_BUCKETS_MS + ("inf",):
+                    seen += raw.get(f"{phase}_le_{bucket}", 0)
+                    if seen >= q * count:
+                        summary[name] = bucket
+                        break
+        stats[phase] = summary
+    return stats
+
+
+def _read_exact(raw, size: int) -> bytes:
+    """
+    Lê `size` bytes de response.raw. As falhas do urllib3 a meio do corpo
+    (ligação cortada, timeout de leitura) passam às exceções do requests,
+    como no iter_content, para o worker as tratar como as outras falhas
+    de ligação ao executor.
+    """
+    data = b""
+    while len(data) < size:
+        try:
+            chunk = raw.read(size - len(data))
+        except urllib3.exceptions.ReadTimeoutError as e:
+            raise requests.exceptions.ReadTimeout(e) from e
+        except urllib3.exceptions.ProtocolError as e:
+            raise requests.exceptions.ChunkedEncodingError(e) from e
+        if not chunk:
+            break
+        data += chunk
+    return data
+
+
+def iter_frames(response):
+    """
+    Lê uma resposta em streaming do executor.
+    Produz (b'O', bytes) para cada bloco de output e, no fim,
+    (b'S', dict) com status, exit_code e output_bytes. Um frame cortado
+    a meio levanta ChunkedEncodingError; o stream só pode acabar logo a
+    seguir a um frame completo (quem lê verifica se veio o b'S').
     """
-    return requests.post(EXECUTOR_URL, files=files, data=data, timeout=timeout)
+    while True:
+        header = _read_exact(response.raw, FRAME_HEADER.size)
+        if not header:
+            return
+        if len(header) < FRAME_HEADER.size:
+            raise requests.exceptions.ChunkedEncodingError("cabeçalho de frame truncado")
+        kind, size = FRAME_HEADER.unpack(header)
+        data = _read_exact(response.raw, size)
+        if len(data) < size:
+            raise requests.exceptions.ChunkedEncodingError(
+                f"frame {kind!r} truncado: {len(data)} de {size} bytes"
+            )
+        yield kind, (json.loads(data) if kind == b'S' else data)
@@ -0,0 +1,173 @@
+"""
+Escalonamento dos jobs por classe de prioridade.
+
+- interactive: /submit-job; vai direto para a fila Celery "interactive",
+  com um limite de submissões por utilizador (token bucket).
+- batch: /submit-batch e /submit-suite; os jobs ficam primeiro numa lista
+  Redis por utilizador e um dispatcher passa-os para a fila Celery "batch"
+  em round-robin entre utilizadores, só enquanto essa fila tiver menos de
+  BATCH_QUEUE_TARGET mensagens. Assim um lote de 10k jobs de um utilizador
+  não passa à frente dos jobs dos outros, e cada utilizador está ainda
+  limitado a FAIR_USER_RATE jobs/s.
+"""
+import json
+import os
+import time
+
+import redis
+
+from job_events import redis_client
+
+INTERACTIVE_QUEUE = "interactive"
+BATCH_QUEUE       = "batch"
+QUEUES            = (INTERACTIVE_QUEUE, BATCH_QUEUE)
+
+BATCH_QUEUE_TARGET     = int(os.environ.get("BATCH_QUEUE_TARGET", "50"))
+FAIR_USER_RATE         = float(os.environ.get("FAIR_USER_RATE", "20"))
+FAIR_USER_BURST        = int(os.environ.get("FAIR_USER_BURST", "50"))
+INTERACTIVE_RATE       = float(os.environ.get("INTERACTIVE_RATE", "2"))
+INTERACTIVE_BURST      = int(os.environ.get("INTERACTIVE_BURST", "20"))
+FAIR_DISPATCH_INTERVAL = float(os.environ.get("FAIR_DISPATCH_INTERVAL", "0.5"))
+
+ACTIVE_USERS_KEY = "fair:batch:active"     # set com os utilizadores com jobs pendentes
+ROTATION_KEY     = "fair:batch:rotation"   # lista circular dos mesmos utilizadores
+PUSH_CHUNK       = 1000
+
+
+def _user_key(user_id):
+    return f"fair:batch:user:{user_id}"
+
+
+# Acrescenta jobs à lista do utilizador e põe-no na rotação se ainda não estiver
+_push = redis_client.register_script("""
+redis.call('RPUSH', KEYS[1], unpack(ARGV, 2))
+if redis.call('SADD', KEYS[2], ARGV[1]) == 1 then
+    redis.call('RPUSH', KEYS[3], ARGV[1])
+end
+return redis.call('LLEN', KEYS[1])
+""")
+
+# Tira o próximo job do utilizador; sem jobs, sai da rotação. Atómico com
+# _push, para que um job acrescentado entretanto nunca fique esquecido.
+_pop = redis_client.register_script("""
+local job = redis.call('LPOP', KEYS[1])
+if not job then
+    redis.call('SREM', KEYS[2], ARGV[1])
+    redis.call('LREM', KEYS[3], 0, ARGV[1])
+end
+return job
+""")
+
+# Devolve um job à cabeça da lista do utilizador (envio para o Celery falhou)
+_requeue = redis_client.register_script("""
+redis.call('LPUSH', KEYS[1], ARGV[2])
+if redis.call('SADD', KEYS[2], ARGV[1]) == 1 then
+    redis.call('RPUSH', KEYS[3], ARGV[1])
+end
+""")
+
+# Token bucket: devolve 1 e consome um token se houver
+_take_token = redis_client.register_script("""
+local rate, burst, now = tonumber(ARGV[1]), tonumber(ARGV[2]), tonumber(ARGV[3])
+local tokens = tonumber(redis.call('HGET', KEYS[1], 'tokens') or burst)
+local ts     = tonumber(redis.call('HGET', KEYS[1], 'ts') or now)
+tokens = math.min(burst, tokens + math.max(now - ts, 0) * rate)
+local ok = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+    ok = 1
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'ts', tostring(now))
+redis.call('EXPIRE', KEYS[1], 3600)
+return ok
+""")
+
+
+def take_token(kind, user_id, rate, burst):
+    return _take_token(keys=[f"fair:bucket:{kind}:{user_id}"], args=[rate, burst, time.time()]) == 1
+
+
+def allow_interactive(user_id):
+    """Limite de submissões interativas por utilizador (sem Redis, deixa passar)."""
+    try:
+        return take_token(INTERACTIVE_QUEUE, user_id, INTERACTIVE_RATE, INTERACTIVE_BURST)
+    except redis.exceptions.RedisError:
+        return True
+
+
+def push_batch_jobs(user_id, jobs):
+    """
+    Põe jobs na fila justa do utilizador. Cada job é um dict
+    {"task": nome da task, "kwargs": {...}}.
+    """
+    keys = [_user_key(user_id), ACTIVE_USERS_KEY, ROTATION_KEY]
+    pipe = redis_client.pipeline(transaction=False)
+    for i in range(0, len(jobs), PUSH_CHUNK):
+        payloads = [json.dumps(job) for job in jobs[i:i + PUSH_CHUNK]]
+        _push(keys=keys, args=[user_id, *payloads], client=pipe)
+    pipe.execute()
+
+
+def queue_depth(queue):
+    """Mensagens à espera numa fila Celery (broker Redis: uma lista por fila)."""
+    return redis_client.llen(queue)
+
+
+def dispatch_once(send):
+    """
+    Passa jobs das filas por utilizador para a fila Celery "batch", um de
+    cada utilizador de cada vez, até esta ter BATCH_QUEUE_TARGET mensagens.
+    `send(job)` enfileira um job no Celery. Devolve quantos foram enviados.
+    Se `send` falhar (broker em baixo), o job volta à cabeça da lista do
+    utilizador antes de a exceção seguir para o dispatcher.
+    """
+    room = BATCH_QUEUE_TARGET - queue_depth(BATCH_QUEUE)
+    sent = 0
+    idle = 0   # utilizadores seguidos sem tokens
+    while room > 0:
+        users = redis_client.llen(ROTATION_KEY)
+        if users == 0 or idle >= users:
+            break
+        # Roda a lista: o utilizador da cauda passa para a cabeça
+        user_id = redis_client.rpoplpush(ROTATION_KEY, ROTATION_KEY)
+        if user_id is None:
+            break
+        user_id = user_id.decode()
+        if not take_token(BATCH_QUEUE, user_id, FAIR_USER_RATE, FAIR_USER_BURST):
+            idle += 1
+            continue
+        keys = [_user_key(user_id), ACTIVE_USERS_KEY, ROTATION_KEY]
+        raw  = _pop(keys=keys, args=[user_id])
+        if raw is None:
+            continue   # saiu da rotação
+        try:
+            send(json.loads(raw))
+        except Exception:
+            _requeue(keys=keys, args=[user_id, raw])
+            raise
+        sent += 1
+        room -= 1
+        idle = 0
+    return sent
+
+
+def dispatcher(send, on_error=None):
+    """Ciclo para uma thread daemon."""
+    while True:
+        try:
+            if dispatch_once(send) == 0:
+                time.sleep(FAIR_DISPATCH_INTERVAL)
+        except Exception as e:
+            if on_error:
+                on_error(e)
+            time.sleep(FAIR_DISPATCH_INTERVAL)
+
+
+def fair_queue_stats():
+    """Jobs ainda nas filas por utilizador (antes da fila Celery "batch")."""
+    users = [u.decode() for u in redis_client.smembers(ACTIVE_USERS_KEY)]
+    pipe = redis_client.pipeline(transaction=False)
+    for user_id in users:
+        pipe.llen(_user_key(user_id))
+    pending = dict(zip(users, pipe.execute()))
+    return {"users": len(users), "pending": sum(pending.values()), "per_user": pending}
@@ -0,0 +1,85 @@
+"""
+Imagens Docker no nó do backend: pré-aquecimento do catálogo
+(AVAILABLE_IMAGES em main.py), estado de cada imagem e espaço ocupado.
+
+O pré-aquecimento faz pull (ou atualização) das imagens do catálogo antes
+de alguém as pedir, para o primeiro container de ml:latest não esperar
+minutos pelo download. A remoção por LRU das imagens de /build-image
+acima do orçamento de disco usa a tabela built_images e está em main.py
+(evict_built_images).
+"""
+import threading
+import time
+from datetime import datetime, timezone
+
+import docker
+
+import image_pull
+
+# Último pré-aquecimento de cada imagem: {"at": epoch, "error": str | None}
+_prewarmed = {}
+_lock      = threading.Lock()
+
+
+def prewarm(client, image_tag):
+    """Pull/atualização de uma imagem; uma falha fica registada e não se propaga."""
+    error = None
+    try:
+        image_pull.ensure_image(client, image_tag, refresh=True)
+    except docker.errors.DockerException as e:
+        # ex.: imagens construídas localmente (datasci, ml) sem registo de
+        # onde fazer pull; se já estiverem no nó, continuam a servir
+        error = str(e)
+    with _lock:
+        _prewarmed[image_tag] = {"at": time.time(), "error": error}
+    return error is None
+
+
+def _parse_time(value):
+    """Datas do Docker (RFC 3339 com nanossegundos) em epoch."""
+    if not value or value.startswith("0001-"):
+        return None
+    value = value.rstrip("Z").split(".")[0]
+    return datetime.fromisoformat(value).replace(tzinfo=timezone.utc).timestamp()
+
+
+def image_status(client, image_tag):
+    """Presença, tamanho e idade de uma imagem, e o último pré-aquecimento."""
+    status = {"tag": image_tag, "present": False, "size_bytes": None,
+              "created_at": None, "pulled_at": None, "age_seconds": None}
+    try:
+        attrs = client.images.get(image_tag).attrs
+    except docker.errors.ImageNotFound:
+        attrs = None
+    if attrs:
+        created = _parse_time(attrs.get("Created"))
+        pulled  = _parse_time((attrs.get("Metadata") or {}).get("LastTagTime"))
+        status.update(
+            present=True,
+            size_bytes=attrs.get("Size"),
+            created_at=created,
+            pulled_at=pulled,
+            age_seconds=round(time.time() - (pulled or created)) if (pulled or created) else None,
+        )
+    with _lock:
+        last = _prewarmed.get(image_tag)
+    status["prewarmed_at"]  = last["at"] if last else None
+    status["prewarm_error"] = last["error"] if last else None
+    return status
+
+
+def disk_usage(client):
+    """Bytes ocupados pelas camadas de todas as imagens (sem contar partilhas duas vezes)."""
+    return client.df().get("LayersSize") or 0
+
+
+def remove_image(client, image_tag):
+    """
+    Remove a imagem (sem force: se um container, mesmo parado, ainda a
+    usa, o Docker recusa com APIError). Devolve False se já não existia.
+    """
+    try:
+        client.images.remove(image_tag)
+    except docker.errors.ImageNotFound:
+        return False
+    return True
@@ -0,0 +1,54 @@
+"""
+Pull de imagens Docker com progresso, para o provisionamento assíncrono
+de containers (ver provision_container em main.py).
+
+O pull é feito pela API de baixo nível em streaming: cada evento traz o
+progresso de uma camada (bytes descarregados / total) e a soma das
+camadas dá a percentagem da imagem. Pulls simultâneos da mesma imagem
+(vários utilizadores a criar containers de ml:latest ao mesmo tempo)
+esperam pelo primeiro em vez de a descarregarem outra vez.
+"""
+import threading
+
+import docker
+
+_locks      = {}
+_locks_lock = threading.Lock()
+
+# Estados de uma camada que já não vai descarregar mais nada
+LAYER_DONE = ("Download complete", "Pull complete", "Already exists")
+
+
+def _image_lock(image_tag):
+    with _locks_lock:
+        return _locks.setdefault(image_tag, threading.Lock())
+
+
+def ensure_image(client, image_tag, on_progress=None, refresh=False):
+    """
+    Garante que `image_tag` existe localmente, fazendo pull se preciso
+    (ou sempre, com refresh=True: só descarrega as camadas que mudaram).
+    `on_progress(done, total)` é chamado a cada evento com os bytes das
+    camadas conhecidas até aí. Levanta docker.errors.APIError se falhar.
+    """
+    with _image_lock(image_tag):
+        if not refresh:
+            try:
+                client.images.get(image_tag)
+                return
+            except docker.errors.ImageNotFound:
+                pass
+
+        repository, tag = docker.utils.parse_repository_tag(image_tag)
+        layers = {}   # id da camada -> [descarregado, total]
+        for event in client.api.pull(repository, tag=tag or "latest", stream=True, decode=True):
+            if "error" in event:
+                raise docker.errors.APIError(event["error"])
+            layer  = event.get("id")
+            detail = event.get("progressDetail") or {}
+            if event.get("status") == "Downloading" and detail.get("total"):
+                layers[layer] = [detail.get("current", 0), detail["total"]]
+            elif event.get("status") in LAYER_DONE and layer in layers:
+                layers[layer][0] = layers[layer][1]
+            if on_progress:
+                on_progress(sum(d for d, _ in layers.values()), sum(t for _, t in layers.values()))
@@ -0,0 +1,67 @@
+import json
+import os
+import time
+
+import redis
+
+# Eventos de conclusão de jobs, via Redis:
+#   - job-done:<job_id>   chave com o último evento (consultas em O(1))
+#   - job-events:<job_id> canal pub/sub para quem está à espera
+REDIS_URL         = os.environ.get("REDIS_URL", "redis://redis:6379/0")
+EVENT_TTL_SECONDS = 7 * 24 * 3600
+
+redis_client = redis.Redis.from_url(REDIS_URL)
+
+
+def _key(job_id: str) -> str:
+    return f"job-done:{job_id}"
+
+
+def _channel(job_id: str) -> str:
+    return f"job-events:{job_id}"
+
+
+def publish_job_done(job_id: str, output_path: str, status: str = "done", usage: dict = None):
+    """Chamado pelo worker quando o output final já está gravado."""
+    event = json.dumps({"job_id": job_id, "status": status, "output_path": output_path, "usage": usage})
+    pipe = redis_client.pipeline()
+    pipe.set(_key(job_id), event, ex=EVENT_TTL_SECONDS)
+    pipe.publish(_channel(job_id), event)
+    pipe.execute()
+
+
+def get_job_event(job_id: str):
+    """Evento de conclusão do job, ou None se ainda não terminou."""
+    try:
+        raw = redis_client.get(_key(job_id))
+    except redis.exceptions.RedisError:
+        return None
+    return json.loads(raw) if raw else None
+
+
+def wait_for_job(job_id: str, timeout: float):
+    """
+    Espera até `timeout` segundos pelo evento de conclusão do job.
+    Subscreve antes de consultar a chave para não perder um evento
+    publicado entre as duas operações.
+    """
+    try:
+        pubsub = redis_client.pubsub(ignore_subscribe_messages=True)
+        pubsub.subscribe(_channel(job_id))
+    except redis.exceptions.RedisError:
+        return None
+    try:
+        event = get_job_event(job_id)
+        deadline = time.monotonic() + timeout
+        while event is None:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            message = pubsub.get_message(timeout=remaining)
+            if message and message["type"] == "message":
+                event = json.loads(message["data"])
+        return event
+    except redis.exceptions.RedisError:
+        return None
+    finally:
+        pubsub.close()
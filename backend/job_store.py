@@ -0,0 +1,56 @@
+import json
+import os
+from datetime import datetime
+
+from sqlalchemy import create_engine, text
+
+# Atualizações da tabela `jobs` (modelo Job em main.py) feitas pelo worker
+DATABASE_URI = os.environ.get("SQLALCHEMY_DATABASE_URI", "sqlite:///mycloud.db")
+
+_engine = None
+_engine_pid = None
+
+
+def get_engine():
+    """Engine por processo (os workers Celery fazem fork após o import)."""
+    global _engine, _engine_pid
+    if _engine is None or _engine_pid != os.getpid():
+        _engine = create_engine(DATABASE_URI, pool_pre_ping=True)
+        _engine_pid = os.getpid()
+    return _engine
+
+
+def mark_job_running(job_id: str):
+    with get_engine().begin() as conn:
+        conn.execute(
+            text("UPDATE jobs SET status = 'running', started_at = :now WHERE id = :id"),
+            {"now": datetime.utcnow(), "id": job_id}
+        )
+
+
+def mark_job_finished(job_id: str, status: str, exit_code, output_size: int, output_path: str,
+                      usage: dict = None, trace: dict = None):
+    """
+    `usage`: tempo de CPU e pico de memória medidos pelo executor.
+    `trace`: instantes e durações das fases do job (ver job_trace em tasks.py).
+    """
+    usage = usage or {}
+    with get_engine().begin() as conn:
+        conn.execute(
+            text(
+                "UPDATE jobs SET status = :status, finished_at = :now, exit_code = :exit_code, "
+                "output_size = :output_size, output_path = :output_path, "
+                "cpu_time_ms = :cpu_time_ms, peak_memory = :peak_memory, trace = :trace WHERE id = :id"
+            ),
+            {
+                "status":      status,
+                "now":         datetime.utcnow(),
+                "exit_code":   exit_code,
+                "output_size": output_size,
+                "output_path": output_path,
+                "cpu_time_ms": usage.get("cpu_ms"),
+                "peak_memory": usage.get("peak_memory_bytes"),
+                "trace":       json.dumps(trace) if trace else None,
+                "id":          job_id,
+            }
+        )
@@ -1,12 +1,20 @@
 import os
+import hashlib
+import hmac
+import io
+import json
 import shutil
+import threading
+import time
 import uuid
-from datetime import datetime
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
 from werkzeug.utils import secure_filename
 from werkzeug.security import generate_password_hash, check_password_hash
 from flask import (
-    Flask, request, jsonify, send_from_directory, render_template,
-    redirect, url_for, flash
+    Flask, request, jsonify, send_file, send_from_directory, render_template,
+    redirect, url_for, flash, Response, stream_with_context
 )
 from flask_sqlalchemy import SQLAlchemy
 from flask_cors import CORS
@@ -14,21 +22,42 @@ from flask_login import (
     LoginManager, UserMixin, login_user, login_required,
     logout_user, current_user
 )
-from sqlalchemy import create_engine, text
+from sqlalchemy import create_engine, inspect, text
+from itsdangerous import BadSignature, URLSafeSerializer
 import docker
+import redis
+
+import blob_store
+import build_logs
+import container_state
+import executor_client
+import job_events
+import fair_queue
+import image_cache
+import image_pull
+import prometheus
+import result_cache
+from container_pool import ContainerPool
+from engine_cache import EngineCache
 
 # ==================================================
 # 1) Tentar importar execute_script de tasks.py
 #    Se não existir, criamos um stub que não faz nada.
 # ==================================================
 try:
-    from tasks import execute_script
+    from tasks import execute_script, execute_suite, job_state
 except ImportError:
     class DummyTask:
         @staticmethod
         def delay(*args, **kwargs):
             return
+
+        @staticmethod
+        def apply_async(*args, **kwargs):
+            return
     execute_script = DummyTask
+    execute_suite  = DummyTask
+    job_state      = lambda job_id: None
 
 # --------------------
 # Configurações Iniciais
@@ -48,14 +77,87 @@ app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 app.config['UPLOAD_FOLDER'] = 'uploads'
 app.config['JOB_FOLDER']    = 'jobs'
 app.config['CONTAINER_FOLDER'] = 'containers'
+app.config['PARTIAL_FOLDER']   = os.path.join('uploads', '.partial')
 
 # Limite de armazenamento padrão (100 MB / usuário)
 STORAGE_LIMIT_BYTES = 100 * 1024 * 1024
 
+# Plano do utilizador pelo armazenamento contratado (MB); define também os
+# limites de CPU/memória dos jobs no executor (executor/limits.py)
+STORAGE_PLANS = {150: 'basic', 300: 'standard', 500: 'premium'}
+
+# Intervalo (s) da reconciliação de User.storage_used com o disco
+USAGE_RECONCILE_INTERVAL = int(os.getenv('USAGE_RECONCILE_INTERVAL', '3600'))
+
+# Credencial partilhada com os executores para GET /blobs/<digest>
+# (cabeçalho X-Blob-Token); sem ela definida a rota fica desligada
+BLOB_FETCH_TOKEN = os.getenv('BLOB_FETCH_TOKEN', '')
+
+# Extensão do script -> linguagem do executor
+SCRIPT_LANGUAGES = {
+    '.py':   'python',
+    '.cpp':  'cpp',
+    '.js':   'js',
+    '.rs':   'rust',
+    '.java':'java'
+}
+
+# /submit-batch: máximo de scripts por lote e de bytes extraídos do zip
+BATCH_MAX_JOBS  = int(os.getenv('BATCH_MAX_JOBS', '5000'))
+BATCH_MAX_BYTES = int(os.getenv('BATCH_MAX_BYTES', str(100 * 1024 * 1024)))
+
+# /submit-suite: máximo de inputs por job
+SUITE_MAX_INPUTS = int(os.getenv('SUITE_MAX_INPUTS', '200'))
+
+# /db-query: linhas por página (JSON) e por resposta em streaming (NDJSON),
+# linhas lidas do cursor de cada vez e tempo máximo de um comando
+DB_QUERY_MAX_ROWS        = int(os.getenv('DB_QUERY_MAX_ROWS', '1000'))
+DB_QUERY_STREAM_MAX_ROWS = int(os.getenv('DB_QUERY_STREAM_MAX_ROWS', '1000000'))
+DB_QUERY_FETCH_SIZE      = 500
+DB_QUERY_TIMEOUT_MS = int(os.getenv('DB_QUERY_TIMEOUT_MS', '30000'))
+
+# Uploads em partes (/uploads): tamanho sugerido de cada parte e validade
+# de uma sessão sem atividade antes de ser descartada
+UPLOAD_CHUNK_SIZE  = 8 * 1024 * 1024
+UPLOAD_SESSION_TTL = int(os.getenv('UPLOAD_SESSION_TTL', str(24 * 3600)))
+
+# Espera máxima em /job-result?wait=N e duração de uma ligação /job-events
+JOB_RESULT_MAX_WAIT  = 30
+JOB_EVENTS_TIMEOUT   = 300
+JOB_EVENTS_HEARTBEAT = 15
+
+# Containers criados em background: pulls/arranques em simultâneo e
+# intervalo mínimo (s) entre atualizações do progresso do pull
+CONTAINER_PROVISION_WORKERS = int(os.getenv('CONTAINER_PROVISION_WORKERS', '4'))
+CONTAINER_PROGRESS_INTERVAL = 1.0
+
+# Pré-aquecimento das imagens de AVAILABLE_IMAGES (no arranque e a cada
+# IMAGE_PREWARM_INTERVAL s) e orçamento de disco das imagens: acima dele
+# as imagens de /build-image usadas há mais tempo são removidas
+IMAGE_PREWARM_INTERVAL = int(os.getenv('IMAGE_PREWARM_INTERVAL', str(6 * 3600)))
+IMAGE_DISK_BUDGET_MB   = int(os.getenv('IMAGE_DISK_BUDGET_MB', '20480'))
+
+# Builds de /build-image em background (em simultâneo) e duração máxima
+# de uma ligação a /builds/<build_id>/logs
+IMAGE_BUILD_WORKERS = int(os.getenv('IMAGE_BUILD_WORKERS', '2'))
+BUILD_LOGS_TIMEOUT  = 1800
+
+# Estado dos containers: o container_reconciler segue os eventos do Docker
+# e o container_stats_sampler faz um resync completo e lê CPU/memória dos
+# containers a correr a cada CONTAINER_STATS_INTERVAL s (0 desliga ambos)
+CONTAINER_STATS_INTERVAL    = int(os.getenv('CONTAINER_STATS_INTERVAL', '30'))
+CONTAINER_EVENTS_RETRY      = 5
+
+# Paginação de /jobs/<username> e tamanho da pré-visualização do output
+JOBS_PAGE_SIZE      = 20
+JOBS_PAGE_MAX       = 100
+JOB_OUTPUT_PREVIEW  = 2000
+
 # Criar pastas iniciais se não existirem
 os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
 os.makedirs(app.config['JOB_FOLDER'], exist_ok=True)
 os.makedirs(app.config['CONTAINER_FOLDER'], exist_ok=True)
+os.makedirs(app.config['PARTIAL_FOLDER'], exist_ok=True)
 
 # Instância do SQLAlchemy
 db = SQLAlchemy(app)
@@ -66,6 +168,15 @@ PG_ADMIN_URL = os.getenv(
 )
 admin_engine = create_engine(PG_ADMIN_URL, isolation_level="AUTOCOMMIT")
 
+# Engines das bases dos utilizadores (/db-query), reutilizados entre pedidos;
+# o statement_timeout limita cada comando do lado do Postgres
+user_engines = EngineCache(connect_args={
+    'options': f'-c statement_timeout={DB_QUERY_TIMEOUT_MS}'
+})
+
+# page_token de /db-query: offset assinado, ligado à base e à query
+db_query_tokens = URLSafeSerializer(app.secret_key, salt='db-query-page')
+
 # Flask-Login
 login_manager = LoginManager()
 login_manager.init_app(app)
@@ -74,6 +185,24 @@ login_manager.login_view = 'index'
 # Docker Client (global)
 docker_client = docker.DockerClient(base_url='unix://var/run/docker.sock')
 
+# Pull da imagem e arranque dos containers, fora dos pedidos HTTP
+container_provisioner = ThreadPoolExecutor(
+    max_workers=CONTAINER_PROVISION_WORKERS, thread_name_prefix='provision'
+)
+
+# docker build de /build-image, fora dos pedidos HTTP
+image_builder = ThreadPoolExecutor(
+    max_workers=IMAGE_BUILD_WORKERS, thread_name_prefix='build'
+)
+
+# Containers pausados, prontos para os comandos de /run-job (ver container_pool.py)
+RUN_JOB_VOLUMES = {"/tmp/jobs": {"bind": "/jobs", "mode": "rw"}}
+run_job_pool    = ContainerPool(docker_client, create_kwargs={'volumes': RUN_JOB_VOLUMES})
+# Comandos de /run-job a correr nos containers do pool (um por container em uso)
+run_job_runner  = ThreadPoolExecutor(
+    max_workers=run_job_pool.max_containers, thread_name_prefix='run-job'
+)
+
 # --------------------
 # Modelos
 # --------------------
@@ -83,6 +212,12 @@ class User(UserMixin, db.Model):
     username      = db.Column(db.String(80), unique=True, nullable=False)
     password      = db.Column(db.String(120), nullable=False)
     storage_limit = db.Column(db.Integer, default=STORAGE_LIMIT_BYTES)
+    # Bytes em uploads/<username>, mantido a cada upload/remoção
+    storage_used  = db.Column(db.BigInteger, nullable=False, default=0, server_default='0')
+
+    @property
+    def plan(self):
+        return STORAGE_PLANS.get((self.storage_limit or 0) // (1024 * 1024), 'free')
 
 class Container(db.Model):
     __tablename__ = 'containers'
@@ -91,11 +226,176 @@ class Container(db.Model):
     image_name      = db.Column(db.String(128), nullable=False)
     container_name  = db.Column(db.String(128), nullable=False)
     run_command     = db.Column(db.String(256), nullable=True)
+    # BUILDING -> PULLING -> STARTING -> RUNNING | ERROR (ver provision_container)
     status          = db.Column(db.String(32), nullable=False, default="PENDING")
     created_at      = db.Column(db.DateTime, default=datetime.utcnow)
+    # Ficheiro do utilizador montado em /app/input (só leitura)
+    input_path      = db.Column(db.String(512), nullable=True)
+    # Progresso do pull (%) e fase atual ou mensagem de erro
+    progress        = db.Column(db.Integer, nullable=True)
+    status_detail   = db.Column(db.String(512), nullable=True)
+    # Mantidos pelo container_reconciler (eventos do Docker) e pelo
+    # container_stats_sampler: as listagens não chamam o Docker
+    docker_id       = db.Column(db.String(64), nullable=True)
+    exit_code       = db.Column(db.Integer, nullable=True)
+    cpu_percent     = db.Column(db.Float, nullable=True)
+    memory_bytes    = db.Column(db.BigInteger, nullable=True)
+    synced_at       = db.Column(db.DateTime, nullable=True)
 
     user = db.relationship('User', backref=db.backref('containers', lazy=True))
 
+    def to_dict(self):
+        return {
+            'id':             self.id,
+            'image':          self.image_name,
+            'container_name': self.container_name,
+            'status':         self.status,
+            'progress':       self.progress,
+            'detail':         self.status_detail,
+            'exit_code':      self.exit_code,
+            'cpu_percent':    self.cpu_percent,
+            'memory_bytes':   self.memory_bytes,
+            'synced_at':      self.synced_at.isoformat() if self.synced_at else None,
+        }
+
+class BuiltImage(db.Model):
+    """Imagem criada por /build-image (candidata à remoção por LRU)."""
+    __tablename__ = 'built_images'
+    id            = db.Column(db.Integer, primary_key=True)
+    user_id       = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False, index=True)
+    tag           = db.Column(db.String(256), unique=True, nullable=False)
+    size_bytes    = db.Column(db.BigInteger, nullable=True)
+    created_at    = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    # Último container criado com a imagem (ou o build)
+    last_used_at  = db.Column(db.DateTime, default=datetime.utcnow, nullable=False, index=True)
+
+    def to_dict(self):
+        return {
+            'tag':          self.tag,
+            'size_bytes':   self.size_bytes,
+            'created_at':   self.created_at.isoformat(),
+            'last_used_at': self.last_used_at.isoformat(),
+        }
+
+class ImageBuild(db.Model):
+    """Build de /build-image: queued -> building -> succeeded | failed."""
+    __tablename__   = 'image_builds'
+    id              = db.Column(db.String(32), primary_key=True)
+    user_id         = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False, index=True)
+    image_tag       = db.Column(db.String(256), nullable=False)
+    dockerfile      = db.Column(db.Text, nullable=False)
+    # sha256 do Dockerfile: builds iguais reutilizam a imagem já construída
+    dockerfile_hash = db.Column(db.String(64), nullable=False, index=True)
+    status          = db.Column(db.String(16), nullable=False, default='queued')
+    image_id        = db.Column(db.String(80), nullable=True)
+    # Build de onde veio a imagem, quando o Dockerfile já tinha sido construído
+    reused_from     = db.Column(db.String(32), nullable=True)
+    error           = db.Column(db.Text, nullable=True)
+    created_at      = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    finished_at     = db.Column(db.DateTime, nullable=True)
+
+    def to_dict(self):
+        return {
+            'build_id':    self.id,
+            'image':       self.image_tag,
+            'status':      self.status,
+            'image_id':    self.image_id,
+            'reused_from': self.reused_from,
+            'error':       self.error,
+            'created_at':  self.created_at.isoformat(),
+            'finished_at': self.finished_at.isoformat() if self.finished_at else None,
+        }
+
+class UploadSession(db.Model):
+    """Upload em partes; o ficheiro cresce em PARTIAL_FOLDER/<id> até ser concluído."""
+    __tablename__ = 'upload_sessions'
+    id          = db.Column(db.String(36), primary_key=True)
+    user_id     = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False, index=True)
+    filename    = db.Column(db.String(256), nullable=False)
+    total_size  = db.Column(db.BigInteger, nullable=False)   # reservado na quota
+    received    = db.Column(db.BigInteger, nullable=False, default=0)
+    sha256      = db.Column(db.String(64), nullable=True)
+    updated_at  = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+
+    def partial_path(self):
+        return os.path.join(app.config['PARTIAL_FOLDER'], self.id)
+
+    def to_dict(self):
+        return {
+            'upload_id':  self.id,
+            'filename':   self.filename,
+            'size':       self.total_size,
+            'received':   self.received,
+            'chunk_size': UPLOAD_CHUNK_SIZE,
+        }
+
+class JobBatch(db.Model):
+    """Conjunto de jobs submetidos num só pedido (/submit-batch)."""
+    __tablename__ = 'job_batches'
+    id          = db.Column(db.String(36), primary_key=True)
+    user_id     = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False, index=True)
+    total       = db.Column(db.Integer, nullable=False)
+    created_at  = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+
+class Job(db.Model):
+    """Metadados de um job de script (o output fica em output_path)."""
+    __tablename__ = 'jobs'
+    id            = db.Column(db.String(36), primary_key=True)   # job_id (uuid)
+    user_id       = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False, index=True)
+    script_name   = db.Column(db.String(256), nullable=False)
+    language      = db.Column(db.String(16), nullable=False)
+    # queued -> running -> succeeded | failed | timeout
+    status        = db.Column(db.String(16), nullable=False, default='queued')
+    created_at    = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    started_at    = db.Column(db.DateTime, nullable=True)
+    finished_at   = db.Column(db.DateTime, nullable=True)
+    exit_code     = db.Column(db.Integer, nullable=True)
+    output_size   = db.Column(db.BigInteger, nullable=True)
+    output_path   = db.Column(db.String(512), nullable=True)
+    batch_id      = db.Column(db.String(36), db.ForeignKey('job_batches.id'), nullable=True, index=True)
+    # script: um input, output em texto | suite: vários inputs, output em JSON
+    kind          = db.Column(db.String(16), nullable=False, default='script', server_default='script')
+    # sha256 do script e do input no blob store (ver blob_store.py)
+    script_digest = db.Column(db.String(64), nullable=True)
+    input_digest  = db.Column(db.String(64), nullable=True)
+    # Classe de prioridade / fila Celery: interactive | batch
+    priority      = db.Column(db.String(16), nullable=False, default='interactive', server_default='interactive')
+    # Resultado servido pela cache de resultados (ver result_cache.py)
+    cached        = db.Column(db.Boolean, nullable=False, default=False, server_default=db.text('false'))
+    # Tempo de CPU e pico de memória (bytes) medidos pelo executor; numa
+    # suite, a soma do CPU e o máximo da memória dos casos
+    cpu_time_ms   = db.Column(db.Float, nullable=True)
+    peak_memory   = db.Column(db.BigInteger, nullable=True)
+    # JSON com os instantes e durações das fases do job (ver /job-trace)
+    trace         = db.Column(db.Text, nullable=True)
+
+    # Listagem paginada do histórico de um utilizador; contagens por fila
+    # e estado e esperas recentes (/metrics e /metrics/queues, a cada scrape)
+    __table_args__ = (
+        db.Index('ix_jobs_user_created', 'user_id', 'created_at', 'id'),
+        db.Index('ix_jobs_priority_status_created', 'priority', 'status', 'created_at'),
+        db.Index('ix_jobs_priority_started', 'priority', 'started_at'),
+    )
+
+    def to_dict(self):
+        return {
+            'job_id':      self.id,
+            'job':         self.script_name,
+            'language':    self.language,
+            'status':      self.status,
+            'created_at':  self.created_at.isoformat() if self.created_at else None,
+            'started_at':  self.started_at.isoformat() if self.started_at else None,
+            'finished_at': self.finished_at.isoformat() if self.finished_at else None,
+            'exit_code':   self.exit_code,
+            'output_size': self.output_size,
+            'batch_id':    self.batch_id,
+            'kind':        self.kind,
+            'priority':    self.priority,
+            'cached':      self.cached,
+            'cpu_time_ms': self.cpu_time_ms,
+            'peak_memory': self.peak_memory,
+        }
+
 # Bundles pré-construídos
 AVAILABLE_IMAGES = [
     {'tag': 'python:3.9-slim', 'description': 'Python 3.9-Slim'},
@@ -104,9 +404,44 @@ AVAILABLE_IMAGES = [
 ]
 
 
+def add_missing_columns():
+    """
+    O create_all() não altera tabelas já existentes: acrescenta aqui as
+    colunas novas dos modelos a bases de dados criadas antes delas.
+    """
+    inspector = inspect(db.engine)
+    for table in db.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        existing = {col['name'] for col in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in existing:
+                continue
+            ddl = f'ALTER TABLE {table.name} ADD COLUMN {column.name} {column.type.compile(db.engine.dialect)}'
+            if column.server_default is not None:
+                ddl += f" DEFAULT {column.server_default.arg}"
+            with db.engine.begin() as conn:
+                conn.execute(text(ddl))
+
+def add_missing_indexes():
+    """
+    Tal como as colunas, os índices novos (db.Index e index=True) não são
+    criados pelo create_all() em tabelas que já existiam.
+    """
+    inspector = inspect(db.engine)
+    for table in db.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        existing = {ix['name'] for ix in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name not in existing:
+                index.create(bind=db.engine)
+
 # Criar tabelas (se ainda não existirem)
 with app.app_context():
     db.create_all()
+    add_missing_columns()
+    add_missing_indexes()
 
 # --------------------
 # Loader do Flask-Login
@@ -188,12 +523,109 @@ def dashboard():
         available_images=AVAILABLE_IMAGES
     )
 
+# --------------------
+# Contabilização de Armazenamento
+# --------------------
+def folder_size(path):
+    return sum(
+        os.path.getsize(os.path.join(root, f))
+        for root, _, files in os.walk(path)
+        for f in files
+    )
+
+def reserve_storage(user, nbytes):
+    """
+    Soma `nbytes` a storage_used se couber no limite do utilizador.
+    A verificação e o incremento são um só UPDATE, por isso uploads
+    concorrentes não ultrapassam o limite.
+    """
+    if nbytes <= 0:
+        release_storage(user, -nbytes)
+        return True
+    updated = User.query.filter(
+        User.id == user.id,
+        User.storage_used + nbytes <= User.storage_limit
+    ).update({User.storage_used: User.storage_used + nbytes}, synchronize_session=False)
+    db.session.commit()
+    return updated == 1
+
+def release_storage(user, nbytes):
+    User.query.filter(User.id == user.id).update(
+        {User.storage_used: db.case(
+            (User.storage_used > nbytes, User.storage_used - nbytes), else_=0
+        )},
+        synchronize_session=False
+    )
+    db.session.commit()
+
+def expire_upload_sessions():
+    """Descarta uploads em partes abandonados e liberta a quota reservada."""
+    cutoff = datetime.utcfromtimestamp(time.time() - UPLOAD_SESSION_TTL)
+    for session in UploadSession.query.filter(UploadSession.updated_at < cutoff).all():
+        if os.path.exists(session.partial_path()):
+            os.remove(session.partial_path())
+        db.session.delete(session)
+    db.session.commit()
+
+def expire_run_job_outputs():
+    """Apaga os outputs de /run-job cujo estado já expirou no Redis."""
+    folder = os.path.join(app.config['JOB_FOLDER'], '_run-jobs')
+    cutoff = time.time() - job_events.EVENT_TTL_SECONDS
+    for entry in os.scandir(folder) if os.path.isdir(folder) else ():
+        if entry.stat().st_mtime < cutoff:
+            os.remove(entry.path)
+
+def expire_blobs():
+    """Apaga do blob store o que não é enviado há BLOB_TTL e nenhum job por terminar usa."""
+    keep = set()
+    for script_digest, input_digest in db.session.query(Job.script_digest, Job.input_digest) \
+            .filter(Job.status.in_(('queued', 'running'))):
+        keep.update(d for d in (script_digest, input_digest) if d)
+    removed, freed = blob_store.collect_garbage(keep)
+    if removed:
+        app.logger.info("blob store: %d blobs expirados (%d bytes)", removed, freed)
+
+def reconcile_storage_usage():
+    """Recalcula storage_used a partir do disco e corrige desvios."""
+    expire_upload_sessions()
+    expire_run_job_outputs()
+    expire_blobs()
+    for user in User.query.all():
+        # Uploads em partes ainda por concluir mantêm a sua reserva
+        reserved = db.session.query(
+            db.func.coalesce(db.func.sum(UploadSession.total_size), 0)
+        ).filter(UploadSession.user_id == user.id).scalar()
+        actual = folder_size(os.path.join(app.config['UPLOAD_FOLDER'], user.username)) + reserved
+        if actual != user.storage_used:
+            app.logger.info(
+                "storage_used de %s corrigido: %d -> %d", user.username, user.storage_used, actual
+            )
+            user.storage_used = actual
+    db.session.commit()
+
+def storage_reconciler():
+    while True:
+        time.sleep(USAGE_RECONCILE_INTERVAL)
+        try:
+            with app.app_context():
+                reconcile_storage_usage()
+        except Exception:
+            app.logger.exception("Falha na reconciliação de armazenamento")
+
 # --------------------
 # Upload / Listagem / Download de Arquivos
 # --------------------
 @app.route('/upload', methods=['POST'])
 def upload_file():
-    username = request.form.get('username', '').strip()
+    # Com ?username= na URL a quota é verificada antes de o Werkzeug ler
+    # o corpo (o que acontece no primeiro acesso a request.form/files)
+    early_user = User.query.filter_by(username=request.args.get('username', '').strip()).first()
+    if early_user and request.content_length and \
+            early_user.storage_used + request.content_length > early_user.storage_limit + 64 * 1024:
+        # margem para o envelope multipart; ficheiros grandes devem usar /uploads
+        return jsonify({'message': 'Limite de armazenamento excedido.'}), 403
+
+    username = request.form.get('username', '').strip() or request.args.get('username', '').strip()
     if not username:
         return jsonify({'message': 'Usuário não especificado.'}), 400
 
@@ -208,20 +640,22 @@ def upload_file():
     user_folder = os.path.join(app.config['UPLOAD_FOLDER'], username)
     os.makedirs(user_folder, exist_ok=True)
 
-    total = sum(
-        os.path.getsize(os.path.join(root, f))
-        for root, _, files in os.walk(user_folder)
-        for f in files
-    )
-
     file.seek(0, os.SEEK_END)
     file_length = file.tell()
     file.seek(0)
 
-    if total + file_length > user.storage_limit:
+    # Substituir um ficheiro existente só conta a diferença de tamanho
+    file_path = os.path.join(user_folder, secure_filename(file.filename))
+    old_size  = os.path.getsize(file_path) if os.path.isfile(file_path) else 0
+
+    if not reserve_storage(user, file_length - old_size):
         return jsonify({'message': 'Limite de armazenamento excedido.'}), 403
 
-    file.save(os.path.join(user_folder, secure_filename(file.filename)))
+    try:
+        file.save(file_path)
+    except Exception:
+        release_storage(user, file_length - old_size)
+        raise
     return jsonify({'message': 'Arquivo enviado com sucesso.'}), 200
 
 @app.route('/files/<username>')
@@ -245,21 +679,170 @@ def get_usage(username):
     if not user:
         return jsonify({'used': 0, 'limit': 0})
 
-    user_folder = os.path.join(app.config['UPLOAD_FOLDER'], safe_username)
-    total = 0
-    if os.path.exists(user_folder):
-        total = sum(
-            os.path.getsize(os.path.join(root, f))
-            for root, _, files in os.walk(user_folder)
-            for f in files
-        )
-    return jsonify({'used': total, 'limit': user.storage_limit})
+    return jsonify({'used': user.storage_used, 'limit': user.storage_limit})
+
+# --------------------
+# Upload em Partes (retomável)
+# --------------------
+def get_upload_session(upload_id, username):
+    session = UploadSession.query.get(upload_id)
+    if not session:
+        return None
+    user = User.query.get(session.user_id)
+    return session if user and user.username == secure_filename(username) else None
+
+@app.route('/uploads', methods=['POST'])
+def create_upload():
+    """
+    Inicia um upload em partes: {username, filename, size, sha256?}.
+    O tamanho total é reservado na quota logo aqui.
+    """
+    data     = request.json or {}
+    username = secure_filename(data.get('username', '').strip())
+    filename = secure_filename(data.get('filename', '').strip())
+    sha256   = (data.get('sha256') or '').strip().lower() or None
+    try:
+        size = int(data.get('size'))
+    except (TypeError, ValueError):
+        size = -1
+    if not username or not filename or size < 0:
+        return jsonify({'message': 'Dados insuficientes.'}), 400
+
+    user = User.query.filter_by(username=username).first()
+    if not user:
+        return jsonify({'message': 'Usuário não encontrado.'}), 404
+
+    if not reserve_storage(user, size):
+        return jsonify({'message': 'Limite de armazenamento excedido.'}), 403
+
+    session = UploadSession(
+        id=str(uuid.uuid4()),
+        user_id=user.id,
+        filename=filename,
+        total_size=size,
+        received=0,
+        sha256=sha256
+    )
+    db.session.add(session)
+    db.session.commit()
+    open(session.partial_path(), 'wb').close()
+    return jsonify(session.to_dict()), 201
+
+@app.route('/uploads/<upload_id>', methods=['GET'])
+def upload_status(upload_id):
+    """Offset a partir do qual o cliente deve retomar."""
+    session = get_upload_session(upload_id, request.args.get('username', ''))
+    if not session:
+        return jsonify({'message': 'Upload não encontrado.'}), 404
+    return jsonify(session.to_dict())
+
+@app.route('/uploads/<upload_id>', methods=['PUT'])
+def upload_chunk(upload_id):
+    """
+    Recebe uma parte no corpo do pedido: ?username=...&offset=N.
+    O corpo é escrito em disco à medida que chega, sem passar do
+    tamanho reservado.
+    """
+    session = get_upload_session(upload_id, request.args.get('username', ''))
+    if not session:
+        return jsonify({'message': 'Upload não encontrado.'}), 404
+
+    try:
+        offset = int(request.args.get('offset', session.received))
+    except ValueError:
+        return jsonify({'message': 'Offset inválido.'}), 400
+    if offset != session.received:
+        # ex.: a resposta a uma parte anterior perdeu-se; o cliente retoma daqui
+        return jsonify({'message': 'Offset incorreto.', **session.to_dict()}), 409
+
+    remaining = session.total_size - offset
+    if request.content_length is not None and request.content_length > remaining:
+        return jsonify({'message': 'Parte excede o tamanho declarado.', **session.to_dict()}), 413
+
+    written = 0
+    with open(session.partial_path(), 'r+b') as f:
+        f.seek(offset)
+        f.truncate()
+        while True:
+            chunk = request.stream.read(64 * 1024)
+            if not chunk:
+                break
+            if written + len(chunk) > remaining:
+                f.truncate(offset)
+                return jsonify({'message': 'Parte excede o tamanho declarado.', **session.to_dict()}), 413
+            f.write(chunk)
+            written += len(chunk)
+
+    session.received   = offset + written
+    session.updated_at = datetime.utcnow()
+    db.session.commit()
+    return jsonify(session.to_dict())
+
+@app.route('/uploads/<upload_id>/complete', methods=['POST'])
+def complete_upload(upload_id):
+    """Verifica tamanho e sha256 e move o ficheiro para a pasta do utilizador."""
+    data    = request.json or {}
+    session = get_upload_session(upload_id, data.get('username', ''))
+    if not session:
+        return jsonify({'message': 'Upload não encontrado.'}), 404
+    if session.received != session.total_size:
+        return jsonify({'message': 'Upload incompleto.', **session.to_dict()}), 409
+
+    partial = session.partial_path()
+    if session.sha256:
+        digest = hashlib.sha256()
+        with open(partial, 'rb') as f:
+            for block in iter(lambda: f.read(1024 * 1024), b''):
+                digest.update(block)
+        if digest.hexdigest() != session.sha256:
+            # Recomeça do zero: a reserva mantém-se para a nova tentativa
+            open(partial, 'wb').close()
+            session.received = 0
+            db.session.commit()
+            return jsonify({'message': 'Checksum não confere.', **session.to_dict()}), 422
+
+    user        = User.query.get(session.user_id)
+    user_folder = os.path.join(app.config['UPLOAD_FOLDER'], user.username)
+    os.makedirs(user_folder, exist_ok=True)
+    file_path = os.path.join(user_folder, session.filename)
+    old_size  = os.path.getsize(file_path) if os.path.isfile(file_path) else 0
+    os.replace(partial, file_path)
+
+    db.session.delete(session)
+    db.session.commit()
+    if old_size:
+        release_storage(user, old_size)
+    return jsonify({'message': 'Arquivo enviado com sucesso.'}), 200
+
+@app.route('/uploads/<upload_id>', methods=['DELETE'])
+def abort_upload(upload_id):
+    session = get_upload_session(upload_id, request.args.get('username', ''))
+    if not session:
+        return jsonify({'message': 'Upload não encontrado.'}), 404
+    if os.path.exists(session.partial_path()):
+        os.remove(session.partial_path())
+    user = User.query.get(session.user_id)
+    db.session.delete(session)
+    db.session.commit()
+    release_storage(user, session.total_size)
+    return jsonify({'message': 'Upload cancelado.'}), 200
 
 # --------------------
 # Apagar Todos os Usuários / Diretórios
 # --------------------
 @app.route('/delete-all-users', methods=['DELETE'])
 def delete_all_users():
+    db.session.query(Job).delete()
+    db.session.query(JobBatch).delete()
+    db.session.query(UploadSession).delete()
+    # Imagens de /build-image saem com os donos (o LRU só conhece as que têm linha)
+    for image in BuiltImage.query.all():
+        try:
+            image_cache.remove_image(docker_client, image.tag)
+        except docker.errors.APIError as e:
+            app.logger.info("Imagem %s não removida: %s", image.tag, e)
+    db.session.query(BuiltImage).delete()
+    db.session.query(ImageBuild).delete()
     db.session.query(User).delete()
     db.session.commit()
 
@@ -270,6 +853,7 @@ def delete_all_users():
     os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
     os.makedirs(app.config['JOB_FOLDER'], exist_ok=True)
     os.makedirs(app.config['CONTAINER_FOLDER'], exist_ok=True)
+    os.makedirs(app.config['PARTIAL_FOLDER'], exist_ok=True)
 
     return jsonify({'message': 'Todos os usuários, uploads, jobs e containers foram apagados.'})
 
@@ -289,45 +873,493 @@ def submit_job():
     if not user:
         return jsonify({'message': 'Usuário não encontrado.'}), 404
 
-    host_job_folder = os.path.join(os.getcwd(), app.config['JOB_FOLDER'], username)
-    os.makedirs(host_job_folder, exist_ok=True)
+    if not fair_queue.allow_interactive(user.id):
+        return jsonify({'message': 'Demasiadas submissões; use /submit-batch para lotes.'}), 429, \
+            {'Retry-After': str(max(int(1 / fair_queue.INTERACTIVE_RATE), 1))}
 
     original_filename = secure_filename(job_file.filename)
-    script_path       = os.path.join(host_job_folder, original_filename)
-    job_file.save(script_path)
-
-    input_path = None
-    if input_file:
-        input_path = os.path.join(host_job_folder, secure_filename(input_file.filename))
-        input_file.save(input_path)
-
     _, ext = os.path.splitext(original_filename)
     ext = ext.lower()
-    supported_languages = {
-        '.py':   'python',
-        '.cpp':  'cpp',
-        '.js':   'js',
-        '.rs':   'rust',
-        '.java':'java'
-    }
-    if ext not in supported_languages:
+    if ext not in SCRIPT_LANGUAGES:
         return jsonify({'message': f'Extensão {ext} não suportada.'}), 400
-    language = supported_languages[ext]
+    language = SCRIPT_LANGUAGES[ext]
+
+    # Script e input vão para o blob store; o job leva só os digests
+    script_digest = blob_store.put_stream(job_file.stream)
+    input_digest  = blob_store.put_stream(input_file.stream) if input_file else None
+
+    host_job_folder = os.path.join(os.getcwd(), app.config['JOB_FOLDER'], username)
+    os.makedirs(host_job_folder, exist_ok=True)
+
+    # cache=1: o utilizador garante que o script é determinista; com o
+    # mesmo script, input e runtime o output guardado é devolvido já
+    use_cache = request.form.get('cache', '').lower() in ('1', 'true')
+    cached    = result_cache.lookup(language, user.plan, script_digest, input_digest) if use_cache else None
 
     job_id = str(uuid.uuid4())
-    execute_script.delay(
-        job_id=job_id,
-        script_path=script_path,
-        input_path=input_path,
-        language=language
+    job = Job(
+        id=job_id,
+        user_id=user.id,
+        script_name=original_filename,
+        language=language,
+        status='queued',
+        script_digest=script_digest,
+        input_digest=input_digest
     )
+    if cached:
+        return cached_job_response(job, cached, host_job_folder)
+
+    db.session.add(job)
+    db.session.commit()
+
+    # task_id = job_id: o estado fica no result backend (ver /job-status)
+    execute_script.apply_async(kwargs=dict(
+        job_id=job_id,
+        language=language,
+        output_dir=host_job_folder,
+        script_digest=script_digest,
+        input_digest=input_digest,
+        cache=use_cache,
+        plan=user.plan,
+        enqueued_at=time.time()
+    ), task_id=job_id)
+
+    return jsonify({
+        'message': 'Job enfileirado com sucesso!',
+        'job_id': job_id,
+        'status': 'queued'
+    }), 202
+
+def cached_job_response(job, cached, host_job_folder):
+    """Regista o job como terminado com o output da cache e devolve-o."""
+    out_path = os.path.join(host_job_folder, f"{job.id}.out.txt")
+    with open(out_path, 'wb') as f:
+        f.write(cached['output'])
+
+    now = datetime.utcnow()
+    job.status      = cached['status']
+    job.started_at  = now
+    job.finished_at = now
+    job.exit_code   = cached['exit_code']
+    job.output_size = len(cached['output'])
+    job.output_path = out_path
+    job.cached      = True
+    db.session.add(job)
+    db.session.commit()
+    job_events.publish_job_done(job.id, out_path, job.status)
+
+    return jsonify({
+        'message':   'Resultado em cache.',
+        'job_id':    job.id,
+        'status':    job.status,
+        'exit_code': job.exit_code,
+        'cached':    True,
+        'output':    cached['output'].decode(errors='replace')
+    }), 200
+
+@app.route('/submit-suite', methods=['POST'])
+def submit_suite():
+    """
+    Job de testes: um script (`job`) contra vários `inputs`. O executor
+    recebe o script uma vez, compila uma vez e devolve output, exit code
+    e duração de cada input (gravados em JSON como output do job).
+    """
+    username = request.form.get('username', '').strip()
+    job_file = request.files.get('job')
+    inputs   = request.files.getlist('inputs')
+
+    if not username or not job_file or not inputs:
+        return jsonify({'message': 'Dados insuficientes.'}), 400
+    if len(inputs) > SUITE_MAX_INPUTS:
+        return jsonify({'message': f'Máximo de {SUITE_MAX_INPUTS} inputs por job.'}), 400
+
+    user = User.query.filter_by(username=username).first()
+    if not user:
+        return jsonify({'message': 'Usuário não encontrado.'}), 404
+
+    original_filename = secure_filename(job_file.filename)
+    ext = os.path.splitext(original_filename)[1].lower()
+    if ext not in SCRIPT_LANGUAGES:
+        return jsonify({'message': f'Extensão {ext} não suportada.'}), 400
+    language = SCRIPT_LANGUAGES[ext]
+
+    job_id          = str(uuid.uuid4())
+    host_job_folder = os.path.join(os.getcwd(), app.config['JOB_FOLDER'], username)
+    os.makedirs(host_job_folder, exist_ok=True)
+
+    script_digest = blob_store.put_stream(job_file.stream)
+    # Prefixo com a posição: mantém a ordem mesmo com nomes repetidos;
+    # inputs iguais ficam um só blob
+    suite_inputs = [
+        [f"{i:04d}_{secure_filename(input_file.filename)}", blob_store.put_stream(input_file.stream)]
+        for i, input_file in enumerate(inputs)
+    ]
+
+    db.session.add(Job(
+        id=job_id,
+        user_id=user.id,
+        script_name=original_filename,
+        language=language,
+        status='queued',
+        kind='suite',
+        priority=fair_queue.BATCH_QUEUE,
+        script_digest=script_digest
+    ))
+    db.session.commit()
+
+    fair_queue.push_batch_jobs(user.id, [{
+        'task':   'execute_suite',
+        'kwargs': {
+            'job_id':        job_id,
+            'language':      language,
+            'output_dir':    host_job_folder,
+            'script_digest': script_digest,
+            'inputs':        suite_inputs,
+            'plan':          user.plan
+        }
+    }])
 
     return jsonify({
         'message': 'Job enfileirado com sucesso!',
         'job_id': job_id,
+        'inputs': len(suite_inputs),
         'status': 'queued'
     }), 202
 
+def batch_entries(files, archive):
+    """
+    Scripts de um lote como lista de (nome, ficheiro aberto), a partir de
+    vários ficheiros `jobs` ou de um zip `archive`. Levanta ValueError se
+    o lote exceder os limites.
+    """
+    if archive:
+        try:
+            zf = zipfile.ZipFile(archive.stream)
+        except zipfile.BadZipFile:
+            raise ValueError('Arquivo zip inválido.')
+        # Ignora pastas e metadados do macOS (__MACOSX/, ._*)
+        members = [
+            info for info in zf.infolist()
+            if not info.is_dir()
+            and not info.filename.startswith('__MACOSX/')
+            and not os.path.basename(info.filename).startswith('.')
+        ]
+        if len(members) > BATCH_MAX_JOBS:
+            raise ValueError(f'Máximo de {BATCH_MAX_JOBS} scripts por lote.')
+        if sum(info.file_size for info in members) > BATCH_MAX_BYTES:
+            raise ValueError('Lote excede o tamanho máximo.')
+        return [(os.path.basename(info.filename), zf.open(info)) for info in members]
+
+    if len(files) > BATCH_MAX_JOBS:
+        raise ValueError(f'Máximo de {BATCH_MAX_JOBS} scripts por lote.')
+    return [(f.filename, f.stream) for f in files]
+
+@app.route('/submit-batch', methods=['POST'])
+def submit_batch():
+    """
+    Submete vários scripts de uma vez (campos `jobs` repetidos ou um zip em
+    `archive`), todos com o mesmo `input` opcional. Os scripts são validados
+    antes de gravar qualquer um e enfileirados de uma só vez na fila batch.
+    """
+    username   = request.form.get('username', '').strip()
+    files      = request.files.getlist('jobs')
+    archive    = request.files.get('archive')
+    input_file = request.files.get('input')
+
+    if not username or not (files or archive):
+        return jsonify({'message': 'Dados insuficientes.'}), 400
+
+    user = User.query.filter_by(username=username).first()
+    if not user:
+        return jsonify({'message': 'Usuário não encontrado.'}), 404
+
+    try:
+        entries = batch_entries(files, archive)
+    except ValueError as e:
+        return jsonify({'message': str(e)}), 400
+    if not entries:
+        return jsonify({'message': 'Nenhum script no lote.'}), 400
+
+    scripts  = []
+    rejected = []
+    for name, stream in entries:
+        name = secure_filename(name)
+        ext  = os.path.splitext(name)[1].lower()
+        if ext not in SCRIPT_LANGUAGES:
+            rejected.append(name)
+        scripts.append((name, SCRIPT_LANGUAGES.get(ext), stream))
+    if rejected:
+        return jsonify({'message': 'Extensões não suportadas.', 'rejected': rejected[:100]}), 400
+
+    host_job_folder = os.path.join(os.getcwd(), app.config['JOB_FOLDER'], username)
+    os.makedirs(host_job_folder, exist_ok=True)
+    batch_id = str(uuid.uuid4())
+
+    # O input partilhado é um só blob; scripts iguais no lote também
+    input_digest = blob_store.put_stream(input_file.stream) if input_file else None
+
+    jobs = []
+    for name, language, stream in scripts:
+        jobs.append({
+            'id':            str(uuid.uuid4()),
+            'user_id':       user.id,
+            'script_name':   name,
+            'language':      language,
+            'status':        'queued',
+            'batch_id':      batch_id,
+            'priority':      fair_queue.BATCH_QUEUE,
+            'created_at':    datetime.utcnow(),
+            'script_digest': blob_store.put_stream(stream),
+            'input_digest':  input_digest,
+        })
+
+    db.session.add(JobBatch(id=batch_id, user_id=user.id, total=len(jobs)))
+    db.session.bulk_insert_mappings(Job, jobs)
+    db.session.commit()
+
+    # Vai para a fila justa do utilizador (ver fair_queue.py)
+    fair_queue.push_batch_jobs(user.id, [
+        {
+            'task':   'execute_script',
+            'kwargs': {
+                'job_id':        job['id'],
+                'language':      job['language'],
+                'output_dir':    host_job_folder,
+                'script_digest': job['script_digest'],
+                'input_digest':  input_digest,
+                'plan':          user.plan
+            }
+        }
+        for job in jobs
+    ])
+
+    return jsonify({
+        'message':  'Lote enfileirado com sucesso!',
+        'batch_id': batch_id,
+        'total':    len(jobs),
+        'job_ids':  [job['id'] for job in jobs]
+    }), 202
+
+@app.route('/batch-status/<batch_id>', methods=['GET'])
+def batch_status(batch_id):
+    """Progresso agregado de um lote: número de jobs por status."""
+    username = secure_filename(request.args.get('username', '').strip())
+    batch    = JobBatch.query.get(batch_id)
+    user     = User.query.get(batch.user_id) if batch else None
+    if not user or user.username != username:
+        return jsonify({'message': 'Lote não encontrado.'}), 404
+
+    counts = dict.fromkeys(['queued', 'running', 'succeeded', 'failed', 'timeout'], 0)
+    rows = db.session.query(Job.status, db.func.count(Job.id)) \
+        .filter(Job.batch_id == batch_id).group_by(Job.status).all()
+    for status, count in rows:
+        counts[status] = count
+    finished = counts['succeeded'] + counts['failed'] + counts['timeout']
+
+    return jsonify({
+        'batch_id':   batch_id,
+        'total':      batch.total,
+        'counts':     counts,
+        'finished':   finished,
+        'done':       finished == batch.total,
+        'created_at': batch.created_at.isoformat()
+    })
+
+# --------------------
+# Filas de Jobs (prioridade e fair-share)
+# --------------------
+BATCH_TASKS = {
+    'execute_script': execute_script,
+    'execute_suite':  execute_suite,
+}
+
+def send_batch_job(job):
+    """Chamado pelo dispatcher de fair_queue para cada job da classe batch."""
+    kwargs = dict(job['kwargs'], enqueued_at=time.time())
+    BATCH_TASKS[job['task']].apply_async(kwargs=kwargs, queue=fair_queue.BATCH_QUEUE,
+                                         task_id=kwargs['job_id'])
+
+def wait_time_stats(priority, since):
+    """Espera (s) entre a submissão e o início dos jobs iniciados desde `since`."""
+    rows = db.session.query(Job.created_at, Job.started_at).filter(
+        Job.priority == priority,
+        Job.started_at >= since
+    ).all()
+    waits = sorted((started - created).total_seconds() for created, started in rows)
+    if not waits:
+        return {'jobs': 0, 'avg': None, 'p50': None, 'p95': None, 'max': None}
+    return {
+        'jobs': len(waits),
+        'avg':  round(sum(waits) / len(waits), 3),
+        'p50':  round(waits[len(waits) // 2], 3),
+        'p95':  round(waits[min(int(len(waits) * 0.95), len(waits) - 1)], 3),
+        'max':  round(waits[-1], 3),
+    }
+
+@app.route('/metrics/queues', methods=['GET'])
+def queue_metrics():
+    """Profundidade das filas e tempo de espera por classe (últimos ?window= s)."""
+    window = request.args.get('window', 900, type=int)
+    since  = datetime.utcfromtimestamp(time.time() - window)
+
+    metrics = {}
+    for priority in fair_queue.QUEUES:
+        queued = db.session.query(db.func.count(Job.id)) \
+            .filter(Job.priority == priority, Job.status == 'queued').scalar()
+        metrics[priority] = {
+            'queued_jobs': queued,
+            'wait_seconds': wait_time_stats(priority, since),
+        }
+    try:
+        for priority in fair_queue.QUEUES:
+            metrics[priority]['celery_depth'] = fair_queue.queue_depth(priority)
+        metrics[fair_queue.BATCH_QUEUE]['fair_share'] = fair_queue.fair_queue_stats()
+    except redis.exceptions.RedisError as e:
+        metrics['error'] = str(e)
+    return jsonify(metrics)
+
+@app.route('/metrics/executor', methods=['GET'])
+def executor_metrics():
+    """Latência das chamadas worker -> executor (tempo até à resposta e total)."""
+    try:
+        return jsonify({
+            endpoint: executor_client.latency_stats(endpoint)
+            for endpoint in ('execute', 'execute-suite')
+        })
+    except redis.exceptions.RedisError as e:
+        return jsonify({'error': str(e)}), 503
+
+@app.route('/metrics/result-cache', methods=['GET'])
+def result_cache_metrics():
+    """Hits, misses e ocupação da cache de resultados."""
+    try:
+        return jsonify(result_cache.result_cache_stats())
+    except redis.exceptions.RedisError as e:
+        return jsonify({'error': str(e)}), 503
+
+def executor_latency_samples(endpoint):
+    """Histograma de executor_client em buckets cumulativos (segundos)."""
+    raw = {k.decode(): float(v) for k, v in job_events.redis_client.hgetall(
+        executor_client.LATENCY_KEY.format(endpoint)).items()}
+    samples = []
+    for phase in executor_client.LATENCY_PHASES:
+        labels = {'endpoint': endpoint, 'phase': phase}
+        seen = 0
+        for bucket in executor_client.LATENCY_BUCKETS_MS:
+            seen += int(raw.get(f'{phase}_le_{bucket}', 0))
+            samples.append(('_bucket', {**labels, 'le': str(bucket / 1000)}, seen))
+        count = int(raw.get(f'{phase}_count', 0))
+        samples.append(('_bucket', {**labels, 'le': '+Inf'}, count))
+        samples.append(('_sum', labels, raw.get(f'{phase}_sum_ms', 0) / 1000))
+        samples.append(('_count', labels, count))
+    responses = [
+        ({'endpoint': endpoint, 'status': k[len('status_'):]}, int(v))
+        for k, v in raw.items() if k.startswith('status_')
+    ]
+    return samples, responses
+
+@app.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    """
+    Métricas no formato do Prometheus. mycloud_queue_backlog (à espera +
+    em execução, por fila) é o sinal usado pelo HPA dos workers (ver
+    k8s/celery-worker-hpa.yaml e k8s/prometheus-adapter.yaml).
+    """
+    window = request.args.get('window', 300, type=int)
+    since  = datetime.utcfromtimestamp(time.time() - window)
+    now    = datetime.utcnow()
+
+    depth, running, oldest, waits = [], [], [], []
+    backlog = {}
+    for priority in fair_queue.QUEUES:
+        labels = {'queue': priority}
+        n_running = db.session.query(db.func.count(Job.id)) \
+            .filter(Job.priority == priority, Job.status == 'running').scalar()
+        first = db.session.query(db.func.min(Job.created_at)) \
+            .filter(Job.priority == priority, Job.status == 'queued').scalar()
+        stats = wait_time_stats(priority, since)
+        running.append((labels, n_running))
+        oldest.append((labels, (now - first).total_seconds() if first else 0))
+        for quantile, name in (('0.5', 'p50'), ('0.95', 'p95'), ('1', 'max')):
+            waits.append(({**labels, 'quantile': quantile}, stats[name]))
+        backlog[priority] = n_running
+
+    families = [
+        ('mycloud_jobs_running', 'gauge', 'Jobs em execução por fila.', running),
+        ('mycloud_queue_oldest_job_age_seconds', 'gauge',
+         'Idade do job mais antigo ainda à espera.', oldest),
+        ('mycloud_queue_wait_seconds', 'gauge',
+         f'Espera até ao início dos jobs iniciados nos últimos {window} s.', waits),
+    ]
+    try:
+        pending = fair_queue.fair_queue_stats()['pending']
+        for priority in fair_queue.QUEUES:
+            n = fair_queue.queue_depth(priority)
+            depth.append(({'queue': priority}, n))
+            backlog[priority] += n
+        backlog[fair_queue.BATCH_QUEUE] += pending
+        latency, responses = [], []
+        for endpoint in ('execute', 'execute-suite'):
+            samples, status = executor_latency_samples(endpoint)
+            latency  += samples
+            responses += status
+        cache = result_cache.result_cache_stats()
+        pool  = run_job_pool.stats()
+        families += [
+            ('mycloud_queue_depth', 'gauge', 'Mensagens na fila Celery.', depth),
+            ('mycloud_fair_queue_pending', 'gauge',
+             'Jobs batch nas filas por utilizador, antes da fila Celery.', [({}, pending)]),
+            ('mycloud_queue_backlog', 'gauge',
+             'Jobs à espera ou em execução por fila (sinal de autoscaling).',
+             [({'queue': q}, n) for q, n in backlog.items()]),
+            ('mycloud_executor_request_duration_seconds', 'histogram',
+             'Latência das chamadas worker -> executor.', latency),
+            ('mycloud_executor_responses_total', 'counter',
+             'Respostas do executor por código HTTP.', responses),
+            ('mycloud_result_cache_lookups_total', 'counter',
+             'Consultas à cache de resultados.',
+             [({'result': 'hit'}, cache['hits']), ({'result': 'miss'}, cache['misses'])]),
+            ('mycloud_result_cache_bytes', 'gauge',
+             'Bytes ocupados pela cache de resultados.', [({}, cache['bytes'])]),
+            ('mycloud_container_pool_idle', 'gauge',
+             'Containers pausados no pool de /run-job.',
+             [({'image': image}, s['idle']) for image, s in pool['images'].items()]),
+            ('mycloud_container_pool_claims_total', 'counter',
+             'Pedidos de /run-job servidos pelo pool (hit) ou com container novo (miss).',
+             [({'result': 'hit'}, pool['hits']), ({'result': 'miss'}, pool['misses'])]),
+        ]
+    except redis.exceptions.RedisError as e:
+        app.logger.warning(f'/metrics sem Redis: {e}')
+    return Response(prometheus.render(families), mimetype=None,
+                    content_type=prometheus.CONTENT_TYPE)
+
+@app.route('/blobs/<digest>', methods=['GET'])
+def get_blob(digest):
+    """Blob por digest, para executores sem o volume partilhado montado."""
+    token = request.headers.get('X-Blob-Token', '')
+    if not BLOB_FETCH_TOKEN or not hmac.compare_digest(token.encode(), BLOB_FETCH_TOKEN.encode()):
+        return jsonify({'message': 'Não autorizado.'}), 403
+    if not blob_store.is_digest(digest) or not blob_store.exists(digest):
+        return jsonify({'message': 'Blob não encontrado.'}), 404
+    return send_file(blob_store.blob_path(digest), mimetype='application/octet-stream')
+
+def job_output_path(username, job_id, event=None):
+    """
+    Caminho do output de um job terminado, ou None se ainda não existe.
+    Usa o evento publicado pelo worker; sem ele (ex.: Redis indisponível)
+    consulta a tabela jobs e, em último caso,
+    <JOB_FOLDER>/<username>/<job_id>.out.txt.
+    """
+    user_folder = os.path.abspath(os.path.join(app.config['JOB_FOLDER'], secure_filename(username)))
+    job = None if event else Job.query.get(job_id)
+    for path in ((event or {}).get('output_path'), job.output_path if job else None):
+        if path:
+            path = os.path.abspath(path)
+            if os.path.dirname(path) == user_folder and os.path.exists(path):
+                return path
+    path = os.path.join(user_folder, f"{secure_filename(job_id)}.out.txt")
+    return path if os.path.exists(path) else None
+
 @app.route('/job-result', methods=['GET'])
 def job_result():
     username = request.args.get('username', '').strip()
@@ -339,29 +1371,180 @@ def job_result():
     if not os.path.isdir(user_folder):
         return jsonify({'message':'Usuário não encontrado.'}), 404
 
-    for fname in os.listdir(user_folder):
-        if fname.startswith(job_id) and fname.endswith('.out.txt'):
-            path = os.path.join(user_folder, fname)
-            with open(path, 'r') as f:
-                output = f.read()
-            return jsonify({'job_id': job_id, 'output': output}), 200
+    # ?wait=N: long-poll até N segundos pelo evento de conclusão
+    try:
+        wait = min(float(request.args.get('wait', 0)), JOB_RESULT_MAX_WAIT)
+    except ValueError:
+        wait = 0
+    if wait > 0:
+        event = job_events.wait_for_job(job_id, wait)
+    else:
+        event = job_events.get_job_event(job_id)
+
+    path = job_output_path(username, job_id, event)
+    if path:
+        with open(path, 'r') as f:
+            output = f.read()
+        # Tempo de CPU e pico de memória medidos pelo executor
+        usage = (event or {}).get('usage')
+        return jsonify({'job_id': job_id, 'output': output, 'usage': usage}), 200
 
     return jsonify({'status':'pending'}), 202
 
+# Fases de um job, pela ordem: (nome, início, fim) sobre os instantes do
+# trace; compile/run/admission vêm medidos pelo executor
+TRACE_PHASES = (
+    ('fair_queue', 'submitted', 'enqueued'),   # só batch: fila por utilizador
+    ('queue',      'enqueued',  'dequeued'),   # fila Celery
+    ('executor',   'dequeued',  'executed'),   # pedido ao executor, de ponta a ponta
+    ('write',      'executed',  'written'),    # output gravado e job fechado
+)
+EXECUTOR_PHASES = ('admission', 'upload', 'compile', 'run')
+
+def trace_phases(job):
+    """
+    Instantes (ISO) e duração de cada fase (ms) de um job terminado.
+    `upload` é o que sobra do pedido ao executor fora da espera por lugar,
+    da compilação e da execução: envio, leitura dos blobs e resposta.
+    """
+    trace = json.loads(job.trace) if job.trace else {}
+    marks = {'submitted': job.created_at.replace(tzinfo=timezone.utc).timestamp()}
+    marks.update((k, v) for k, v in trace.items() if isinstance(v, (int, float)))
+    marks.setdefault('enqueued', marks['submitted'])
+
+    phases = {}
+    for name, start, end in TRACE_PHASES:
+        if start in marks and end in marks:
+            phases[name] = round((marks[end] - marks[start]) * 1000, 1)
+    executor = trace.get('executor') or {}
+    for name in EXECUTOR_PHASES:
+        if f'{name}_ms' in executor:
+            phases[name] = executor[f'{name}_ms']
+    if 'executor' in phases and {'admission', 'compile', 'run'} <= phases.keys():
+        phases['upload'] = round(
+            phases['executor'] - phases['admission'] - phases['compile'] - phases['run'], 1)
+    if 'written' in marks:
+        phases['total'] = round((marks['written'] - marks['submitted']) * 1000, 1)
+
+    return {
+        'timestamps': {
+            k: datetime.fromtimestamp(v, timezone.utc).isoformat() for k, v in marks.items()
+        },
+        'phases_ms': phases,
+    }
+
+@app.route('/job-trace/<job_id>', methods=['GET'])
+def job_trace(job_id):
+    """Onde foi gasto o tempo de um job: submissão, filas, executor e escrita."""
+    username = secure_filename(request.args.get('username', '').strip())
+    job      = Job.query.get(job_id)
+    user     = User.query.get(job.user_id) if job else None
+    if not user or user.username != username:
+        return jsonify({'message': 'Job não encontrado.'}), 404
+    if job.status in ('queued', 'running'):
+        return jsonify({'job_id': job_id, 'status': job.status}), 202
+
+    return jsonify({
+        'job_id':   job_id,
+        'language': job.language,
+        'kind':     job.kind,
+        'status':   job.status,
+        'cached':   job.cached,
+        **trace_phases(job),
+    })
+
+@app.route('/job-status/<job_id>', methods=['GET'])
+def get_job_status(job_id):
+    """
+    Estado de um job: queued | running | succeeded | failed | timeout.
+    Lido do result backend do Celery (uma leitura no Redis); só os jobs
+    que ainda não chegaram a um worker, os servidos pela cache e os já
+    expirados no backend usam o estado da tabela jobs. A linha do job
+    (chave primária) é lida sempre, para confirmar o dono, como em
+    /job-trace.
+    """
+    username = secure_filename(request.args.get('username', '').strip())
+    job      = Job.query.get(job_id)
+    user     = User.query.get(job.user_id) if job else None
+    if not user or user.username != username:
+        return jsonify({'message': 'Job não encontrado.'}), 404
+    try:
+        state = job_state(job_id)
+    except redis.exceptions.RedisError:
+        state = None
+    if state is None:
+        state = {'status': job.status, 'exit_code': job.exit_code}
+    return jsonify({'job_id': job_id, **state})
+
+@app.route('/job-events', methods=['GET'])
+def job_events_stream():
+    """Server-Sent Events: envia `done` (com o output) quando o job termina."""
+    username = request.args.get('username', '').strip()
+    job_id   = request.args.get('job_id', '').strip()
+    if not username or not job_id:
+        return jsonify({'message':'username e job_id são obrigatórios.'}), 400
+
+    def generate():
+        deadline = time.monotonic() + JOB_EVENTS_TIMEOUT
+        while time.monotonic() < deadline:
+            event = job_events.wait_for_job(job_id, JOB_EVENTS_HEARTBEAT)
+            path  = job_output_path(username, job_id, event)
+            if path:
+                with open(path, 'r') as f:
+                    payload = {'job_id': job_id, 'output': f.read()}
+                yield f"event: done\ndata: {json.dumps(payload)}\n\n"
+                return
+            yield ": ping\n\n"
+        yield "event: timeout\ndata: {}\n\n"
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
 @app.route('/jobs/<username>')
 def list_jobs(username):
-    user_job_folder = os.path.join(app.config['JOB_FOLDER'], secure_filename(username))
+    """
+    Histórico de jobs, mais recentes primeiro, paginado por cursor:
+    ?limit=N&cursor=<job_id do último item da página anterior>.
+    """
+    user = User.query.filter_by(username=secure_filename(username)).first()
+    if not user:
+        return jsonify({'jobs': [], 'next_cursor': None})
+
+    try:
+        limit = max(1, min(int(request.args.get('limit', JOBS_PAGE_SIZE)), JOBS_PAGE_MAX))
+    except ValueError:
+        limit = JOBS_PAGE_SIZE
+
+    query = Job.query.filter(Job.user_id == user.id)
+    cursor = request.args.get('cursor', '').strip()
+    if cursor:
+        last = Job.query.filter_by(id=cursor, user_id=user.id).first()
+        if last:
+            query = query.filter(db.or_(
+                Job.created_at < last.created_at,
+                db.and_(Job.created_at == last.created_at, Job.id < last.id)
+            ))
+
+    page = query.order_by(Job.created_at.desc(), Job.id.desc()).limit(limit + 1).all()
+    has_more = len(page) > limit
+    page = page[:limit]
+
     results = []
-    if os.path.exists(user_job_folder):
-        for fname in os.listdir(user_job_folder):
-            if fname.endswith(".out.txt"):
-                job_name = fname.replace(".py.out.txt", ".py")
-                with open(os.path.join(user_job_folder, fname)) as f:
-                    results.append({
-                        "job": job_name,
-                        "output": f.read()
-                    })
-    return jsonify(results)
+    for job in page:
+        item = job.to_dict()
+        item['output'] = ''
+        if job.output_path and os.path.exists(job.output_path):
+            with open(job.output_path, errors='replace') as f:
+                item['output'] = f.read(JOB_OUTPUT_PREVIEW)
+        results.append(item)
+
+    return jsonify({
+        'jobs':        results,
+        'next_cursor': page[-1].id if has_more else None
+    })
 
 # --------------------
 # Excluir Arquivos de Upload
@@ -374,7 +1557,11 @@ def delete_file():
 
     file_path = os.path.join(app.config['UPLOAD_FOLDER'], username, filename)
     if os.path.exists(file_path):
+        size = os.path.getsize(file_path)
         os.remove(file_path)
+        user = User.query.filter_by(username=username).first()
+        if user:
+            release_storage(user, size)
         return jsonify({'message': f'Arquivo {filename} apagado.'}), 200
     return jsonify({'message': 'Arquivo não encontrado.'}), 404
 
@@ -386,6 +1573,8 @@ def delete_all_files():
     if os.path.exists(user_folder):
         shutil.rmtree(user_folder)
         os.makedirs(user_folder, exist_ok=True)
+        User.query.filter_by(username=username).update({User.storage_used: 0})
+        db.session.commit()
         return jsonify({'message': 'Todos os arquivos foram apagados.'}), 200
     return jsonify({'message': 'Diretório não encontrado.'}), 404
 
@@ -405,6 +1594,7 @@ def update_username():
     if User.query.filter_by(username=new_username).first():
         return jsonify({"message": "Novo nome de usuário já está em uso.", "success": False})
 
+    # storage_used está na linha do utilizador e acompanha o novo nome
     old_path = os.path.join(app.config['UPLOAD_FOLDER'], old_username)
     new_path = os.path.join(app.config['UPLOAD_FOLDER'], new_username)
     if os.path.exists(old_path):
@@ -420,6 +1610,16 @@ def update_username():
     if os.path.exists(old_cont):
         os.rename(old_cont, new_cont)
 
+    # Os outputs dos jobs mudaram de pasta
+    Job.query.filter_by(user_id=user.id).update(
+        {Job.output_path: db.func.replace(
+            Job.output_path,
+            os.path.abspath(old_job) + os.sep,
+            os.path.abspath(new_job) + os.sep
+        )},
+        synchronize_session=False
+    )
+
     user.username = new_username
     db.session.commit()
     return jsonify({"message": "Nome de usuário atualizado com sucesso.", "success": True})
@@ -499,15 +1699,77 @@ def list_databases():
     nomes  = [r['datname'] for r in rows]
     return jsonify({'databases': nomes})
 
+@app.route('/metrics/db-engines', methods=['GET'])
+def db_engines_metrics():
+    return jsonify(user_engines.stats())
+
 @app.route('/databases-ui', methods=['GET'])
 def databases_ui():
     if not current_user.is_authenticated:
         return jsonify({'error': 'Autenticação requerida'}), 401
     return render_template('databases.html')
 
+def db_query_page_token(dbname, sql_query, key, row):
+    """
+    page_token assinado: colunas-chave e os seus valores na última linha
+    enviada. ValueError se algum for NULL (a página seguinte, com
+    WHERE (k) > (NULL), viria sempre vazia).
+    """
+    after = [v if v is None or isinstance(v, (bool, int, float, str)) else str(v)
+             for v in (row[k] for k in key)]
+    if any(v is None for v in after):
+        raise ValueError(f"key {key} com NULL na última linha da página; use colunas sem NULLs")
+    return db_query_tokens.dumps({
+        'db':    dbname,
+        'sql':   hashlib.sha256(sql_query.encode()).hexdigest(),
+        'key':   key,
+        'after': after
+    })
+
+def db_query_cursor(token, dbname, sql_query):
+    """(colunas-chave, valores) de um page_token, ou None se não pertencer a esta query."""
+    try:
+        data = db_query_tokens.loads(token)
+    except BadSignature:
+        return None
+    if data.get('db') != dbname or data.get('sql') != hashlib.sha256(sql_query.encode()).hexdigest():
+        return None
+    return data.get('key'), data.get('after')
+
+def db_query_keyset(engine, sql_query, key, after, limit):
+    """
+    Página por keyset: ordena pelas colunas-chave e continua a seguir aos
+    valores da última linha (WHERE (k1, k2) > (...)), em vez de um
+    OFFSET que obriga o Postgres a ler e descartar as páginas anteriores.
+    """
+    quote = engine.dialect.identifier_preparer.quote
+    cols  = ', '.join(f'q.{quote(k)}' for k in key)
+    where = ''
+    params = {'limit': limit}
+    if after is not None:
+        where = f"WHERE ({cols}) > ({', '.join(f':k{i}' for i in range(len(key)))})"
+        params.update({f'k{i}': v for i, v in enumerate(after)})
+    return text(
+        f"SELECT * FROM ({sql_query.rstrip().rstrip(';')}) AS q {where} "
+        f"ORDER BY {cols} LIMIT :limit"
+    ), params
+
+def ndjson_line(obj):
+    return json.dumps(obj, default=str) + '\n'
+
 @app.route('/db-query', methods=['POST'])
 @login_required
 def db_query():
+    """
+    Executa SQL numa base do utilizador. Consultas (select/with) devolvem
+    no máximo `limit` linhas por resposta, lidas de um cursor do servidor,
+    e `has_more` se ficaram linhas por ler. Sem `key` a query corre tal
+    como veio e não há página seguinte. Com `key` (colunas do resultado
+    que, juntas, são únicas e sem NULLs) a paginação é por keyset: as
+    linhas vêm ordenadas por `key` e `next_page_token` pede as seguintes.
+    Com "stream": true as linhas seguem em NDJSON à medida que são lidas,
+    até DB_QUERY_STREAM_MAX_ROWS por resposta.
+    """
     data     = request.get_json() or {}
     dbname   = (data.get('dbname') or '').strip()
     sql_query = (data.get('sql') or '').strip()
@@ -527,17 +1789,22 @@ def db_query():
     pg_port = os.getenv("POSTGRES_PORT_5432_TCP_PORT", "5432")
 
     uri = f"postgresql://{pg_user}:{pg_pass}@{pg_host}:{pg_port}/{dbname}"
-    try:
-        engine = create_engine(uri)
-        with engine.connect() as conn:
-            lower = sql_query.strip().lower()
-            if lower.startswith(("select", "show", "with")):
-                result = conn.execute(text(sql_query))
-                rows = [dict(row) for row in result.fetchall()]
-                return jsonify({'rows': rows}), 200
-            else:
+    engine = user_engines.get(uri)
+    lower  = sql_query.strip().lower()
+
+    if lower.startswith("show"):
+        try:
+            with engine.connect() as conn:
+                rows = [dict(row) for row in conn.execute(text(sql_query)).fetchmany(DB_QUERY_MAX_ROWS)]
+            return jsonify({'rows': rows, 'next_page_token': None}), 200
+        except Exception as e:
+            return jsonify({'error': str(e)}), 400
+
+    if not lower.startswith(("select", "with")):
+        try:
+            # begin() faz commit ao sair (ou rollback em caso de erro)
+            with engine.begin() as conn:
                 result = conn.execute(text(sql_query))
-                conn.commit()
                 count = None
                 try:
                     count = result.rowcount
@@ -547,12 +1814,348 @@ def db_query():
                     'message': 'Comando executado com sucesso',
                     'rowcount': count
                 }), 200
+        except Exception as e:
+            return jsonify({'error': str(e)}), 400
+
+    # Consultas: `limit` linhas (a seguir à última da página anterior, com `key`)
+    stream   = bool(data.get('stream'))
+    max_rows = DB_QUERY_STREAM_MAX_ROWS if stream else DB_QUERY_MAX_ROWS
+    try:
+        limit = max(1, min(int(data.get('limit') or max_rows), max_rows))
+    except (TypeError, ValueError):
+        return jsonify({'error': 'limit inválido'}), 400
+    key, after = data.get('key'), None
+    if data.get('page_token'):
+        cursor = db_query_cursor(data['page_token'], dbname, sql_query)
+        if cursor is None:
+            return jsonify({'error': 'page_token inválido'}), 400
+        key, after = cursor
+    if isinstance(key, str):
+        key = [key]
+    if key is not None and (not key or not all(isinstance(k, str) and k for k in key)):
+        return jsonify({'error': 'key inválida'}), 400
+
+    # Abre o cursor antes de responder para que erros de SQL ainda possam dar 400
+    conn = engine.connect()
+    try:
+        if key is None:
+            query, params = text(sql_query), {}
+        else:
+            columns = list(conn.execute(text(
+                f"SELECT * FROM ({sql_query.rstrip().rstrip(';')}) AS q LIMIT 0"
+            )).keys())
+            duplicated = sorted({c for c in columns if columns.count(c) > 1})
+            if duplicated:
+                raise ValueError(f"colunas repetidas no resultado: {', '.join(duplicated)}; "
+                                 "use aliases para paginar com key")
+            missing = [k for k in key if k not in columns]
+            if missing:
+                raise ValueError(f"key com colunas que não estão no resultado: {', '.join(missing)}")
+            query, params = db_query_keyset(engine, sql_query, key, after, limit + 1)
+        # cursor do servidor: o Postgres só envia as linhas que forem lidas
+        result = conn.execution_options(stream_results=True).execute(query, params)
     except Exception as e:
+        conn.close()
         return jsonify({'error': str(e)}), 400
 
+    if not stream:
+        try:
+            rows       = [dict(row) for row in result.fetchmany(limit + 1)]
+            has_more   = len(rows) > limit
+            next_token = db_query_page_token(dbname, sql_query, key, rows[limit - 1]) \
+                if has_more and key else None
+        except Exception as e:
+            return jsonify({'error': str(e)}), 400
+        finally:
+            result.close()
+            conn.close()
+        return jsonify({
+            'rows':            rows[:limit],
+            'key':             key,
+            'has_more':        has_more,
+            'next_page_token': next_token
+        }), 200
+
+    def generate():
+        sent, last = 0, None
+        try:
+            yield ndjson_line({'columns': list(result.keys()), 'key': key})
+            while sent < limit:
+                batch = result.fetchmany(min(DB_QUERY_FETCH_SIZE, limit - sent))
+                if not batch:
+                    break
+                for row in batch:
+                    yield ndjson_line({'row': dict(row)})
+                sent += len(batch)
+                last  = dict(batch[-1])
+            has_more = sent == limit and result.fetchone() is not None
+            yield ndjson_line({
+                'rows':            sent,
+                'has_more':        has_more,
+                'next_page_token': db_query_page_token(dbname, sql_query, key, last) if has_more and key else None
+            })
+        except Exception as e:
+            yield ndjson_line({'error': str(e)})
+        finally:
+            result.close()
+            conn.close()
+
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
 # --------------------
 # Container (embutido no Dashboard)
 # --------------------
+PROVISIONING_STATES = ('BUILDING', 'PULLING', 'STARTING')
+
+def start_provisioning(c):
+    """Põe o container na fila do container_provisioner (responde já ao pedido)."""
+    c.status        = 'BUILDING'
+    c.progress      = None
+    c.status_detail = 'Na fila...'
+    db.session.commit()
+    container_provisioner.submit(provision_container, c.id)
+
+def set_container_status(c, status, detail=None, progress=None):
+    c.status        = status
+    c.status_detail = detail
+    c.progress      = progress
+    db.session.commit()
+
+def container_volumes(c):
+    if not c.input_path or not os.path.exists(c.input_path):
+        return {}
+    bind = f"/app/input/{os.path.basename(c.input_path)}"
+    return {os.path.abspath(c.input_path): {'bind': bind, 'mode': 'ro'}}
+
+def provision_container(container_id):
+    """
+    Corre no container_provisioner: pull da imagem (com progresso),
+    remoção do container anterior com o mesmo nome e arranque.
+    Qualquer falha deixa o container em ERROR, com a mensagem em
+    status_detail.
+    """
+    with app.app_context():
+        c = Container.query.get(container_id)
+        try:
+            set_container_status(c, 'PULLING', f'A verificar a imagem {c.image_name}...', 0)
+            last_update = 0
+
+            def on_progress(done, total):
+                nonlocal last_update
+                if total and time.monotonic() - last_update >= CONTAINER_PROGRESS_INTERVAL:
+                    last_update = time.monotonic()
+                    mb = 1024 * 1024
+                    set_container_status(
+                        c, 'PULLING', f'A descarregar {c.image_name}: {done // mb}/{total // mb} MB',
+                        int(done * 100 / total)
+                    )
+
+            image_pull.ensure_image(docker_client, c.image_name, on_progress)
+
+            # Eliminado durante o pull: não arranca
+            db.session.refresh(c)
+            if c.status == 'DELETED':
+                return
+            set_container_status(c, 'STARTING', 'A arrancar o container...', 100)
+            touch_built_image(c.image_name)
+            try:
+                docker_client.containers.get(c.container_name).remove(force=True)
+            except docker.errors.NotFound:
+                pass
+            docker_c = docker_client.containers.run(
+                image=c.image_name,
+                name=c.container_name,
+                command=c.run_command.split(),
+                detach=True,
+                volumes=container_volumes(c),
+                tty=True
+            )
+            # Um comando curto pode já ter terminado: o evento "die" pode
+            # ter chegado antes de sair de STARTING e ter sido ignorado
+            docker_c.reload()
+            c.docker_id    = docker_c.id
+            c.exit_code    = docker_c.attrs.get('State', {}).get('ExitCode') if docker_c.status == 'exited' else None
+            c.cpu_percent  = c.memory_bytes = None
+            set_container_status(c, container_state.DOCKER_STATUS.get(docker_c.status, 'RUNNING'))
+        except Exception as e:
+            app.logger.warning("Falha ao provisionar o container %s: %s", c.container_name, e)
+            db.session.rollback()
+            set_container_status(c, 'ERROR', f'Erro ao criar container: {e}'[:512])
+        finally:
+            db.session.remove()
+
+def apply_container_state(name, docker_id, status, exit_code):
+    """
+    Aplica o estado vindo do Docker à linha mais recente com esse nome.
+    Containers que não são da plataforma são ignorados, tal como os que
+    estão em preparação (provision_container decide o estado final).
+    """
+    if not name or not status:
+        return
+    c = Container.query.filter_by(container_name=name).order_by(Container.id.desc()).first()
+    if c is None or c.status in PROVISIONING_STATES + ('DELETED',):
+        return
+    c.status    = status
+    c.docker_id = docker_id or c.docker_id
+    if status == 'STOPPED':
+        c.exit_code = exit_code
+    elif status == 'RUNNING':
+        c.exit_code = None
+    if status != 'RUNNING':
+        c.cpu_percent = c.memory_bytes = None
+    c.synced_at = datetime.utcnow()
+    db.session.commit()
+
+def resync_containers():
+    """
+    Listagem completa (uma chamada ao Docker): corrige o que os eventos
+    não trouxeram (backend parado, ligação perdida). Containers que já
+    não existem no Docker passam a DELETED.
+    """
+    existing = set()
+    for item in docker_client.api.containers(all=True):
+        name, docker_id, status, exit_code = container_state.listed_update(item)
+        existing.add(name)
+        apply_container_state(name, docker_id, status, exit_code)
+    gone = Container.query.filter(Container.status.in_(('RUNNING', 'PAUSED', 'STOPPED')))
+    if existing:
+        gone = gone.filter(Container.container_name.notin_(existing))
+    for c in gone.all():
+        c.status    = 'DELETED'
+        c.synced_at = datetime.utcnow()
+    db.session.commit()
+
+def container_reconciler():
+    """
+    Segue os eventos de containers do Docker e atualiza a tabela
+    containers. Depois de cada (re)ligação faz um resync completo; os
+    eventos perdidos entretanto são pedidos com `since`.
+    """
+    since = None
+    while True:
+        try:
+            with app.app_context():
+                resync_containers()
+                db.session.remove()
+            events = docker_client.events(
+                decode=True, since=since, filters={'type': 'container'}
+            )
+            for event in events:
+                since  = event.get('time', since)
+                update = container_state.event_update(event)
+                if update is None:
+                    continue
+                with app.app_context():
+                    apply_container_state(*update)
+                    db.session.remove()
+        except Exception:
+            app.logger.exception("Ligação aos eventos do Docker perdida")
+        time.sleep(CONTAINER_EVENTS_RETRY)
+
+def sample_container_stats():
+    """CPU e memória de cada container RUNNING (docker stats sem streaming)."""
+    for c in Container.query.filter_by(status='RUNNING').all():
+        try:
+            stats = docker_client.api.stats(c.docker_id or c.container_name, stream=False)
+        except docker.errors.NotFound:
+            c.status = 'DELETED'
+        except docker.errors.APIError as e:
+            app.logger.info("Sem stats do container %s: %s", c.container_name, e)
+            continue
+        else:
+            c.cpu_percent, c.memory_bytes = container_state.stats_usage(stats)
+        c.synced_at = datetime.utcnow()
+        db.session.commit()
+
+def container_stats_sampler():
+    while True:
+        time.sleep(CONTAINER_STATS_INTERVAL)
+        try:
+            with app.app_context():
+                resync_containers()
+                sample_container_stats()
+                db.session.remove()
+        except Exception:
+            app.logger.exception("Falha ao ler o estado dos containers")
+
+def touch_built_image(tag):
+    """Regista o uso de uma imagem de /build-image (para o LRU)."""
+    BuiltImage.query.filter_by(tag=tag).update({'last_used_at': datetime.utcnow()})
+    db.session.commit()
+
+def evict_built_images():
+    """
+    Enquanto as imagens ocuparem mais do que IMAGE_DISK_BUDGET_MB, remove
+    as de /build-image usadas há mais tempo. As do catálogo e as de
+    containers em preparação ou a correr nunca são removidas; as de
+    containers parados são recusadas pelo Docker e ficam.
+    """
+    budget = IMAGE_DISK_BUDGET_MB * 1024 * 1024
+    keep   = {img['tag'] for img in AVAILABLE_IMAGES} | {
+        c.image_name for c in Container.query.filter(
+            Container.status.in_(PROVISIONING_STATES + ('RUNNING',))
+        )
+    }
+    evicted = []
+    for image in BuiltImage.query.order_by(BuiltImage.last_used_at).all():
+        if image_cache.disk_usage(docker_client) <= budget:
+            break
+        if image.tag in keep:
+            continue
+        try:
+            image_cache.remove_image(docker_client, image.tag)
+        except docker.errors.APIError as e:
+            app.logger.info("Imagem %s não removida: %s", image.tag, e)
+            continue
+        db.session.delete(image)
+        db.session.commit()
+        evicted.append(image.tag)
+    if evicted:
+        app.logger.info("Imagens removidas (LRU): %s", ", ".join(evicted))
+    return evicted
+
+def prewarm_images():
+    """Pull/atualização do catálogo e, a seguir, o LRU das imagens de utilizadores."""
+    for img in AVAILABLE_IMAGES:
+        image_cache.prewarm(docker_client, img['tag'])
+    evict_built_images()
+
+def image_prewarmer():
+    while True:
+        try:
+            with app.app_context():
+                prewarm_images()
+        except Exception:
+            app.logger.exception("Falha no pré-aquecimento de imagens")
+        time.sleep(IMAGE_PREWARM_INTERVAL)
+
+def in_app_context(fn):
+    def run():
+        with app.app_context():
+            try:
+                return fn()
+            finally:
+                db.session.remove()
+    return run
+
+@app.route('/metrics/images', methods=['GET'])
+def image_metrics():
+    """Imagens do catálogo (presença, idade, pré-aquecimento) e de /build-image."""
+    try:
+        return jsonify({
+            'catalog':          [image_cache.image_status(docker_client, img['tag']) for img in AVAILABLE_IMAGES],
+            'built':            [i.to_dict() for i in BuiltImage.query.order_by(BuiltImage.last_used_at.desc())],
+            'disk_usage_bytes': image_cache.disk_usage(docker_client),
+            'budget_bytes':     IMAGE_DISK_BUDGET_MB * 1024 * 1024,
+        })
+    except docker.errors.DockerException as e:
+        return jsonify({'error': str(e)}), 503
+
+def resume_provisioning():
+    """No arranque: retoma os containers que ficaram a meio (backend reiniciado)."""
+    for c in Container.query.filter(Container.status.in_(PROVISIONING_STATES)).all():
+        container_provisioner.submit(provision_container, c.id)
+
 @app.route('/containers/create', methods=['GET', 'POST'])
 @login_required
 def create_container():
@@ -586,42 +2189,11 @@ def create_container():
             image_name=image_tag,
             container_name=container_name,
             run_command=run_command,
-            status='BUILDING'
+            input_path=bind_src
         )
         db.session.add(novo)
-        db.session.commit()
-
-        try:
-            # 1) Garantir que a imagem existe (fazer pull se necessário)
-            try:
-                docker_client.images.get(image_tag)
-            except docker.errors.ImageNotFound:
-                docker_client.images.pull(image_tag)
-
-            # 2) Configurar volumes (se enviou arquivo)
-            volumes = {}
-            if bind_src:
-                container_path = f"/app/input/{os.path.basename(bind_src)}"
-                volumes[bind_src] = {'bind': container_path, 'mode': 'ro'}
-
-            # 3) Executar container em modo destacável
-            docker_client.containers.run(
-                image=image_tag,
-                name=container_name,
-                command=run_command.split(),
-                detach=True,
-                volumes=volumes,
-                tty=True
-            )
-
-            # 4) Atualizar status para RUNNING
-            novo.status = 'RUNNING'
-            db.session.commit()
-            flash('Container criado e iniciado com sucesso.', 'success')
-        except Exception as e:
-            novo.status = 'ERROR'
-            db.session.commit()
-            flash(f'Erro ao criar container: {e}', 'danger')
+        start_provisioning(novo)
+        flash('Container em preparação; o estado é atualizado nesta página.', 'info')
 
         return redirect(url_for('dashboard'))
 
@@ -652,47 +2224,21 @@ def stop_container(container_id):
 @login_required
 def run_container_again(container_id):
     c = Container.query.filter_by(id=container_id, user_id=current_user.id).first_or_404()
-    try:
-        # 1) Remover container antigo, se existir
-        try:
-            old = docker_client.containers.get(c.container_name)
-            if old.status == 'running':
-                old.stop()
-            old.remove()
-        except docker.errors.NotFound:
-            pass
-
-        # 2) Configurar volumes novamente (se arquivo ainda estiver em disco)
-        volumes = {}
-        user_folder = os.path.join(
-            app.config['CONTAINER_FOLDER'], current_user.username, str(c.id)
-        )
-        if os.path.isdir(user_folder):
-            files = os.listdir(user_folder)
-            if files:
-                bind_src = os.path.join(user_folder, files[0])
-                container_path = f"/app/input/{os.path.basename(bind_src)}"
-                volumes[bind_src] = {'bind': container_path, 'mode': 'ro'}
-
-        # 3) Rodar container novamente
-        docker_client.containers.run(
-            image=c.image_name,
-            name=c.container_name,
-            command=c.run_command.split(),
-            detach=True,
-            volumes=volumes,
-            tty=True
-        )
-
-        c.status = 'RUNNING'
-        db.session.commit()
-        flash(f'Container {c.container_name} iniciado novamente.', 'success')
-    except Exception as e:
-        c.status = 'ERROR'
-        db.session.commit()
-        flash(f'Erro ao rodar container: {e}', 'danger')
+    if c.status in PROVISIONING_STATES:
+        flash(f'Container {c.container_name} ainda em preparação.', 'warning')
+    else:
+        # O container antigo é removido e criado de novo em background
+        start_provisioning(c)
+        flash(f'Container {c.container_name} a iniciar novamente.', 'info')
     return redirect(url_for('dashboard'))
 
+@app.route('/containers/<int:container_id>/status', methods=['GET'])
+@login_required
+def container_status(container_id):
+    """Estado e progresso do provisionamento (consultado pela dashboard)."""
+    c = Container.query.filter_by(id=container_id, user_id=current_user.id).first_or_404()
+    return jsonify(c.to_dict())
+
 @app.route('/containers/<int:container_id>/delete', methods=['POST'])
 @login_required
 def delete_container(container_id):
@@ -723,13 +2269,71 @@ def run_job_api():
     dados  = request.json or {}
     imagem = dados.get("imagem", "ubuntu:20.04")
     cmd    = dados.get("cmd", ["echo", "Olá"])
-    cid    = docker_client.containers.run(
+
+    # Imagem com pool: exec num container pausado, em background; o estado
+    # e o output completo ficam em /run-job/<run_id>
+    entry = run_job_pool.claim(imagem) if run_job_pool.pooled(imagem) else None
+    if entry is not None:
+        run_id = uuid.uuid4().hex
+        try:
+            set_run_job_state(run_id, {'status': 'running', 'container_id': entry.container.id})
+        except redis.exceptions.RedisError as e:
+            run_job_pool.release(entry, healthy=False)
+            return jsonify({"message": f"Erro ao registar o job: {str(e)}"}), 503
+        run_job_runner.submit(run_pooled_job, entry, cmd, run_id)
+        return jsonify({
+            "container_id": entry.container.id,
+            "pooled":       True,
+            "run_id":       run_id,
+            "status_url":   url_for('run_job_status', run_id=run_id)
+        }), 201
+
+    # Sem pool (ou pool vazio): container novo, em background
+    cid = docker_client.containers.run(
         image=imagem,
         command=cmd,
-        volumes={"/tmp/jobs": {"bind": "/jobs", "mode": "rw"}},
+        volumes=RUN_JOB_VOLUMES,
         detach=True
     )
-    return jsonify({"container_id": cid.id}), 201
+    return jsonify({"container_id": cid.id, "pooled": False}), 201
+
+def run_job_output_path(run_id):
+    return os.path.join(app.config['JOB_FOLDER'], '_run-jobs', f'{run_id}.out')
+
+def set_run_job_state(run_id, state):
+    job_events.redis_client.set(f'run-job:{run_id}', json.dumps(state),
+                                ex=job_events.EVENT_TTL_SECONDS)
+
+def run_pooled_job(entry, cmd, run_id):
+    """Corre no run_job_runner: exec no container do pool, output num ficheiro."""
+    path  = run_job_output_path(run_id)
+    state = {'container_id': entry.container.id}
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as out:
+            exit_code = run_job_pool.execute(entry, cmd, out)
+        state.update(status='timeout' if exit_code is None else 'finished', exit_code=exit_code)
+    except Exception as e:
+        app.logger.warning("Falha no /run-job %s: %s", run_id, e)
+        state.update(status='error', error=str(e))
+    set_run_job_state(run_id, state)
+
+@app.route("/run-job/<run_id>", methods=["GET"])
+def run_job_status(run_id):
+    """Estado de um /run-job no pool e, quando termina, o output completo."""
+    raw = job_events.redis_client.get(f'run-job:{run_id}')
+    if raw is None:
+        return jsonify({"message": "run_id não encontrado."}), 404
+    state = json.loads(raw)
+    path  = run_job_output_path(run_id)
+    if state['status'] != 'running' and os.path.exists(path):
+        with open(path, 'rb') as f:
+            state['output'] = f.read().decode('utf-8', 'replace')
+    return jsonify({'run_id': run_id, **state}), 200 if state['status'] != 'running' else 202
+
+@app.route('/metrics/container-pool', methods=['GET'])
+def container_pool_metrics():
+    return jsonify(run_job_pool.stats())
 
 @app.route("/run-container", methods=["POST"])
 @login_required
@@ -756,6 +2360,7 @@ def run_container_api():
     }
 
     try:
+        touch_built_image(imagem)
         container = docker_client.containers.run(
             image=imagem,
             name=container_name,
@@ -763,6 +2368,17 @@ def run_container_api():
             volumes=volumes,
             detach=True
         )
+        # Registado para o container_reconciler e para /list-containers
+        db.session.add(Container(
+            user_id=current_user.id,
+            image_name=imagem,
+            container_name=container_name,
+            run_command=cmd_str,
+            status='RUNNING',
+            docker_id=container.id,
+            synced_at=datetime.utcnow()
+        ))
+        db.session.commit()
         return jsonify({
             "container_id": container.id,
             "name":         container.name,
@@ -774,15 +2390,21 @@ def run_container_api():
 @app.route("/list-containers", methods=["GET"])
 @login_required
 def list_containers_api():
-    username = current_user.username
-    prefixo  = f"{username}_"
-    todos    = docker_client.containers.list(all=True, filters={"name": prefixo})
+    # Servido da tabela containers (mantida pelo container_reconciler)
+    todos = Container.query \
+        .filter(Container.user_id == current_user.id, Container.status != 'DELETED') \
+        .order_by(Container.created_at.desc()) \
+        .all()
     resultado = []
     for c in todos:
         resultado.append({
-            "id":     c.id,
-            "name":   c.name,
-            "status": c.status
+            "id":           c.docker_id,
+            "name":         c.container_name,
+            "status":       c.status,
+            "exit_code":    c.exit_code,
+            "cpu_percent":  c.cpu_percent,
+            "memory_bytes": c.memory_bytes,
+            "synced_at":    c.synced_at.isoformat() if c.synced_at else None
         })
     return jsonify(resultado)
 
@@ -799,6 +2421,8 @@ def stop_container_api():
     try:
         cont = docker_client.containers.get(container_name)
         cont.stop()
+        cont.reload()
+        apply_container_state(container_name, cont.id, 'STOPPED', cont.attrs.get('State', {}).get('ExitCode'))
         return jsonify({"message": f"Container {container_name} parado."}), 200
     except docker.errors.NotFound:
         return jsonify({"message": "Container não encontrado."}), 404
@@ -818,6 +2442,7 @@ def remove_container_api():
     try:
         cont = docker_client.containers.get(container_name)
         cont.remove(force=True)
+        apply_container_state(container_name, cont.id, 'DELETED', None)
         return jsonify({"message": f"Container {container_name} removido."}), 200
     except docker.errors.NotFound:
         return jsonify({"message": "Container não encontrado."}), 404
@@ -827,6 +2452,11 @@ def remove_container_api():
 @app.route("/build-image", methods=["POST"])
 @login_required
 def build_image():
+    """
+    Põe o build na fila do image_builder e responde já com o build_id;
+    o progresso segue-se em /builds/<build_id> e os logs, à medida que
+    chegam, em /builds/<build_id>/logs (SSE).
+    """
     data = request.get_json() or {}
     df_text    = data.get("dockerfile", "").strip()
     image_name = data.get("image_name", "").strip()
@@ -835,32 +2465,202 @@ def build_image():
     if not df_text or not image_name:
         return jsonify({"message": "dockerfile e image_name são obrigatórios"}), 400
 
-    username  = current_user.username
-    build_id  = str(uuid.uuid4())[:8]
-    build_path = os.path.join(os.getcwd(), "dockerbuilds", username, build_id)
-    os.makedirs(build_path, exist_ok=True)
+    full_image_tag = f"{current_user.username}_{image_name}:{tag}"
+    df_hash        = hashlib.sha256(df_text.encode()).hexdigest()
+
+    # O mesmo Dockerfile para a mesma imagem já na fila: é esse o build
+    build = ImageBuild.query.filter(
+        ImageBuild.user_id == current_user.id,
+        ImageBuild.image_tag == full_image_tag,
+        ImageBuild.dockerfile_hash == df_hash,
+        ImageBuild.status.in_(('queued', 'building'))
+    ).first()
+    if build is None:
+        build = ImageBuild(
+            id=uuid.uuid4().hex,
+            user_id=current_user.id,
+            image_tag=full_image_tag,
+            dockerfile=df_text,
+            dockerfile_hash=df_hash
+        )
+        db.session.add(build)
+        db.session.commit()
+        image_builder.submit(run_image_build, build.id)
 
-    dockerfile_path = os.path.join(build_path, "Dockerfile")
-    with open(dockerfile_path, "w") as f:
-        f.write(df_text)
+    return jsonify({
+        **build.to_dict(),
+        "status_url": url_for('build_status', build_id=build.id),
+        "logs_url":   url_for('build_log_stream', build_id=build.id)
+    }), 202
 
-    full_image_tag = f"{username}_{image_name}:{tag}"
+_build_locks      = {}
+_build_locks_lock = threading.Lock()
+
+def dockerfile_lock(df_hash):
+    """Builds do mesmo Dockerfile correm um de cada vez (o segundo reutiliza o primeiro)."""
+    with _build_locks_lock:
+        return _build_locks.setdefault(df_hash, threading.Lock())
+
+def reusable_build(build):
+    """Build anterior bem-sucedido do mesmo Dockerfile cuja imagem ainda existe."""
+    previous = ImageBuild.query.filter(
+        ImageBuild.dockerfile_hash == build.dockerfile_hash,
+        ImageBuild.status == 'succeeded',
+        ImageBuild.id != build.id
+    ).order_by(ImageBuild.finished_at.desc()).all()
+    for prev in previous:
+        try:
+            return prev, docker_client.images.get(prev.image_id)
+        except docker.errors.ImageNotFound:
+            continue
+    return None, None
+
+def docker_build(build):
+    """
+    docker build com o contexto em memória (só o Dockerfile, como antes):
+    não fica nenhuma pasta por apagar. Sem nocache/pull, os passos já
+    construídos por builds anteriores vêm da cache de camadas do Docker.
+    Devolve o id da imagem; levanta docker.errors.BuildError se falhar.
+    """
+    image_id = None
+    for chunk in docker_client.api.build(
+        fileobj=io.BytesIO(build.dockerfile.encode()),
+        tag=build.image_tag,
+        rm=True,
+        forcerm=True,
+        decode=True,
+        labels={'mycloud.dockerfile-sha256': build.dockerfile_hash}
+    ):
+        if 'stream' in chunk:
+            build_logs.append_build_log(build.id, chunk['stream'].splitlines())
+        elif 'status' in chunk:
+            # pull da imagem base
+            build_logs.append_build_log(build.id, [
+                ' '.join(str(chunk[k]) for k in ('id', 'status', 'progress') if chunk.get(k))
+            ])
+        elif 'aux' in chunk:
+            image_id = chunk['aux'].get('ID', image_id)
+        if 'error' in chunk:
+            raise docker.errors.BuildError(chunk['error'], [])
+    return image_id or docker_client.images.get(build.image_tag).id
+
+def run_image_build(build_id):
+    """
+    Corre no image_builder. Se o mesmo Dockerfile já foi construído (por
+    qualquer utilizador) e a imagem ainda existe, só a etiqueta com o novo
+    nome; senão faz o build, com os logs publicados em build_logs. A
+    imagem que a etiqueta deixou de apontar é removida se ficou sem nome.
+    """
+    with app.app_context():
+        build = ImageBuild.query.get(build_id)
+        if build is None:
+            return   # apagado (/delete-all-users) enquanto estava na fila
+        try:
+            build.status = 'building'
+            db.session.commit()
+            try:
+                previous_id = docker_client.images.get(build.image_tag).id
+            except docker.errors.ImageNotFound:
+                previous_id = None
+
+            with dockerfile_lock(build.dockerfile_hash):
+                source, image = reusable_build(build)
+                if image is not None:
+                    repository, tag = docker.utils.parse_repository_tag(build.image_tag)
+                    image.tag(repository, tag=tag)
+                    build.reused_from = source.id
+                    build_logs.append_build_log(build.id, [
+                        f"Dockerfile igual ao do build {source.id}: imagem {image.short_id} reutilizada."
+                    ])
+                    build.image_id = image.id
+                else:
+                    build.image_id = docker_build(build)
+                    image = docker_client.images.get(build.image_id)
+
+            # Entra no LRU das imagens; o orçamento de disco é verificado a seguir
+            built = BuiltImage.query.filter_by(tag=build.image_tag).first() or \
+                BuiltImage(user_id=build.user_id, tag=build.image_tag)
+            built.size_bytes   = image.attrs.get('Size')
+            built.last_used_at = datetime.utcnow()
+            db.session.add(built)
+            build.status = 'succeeded'
+        except Exception as e:
+            app.logger.info("Build %s falhou: %s", build_id, e)
+            db.session.rollback()
+            build.status = 'failed'
+            build.error  = str(e)[:4000]
+            build_logs.append_build_log(build.id, [f"Erro: {e}"])
+        finally:
+            build.finished_at = datetime.utcnow()
+            db.session.commit()
+            build_logs.finish_build_log(build.id, build.status)
 
+        try:
+            if build.status == 'succeeded':
+                if previous_id and previous_id != build.image_id:
+                    remove_dangling_image(previous_id)
+                evict_built_images()
+        except docker.errors.DockerException as e:
+            app.logger.warning("Limpeza de imagens após o build %s: %s", build_id, e)
+        finally:
+            db.session.remove()
+
+def remove_dangling_image(image_id):
+    """Remove a versão anterior de uma imagem reconstruída, se ficou sem etiquetas."""
     try:
-        image_obj, build_logs = docker_client.images.build(
-            path=build_path,
-            tag=full_image_tag,
-            rm=True,
-            forcerm=True
-        )
-        return jsonify({
-            "image": full_image_tag,
-            "build_status": "sucesso"
-        }), 201
-    except docker.errors.BuildError as be:
-        return jsonify({"message": f"Erro no build: {str(be)}"}), 500
-    except docker.errors.APIError as ae:
-        return jsonify({"message": f"Erro na API Docker: {str(ae)}"}), 500
+        if not docker_client.images.get(image_id).tags:
+            image_cache.remove_image(docker_client, image_id)
+    except docker.errors.APIError as e:
+        app.logger.info("Imagem %s não removida: %s", image_id, e)
+
+def resume_image_builds():
+    """No arranque: builds que ficaram a meio (backend reiniciado) voltam à fila."""
+    for build in ImageBuild.query.filter(ImageBuild.status.in_(('queued', 'building'))).all():
+        image_builder.submit(run_image_build, build.id)
+
+def remove_build_contexts():
+    """
+    Apaga as pastas dockerbuilds/<user>/<id> deixadas pelos builds
+    antigos (o contexto agora é construído em memória).
+    """
+    shutil.rmtree(os.path.join(os.getcwd(), "dockerbuilds"), ignore_errors=True)
+
+@app.route("/builds/<build_id>", methods=["GET"])
+@login_required
+def build_status(build_id):
+    build = ImageBuild.query.filter_by(id=build_id, user_id=current_user.id).first_or_404()
+    return jsonify(build.to_dict())
+
+@app.route("/builds/<build_id>/logs", methods=["GET"])
+@login_required
+def build_log_stream(build_id):
+    """
+    Server-Sent Events: um evento `log` por linha do docker build (com o
+    número da linha como id, para retomar com Last-Event-ID) e `done` com
+    o estado final.
+    """
+    ImageBuild.query.filter_by(id=build_id, user_id=current_user.id).first_or_404()
+    start = request.headers.get('Last-Event-ID', -1, type=int) + 1
+
+    def generate(offset):
+        deadline = time.monotonic() + BUILD_LOGS_TIMEOUT
+        while time.monotonic() < deadline:
+            lines, done = build_logs.wait_build_log(build_id, offset, JOB_EVENTS_HEARTBEAT)
+            for line in lines:
+                yield f"id: {offset}\nevent: log\ndata: {json.dumps({'line': line})}\n\n"
+                offset += 1
+            if done:
+                yield f"event: done\ndata: {json.dumps({'build_id': build_id, 'status': done})}\n\n"
+                return
+            if not lines:
+                yield ": ping\n\n"
+        yield "event: timeout\ndata: {}\n\n"
+
+    return Response(
+        stream_with_context(generate(start)),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
 
 # --------------------
 # Execução (main)
@@ -869,4 +2669,28 @@ if __name__ == '__main__':
     print(f"[DEBUG] Pasta de uploads:     {os.path.abspath(app.config['UPLOAD_FOLDER'])}")
     print(f"[DEBUG] Pasta de jobs:        {os.path.abspath(app.config['JOB_FOLDER'])}")
     print(f"[DEBUG] Pasta de containers:  {os.path.abspath(app.config['CONTAINER_FOLDER'])}")
+    with app.app_context():
+        reconcile_storage_usage()
+        resume_provisioning()
+        resume_image_builds()
+    remove_build_contexts()
+    if USAGE_RECONCILE_INTERVAL > 0:
+        threading.Thread(target=storage_reconciler, daemon=True).start()
+    threading.Thread(target=user_engines.sweeper, daemon=True).start()
+    if IMAGE_PREWARM_INTERVAL > 0:
+        threading.Thread(target=image_prewarmer, daemon=True).start()
+    if run_job_pool.size > 0:
+        threading.Thread(
+            target=run_job_pool.maintainer,
+            args=(lambda e: app.logger.warning("Pool de containers: %s", e),),
+            daemon=True
+        ).start()
+    if CONTAINER_STATS_INTERVAL > 0:
+        threading.Thread(target=container_reconciler, daemon=True).start()
+        threading.Thread(target=container_stats_sampler, daemon=True).start()
+    threading.Thread(
+        target=fair_queue.dispatcher,
+        args=(send_batch_job, lambda e: app.logger.warning("Dispatcher batch: %s", e)),
+        daemon=True
+    ).start()
     app.run(host='0.0.0.0', port=5000)
@@ -0,0 +1,172 @@
+"""
+Cache de resultados de jobs deterministas (opt-in: /submit-job com cache=1).
+
+A chave é o sha256 de: linguagem, runtime do executor (versão da
+toolchain e limites de execução do plano do utilizador, devolvidos no
+estado final de cada job), digest do script e digest do input. Com a
+mesma chave, o output é o mesmo e o job não precisa de passar pelo
+Celery nem pelo executor.
+
+No Redis:
+- result-cache:entry:<chave>  hash com output, exit_code e status;
+- result-cache:lru            zset chave -> último uso (para o LRU);
+- result-cache:sizes          hash chave -> bytes da entrada;
+- result-cache:bytes          total de bytes em cache;
+- result-cache:runtime        hash linguagem:plano -> runtime visto por último;
+- result-cache:stats          contadores hits/misses/stores/evictions.
+
+As entradas expiram RESULT_CACHE_TTL segundos após o último uso e, acima
+de RESULT_CACHE_MAX_BYTES, as menos usadas são removidas. Só ficam em
+cache execuções que terminaram normalmente (qualquer exit code) e com
+output até RESULT_CACHE_MAX_ENTRY_BYTES. Erros do Redis nunca falham o
+job: contam como miss.
+"""
+import hashlib
+import json
+import os
+import time
+
+import redis
+
+from job_events import redis_client
+
+RESULT_CACHE_TTL             = int(os.environ.get("RESULT_CACHE_TTL", str(24 * 3600)))
+RESULT_CACHE_MAX_BYTES       = int(os.environ.get("RESULT_CACHE_MAX_BYTES", str(256 * 1024 * 1024)))
+RESULT_CACHE_MAX_ENTRY_BYTES = int(os.environ.get("RESULT_CACHE_MAX_ENTRY_BYTES", str(1024 * 1024)))
+
+LRU_KEY     = "result-cache:lru"
+SIZES_KEY   = "result-cache:sizes"
+BYTES_KEY   = "result-cache:bytes"
+RUNTIME_KEY = "result-cache:runtime"
+STATS_KEY   = "result-cache:stats"
+
+
+def _entry_key(key):
+    return f"result-cache:entry:{key}"
+
+
+def _runtime_field(language, plan):
+    return f"{language}:{plan or 'free'}"
+
+
+# Grava uma entrada e remove as expiradas e as menos usadas até o total
+# caber em ARGV[6]. Devolve quantas foram removidas por tamanho.
+_store = redis_client.register_script("""
+local entry, now, ttl, size = KEYS[1], tonumber(ARGV[4]), tonumber(ARGV[5]), tonumber(ARGV[7])
+local function drop(key)
+    redis.call('DEL', key)
+    redis.call('ZREM', KEYS[2], key)
+    redis.call('DECRBY', KEYS[4], tonumber(redis.call('HGET', KEYS[3], key) or 0))
+    redis.call('HDEL', KEYS[3], key)
+end
+for _, key in ipairs(redis.call('ZRANGEBYSCORE', KEYS[2], '-inf', now - ttl)) do
+    drop(key)
+end
+drop(entry)
+redis.call('HSET', entry, 'output', ARGV[1], 'exit_code', ARGV[2], 'status', ARGV[3])
+redis.call('EXPIRE', entry, ttl)
+redis.call('ZADD', KEYS[2], now, entry)
+redis.call('HSET', KEYS[3], entry, size)
+local total = redis.call('INCRBY', KEYS[4], size)
+local evicted = 0
+while total > tonumber(ARGV[6]) do
+    local oldest = redis.call('ZRANGE', KEYS[2], 0, 0)[1]
+    if not oldest or oldest == entry then
+        break
+    end
+    drop(oldest)
+    total = tonumber(redis.call('GET', KEYS[4]))
+    evicted = evicted + 1
+end
+redis.call('HINCRBY', KEYS[5], 'stores', 1)
+redis.call('HINCRBY', KEYS[5], 'evictions', evicted)
+return evicted
+""")
+
+
+def cache_key(language, runtime, script_digest, input_digest=None):
+    """Chave da cache; `runtime` é o dict devolvido pelo executor."""
+    h = hashlib.sha256()
+    for part in (language, json.dumps(runtime, sort_keys=True), script_digest, input_digest or ""):
+        h.update(part.encode())
+        h.update(b"\0")
+    return h.hexdigest()
+
+
+def lookup(language, plan, script_digest, input_digest=None):
+    """
+    Resultado em cache ({"output": bytes, "exit_code", "status"}) ou None.
+    Sem runtime conhecido para a linguagem e plano (nenhum job correu
+    ainda com eles) não há chave possível e conta como miss.
+    """
+    try:
+        runtime = redis_client.hget(RUNTIME_KEY, _runtime_field(language, plan))
+        entry   = None
+        if runtime:
+            key   = _entry_key(cache_key(language, json.loads(runtime), script_digest, input_digest))
+            entry = redis_client.hgetall(key)
+        pipe = redis_client.pipeline(transaction=False)
+        if entry:
+            pipe.zadd(LRU_KEY, {key: time.time()})
+            pipe.expire(key, RESULT_CACHE_TTL)
+            pipe.hincrby(STATS_KEY, "hits", 1)
+        else:
+            pipe.hincrby(STATS_KEY, "misses", 1)
+        pipe.execute()
+    except redis.exceptions.RedisError:
+        return None
+    if not entry:
+        return None
+    exit_code = entry[b"exit_code"].decode()
+    return {
+        "output":    entry[b"output"],
+        "exit_code": int(exit_code) if exit_code else None,
+        "status":    entry[b"status"].decode(),
+    }
+
+
+def store(language, plan, script_digest, input_digest, result, status, output_path):
+    """
+    Chamado pelo worker no fim de um job com cache=1. `result` é o estado
+    final do executor (traz "runtime"), `status` o status do Job.
+    Devolve True se o resultado ficou em cache.
+    """
+    runtime = result.get("runtime")
+    if not runtime or result.get("status") != "ok":
+        return False
+    size = os.path.getsize(output_path)
+    if size > RESULT_CACHE_MAX_ENTRY_BYTES:
+        return False
+    with open(output_path, "rb") as f:
+        output = f.read()
+
+    exit_code = result.get("exit_code")
+    key = _entry_key(cache_key(language, runtime, script_digest, input_digest))
+    try:
+        redis_client.hset(RUNTIME_KEY, _runtime_field(language, plan), json.dumps(runtime, sort_keys=True))
+        _store(
+            keys=[key, LRU_KEY, SIZES_KEY, BYTES_KEY, STATS_KEY],
+            args=[output, "" if exit_code is None else exit_code, status, time.time(),
+                  RESULT_CACHE_TTL, RESULT_CACHE_MAX_BYTES, size],
+        )
+    except redis.exceptions.RedisError:
+        return False
+    return True
+
+
+def result_cache_stats():
+    pipe = redis_client.pipeline(transaction=False)
+    pipe.hgetall(STATS_KEY)
+    pipe.zcard(LRU_KEY)
+    pipe.get(BYTES_KEY)
+    raw, entries, size = pipe.execute()
+    stats = {k: int(raw.get(k.encode(), 0)) for k in ("hits", "misses", "stores", "evictions")}
+    lookups = stats["hits"] + stats["misses"]
+    return {
+        **stats,
+        "hit_rate":  round(stats["hits"] / lookups, 3) if lookups else None,
+        "entries":   entries,
+        "bytes":     int(size or 0),
+        "max_bytes": RESULT_CACHE_MAX_BYTES,
+        "ttl":       RESULT_CACHE_TTL,
+    }
@@ -1,35 +1,333 @@
+import json
 import os
-from celery import Celery
-from executor_client import run_job
+import random
+import time
+from contextlib import ExitStack
+import requests
+from celery import Celery, Task
+from executor_client import run_job, run_suite, iter_frames, record_latency
+from job_events import EVENT_TTL_SECONDS, publish_job_done
+from job_store import mark_job_running, mark_job_finished
+import result_cache
+import worker_metrics  # /metrics do worker (liga-se aos sinais do Celery)
 
-# Inicializa o Celery com o Redis como broker
-app = Celery('worker', broker='redis://redis:6379/0')
+# Limite de output gravado por job (o executor aplica o seu próprio limite)
+MAX_OUTPUT_BYTES = int(os.environ.get('MAX_OUTPUT_BYTES', str(10 * 1024 * 1024)))
 
-@app.task
-def execute_script(job_id: str, script_path: str, input_path: str, language: str):
+# Tempo máximo de um pedido /execute-suite: compilação + cada caso
+SUITE_BASE_TIMEOUT = 60
+SUITE_CASE_TIMEOUT = 15
+
+# Retries com backoff exponencial (com jitter) quando o executor falha:
+# ligação recusada, timeout ou 5xx. Os 429 seguem o Retry-After.
+EXECUTOR_MAX_RETRIES = int(os.environ.get('EXECUTOR_MAX_RETRIES', '5'))
+EXECUTOR_RETRY_BASE  = float(os.environ.get('EXECUTOR_RETRY_BASE', '2'))
+EXECUTOR_RETRY_MAX   = float(os.environ.get('EXECUTOR_RETRY_MAX', '60'))
+
+# Inicializa o Celery com o Redis como broker e, noutra base do mesmo
+# Redis, como result backend: o estado de cada job (task_id = job_id)
+# lê-se em O(1) com job_state()
+app = Celery(
+    'worker',
+    broker=os.environ.get('CELERY_BROKER_URL', 'redis://redis:6379/0'),
+    backend=os.environ.get('CELERY_RESULT_BACKEND', 'redis://redis:6379/1'),
+)
+app.conf.result_expires = EVENT_TTL_SECONDS
+
+# Filas por classe de prioridade: /submit-job vai para "interactive"; os
+# lotes chegam a "batch" através do dispatcher do backend (fair_queue.py).
+# Cada worker consome só uma delas (-Q), para os lotes não atrasarem os
+# jobs interativos.
+app.conf.task_default_queue = 'interactive'
+
+
+# Estado extra no result backend, além dos do Celery (PENDING, RETRY,
+# SUCCESS, FAILURE): a task já está a correr
+RUNNING = 'RUNNING'
+
+
+class ExecutorUnavailable(Exception):
+    """Resposta 5xx do executor (vale a pena tentar outra vez)."""
+
+
+class JobTask(Task):
+    """
+    Base das tasks de jobs. Se a task falhar de vez (exceção inesperada ou
+    retries esgotados), o job fica 'failed' com o erro como output e quem
+    está à espera é avisado, em vez de ficar 'running' para sempre.
+    """
+
+    def on_failure(self, exc, task_id, args, kwargs, einfo):
+        job_id     = kwargs.get('job_id', task_id)
+        output_dir = kwargs.get('output_dir') or os.path.dirname(kwargs.get('script_path') or '')
+        out_path   = os.path.join(output_dir, f"{job_id}.out.txt")
+        if os.path.exists(out_path + '.part'):
+            os.remove(out_path + '.part')
+        with open(out_path, 'w') as f:
+            f.write(f" Erro ao executar o job: {exc}")
+        mark_job_finished(job_id, 'failed', None, os.path.getsize(out_path), out_path)
+        publish_job_done(job_id, out_path, 'failed')
+
+
+def mark_running(task, job_id: str):
+    """Job a correr, na tabela jobs e no result backend."""
+    mark_job_running(job_id)
+    task.update_state(state=RUNNING, meta={'job_id': job_id, 'retries': task.request.retries})
+
+
+def retry_with_backoff(task, exc):
+    """
+    Volta a pôr o job na fila daqui a 2, 4, 8... s (até EXECUTOR_RETRY_MAX);
+    esgotados os EXECUTOR_MAX_RETRIES, levanta `exc` e o job falha.
+    Um pedido que deu timeout pode já ter corrido no executor: o job corre
+    outra vez e o output é substituído.
+
+    As falhas do executor contam-se no kwarg `executor_retries`, à parte
+    do task.request.retries (que inclui os retries dos 429): um job que
+    esperou por capacidade não chega ao limite nem começa com um backoff
+    já longo.
+    """
+    kwargs   = dict(task.request.kwargs or {})
+    attempts = kwargs.get('executor_retries', 0)
+    if attempts >= EXECUTOR_MAX_RETRIES:
+        raise exc
+    countdown = min(EXECUTOR_RETRY_BASE * 2 ** attempts, EXECUTOR_RETRY_MAX)
+    kwargs['executor_retries'] = attempts + 1
+    # o limite é o de cima; o max_retries da task (20) conta também os 429
+    return task.retry(exc=exc, kwargs=kwargs, countdown=countdown * random.uniform(0.5, 1),
+                      max_retries=task.request.retries + 1)
+
+
+def job_state(job_id: str):
+    """
+    Estado do job no result backend (uma leitura no Redis), ou None se
+    não estiver lá: ainda na fila, servido pela cache de resultados ou já
+    expirado (result_expires).
+    """
+    meta   = app.backend.get_task_meta(job_id)
+    state  = meta['status']
+    result = meta.get('result')
+    if state == 'PENDING':
+        return None
+    if state == 'SUCCESS':
+        return {'status': result.get('status'), 'exit_code': result.get('exit_code')}
+    if state == RUNNING:
+        return {'status': 'running', 'retries': result.get('retries')}
+    if state == 'RETRY':
+        return {'status': 'queued', 'error': str(result)}
+    return {'status': 'failed', 'error': str(result)}
+
+
+def job_status(result: dict) -> str:
+    """Converte o estado final devolvido pelo executor no status do Job."""
+    if result.get('status') in ('timeout', 'cpu_limit', 'compile_timeout'):
+        return 'timeout'
+    if result.get('status') in ('ok', 'output_limit') and result.get('exit_code') == 0:
+        return 'succeeded'
+    return 'failed'
+
+
+def job_trace(enqueued_at, dequeued_at, executed_at, result: dict) -> dict:
+    """
+    Instantes (epoch, s) das fases vistas pelo worker e durações (ms) das
+    fases no executor; o instante "written" é acrescentado no fim do job.
+    Ver trace_phases em main.py.
+    """
+    return {
+        'enqueued': enqueued_at,
+        'dequeued': dequeued_at,
+        'executed': executed_at,
+        'executor': result.get('timings'),
+    }
+
+
+def suite_usage(cases: list):
+    """CPU somado e pico de memória máximo dos casos de uma suite."""
+    usages = [case['usage'] for case in cases if case.get('usage')]
+    if not usages:
+        return None
+    return {
+        'cpu_ms':            round(sum(u['cpu_ms'] for u in usages), 1),
+        'peak_memory_bytes': max(u['peak_memory_bytes'] for u in usages),
+    }
+
+
+@app.task(bind=True, base=JobTask, max_retries=20)
+def execute_script(self, job_id: str, language: str, output_dir: str = None,
+                   script_digest: str = None, input_digest: str = None,
+                   script_path: str = None, input_path: str = None, cache: bool = False,
+                   plan: str = None, enqueued_at: float = None, executor_retries: int = 0):
     """
     Executa o script via HTTP no executor e grava
     o output em /app/jobs/<username>/<job_id>.out.txt
+
+    O script e o input vão por referência (digests do blob store, que o
+    executor lê do volume partilhado); script_path/input_path só existem
+    em jobs enfileirados antes disso e seguem em multipart.
+    Com cache=True o resultado fica na cache de resultados (result_cache.py).
+    `plan` escolhe os limites de CPU/memória aplicados pelo executor.
+    `enqueued_at`: instante em que o job entrou na fila Celery (trace).
+    `executor_retries`: falhas do executor até aqui (ver retry_with_backoff).
     """
-    # Prepara ficheiros multipart para o executor
-    files = {
-        'file': (os.path.basename(script_path), open(script_path, 'rb'))
-    }
-    if input_path:
-        files['input'] = (os.path.basename(input_path), open(input_path, 'rb'))
+    dequeued_at = time.time()
+    mark_running(self, job_id)
 
     # Dados adicionais (inclui job_id caso o executor use)
     data = {'language': language, 'job_id': job_id}
-    response = run_job(files=files, data=data)
-    output = response.json().get('output', '') if response.ok else f" {response.status_code}: {response.text}"
+    if plan:
+        data['plan'] = plan
 
     # Define o path de output usando o job_id como nome
-    dirpath = os.path.dirname(script_path)
+    dirpath = output_dir or os.path.dirname(script_path)
     out_filename = f"{job_id}.out.txt"
     out_path = os.path.join(dirpath, out_filename)
 
-    # Grava o output no ficheiro corretamente nomeado
-    with open(out_path, 'w') as f:
-        f.write(output)
+    # O output chega em streaming e é acrescentado por chunks a um ficheiro
+    # temporário, renomeado no fim para quem faz polling nunca ler output parcial
+    part_path = out_path + '.part'
+    started = time.monotonic()
+    try:
+        if script_digest:
+            data['script_digest'] = script_digest
+            if input_digest:
+                data['input_digest'] = input_digest
+            response = run_job(files=None, data=data, stream=True)
+        else:
+            # Ficheiros multipart; só são precisos até o pedido ter sido enviado
+            with ExitStack() as stack:
+                files = {
+                    'file': (os.path.basename(script_path), stack.enter_context(open(script_path, 'rb')))
+                }
+                if input_path:
+                    files['input'] = (os.path.basename(input_path), stack.enter_context(open(input_path, 'rb')))
+                response = run_job(files=files, data=data, stream=True)
+
+        with response:
+            # Executor saturado (429): volta para a fila e tenta mais tarde
+            if response.status_code == 429:
+                retry_after = int(response.headers.get('Retry-After', 2))
+                raise self.retry(countdown=retry_after)
+            if response.status_code >= 500:
+                raise ExecutorUnavailable(f"{response.status_code}: {response.text}")
+            result = write_output(response, part_path)
+    except (requests.RequestException, ExecutorUnavailable) as e:
+        raise retry_with_backoff(self, e)
+    executed_at = time.time()
+    record_latency('execute', 'total', time.monotonic() - started)
+    os.replace(part_path, out_path)
+
+    status = job_status(result)
+    usage = result.get('usage')
+    trace = job_trace(enqueued_at, dequeued_at, executed_at, result)
+    trace['written'] = time.time()
+    mark_job_finished(job_id, status, result.get('exit_code'), os.path.getsize(out_path), out_path,
+                      usage=usage, trace=trace)
+    if cache and script_digest:
+        result_cache.store(language, plan, script_digest, input_digest, result, status, out_path)
+
+    # Avisa quem está à espera (SSE / long-poll em /job-result)
+    publish_job_done(job_id, out_path, status, usage)
+
+    return {'job_id': job_id, 'output_path': out_path, 'status': status, 'exit_code': result.get('exit_code')}
+
+
+def write_output(response, part_path: str) -> dict:
+    """
+    Grava o output recebido em streaming; devolve o estado final do executor.
+    Sem o frame de estado o stream ficou a meio: levanta ExecutorUnavailable
+    (o job é repetido, não fica registado como erro do script).
+    """
+    result = {'status': 'error', 'exit_code': None}
+    with open(part_path, 'wb') as f:
+        if not response.ok:
+            f.write(f" {response.status_code}: {response.text}".encode())
+            return result
+        result    = None
+        written   = 0
+        truncated = False
+        for kind, chunk in iter_frames(response):
+            if kind == b'S':
+                result = chunk
+            elif truncated:
+                continue  # descarta, mas continua até ao frame de estado
+            elif written + len(chunk) > MAX_OUTPUT_BYTES:
+                f.write(chunk[:MAX_OUTPUT_BYTES - written])
+                f.write(b"\n Limite de output excedido.")
+                truncated = True
+            else:
+                f.write(chunk)
+                written += len(chunk)
+    if result is None:
+        raise ExecutorUnavailable("o stream do executor terminou sem o frame de estado")
+    return result
+
+
+@app.task(bind=True, base=JobTask, max_retries=20)
+def execute_suite(self, job_id: str, language: str, output_dir: str = None,
+                  script_digest: str = None, inputs: list = None,
+                  script_path: str = None, input_paths: list = None, plan: str = None,
+                  enqueued_at: float = None, executor_retries: int = 0):
+    """
+    Corre o script contra cada input num só pedido ao executor (que compila
+    uma vez) e grava o resultado em JSON em /app/jobs/<username>/<job_id>.out.txt
+
+    inputs: [[nome, digest], ...] no blob store (script_path/input_paths
+    só em jobs enfileirados antes do blob store).
+    """
+    dequeued_at = time.time()
+    mark_running(self, job_id)
+
+    out_path = os.path.join(output_dir or os.path.dirname(script_path), f"{job_id}.out.txt")
+    data     = {'language': language, 'job_id': job_id}
+    if plan:
+        data['plan'] = plan
+    try:
+        if script_digest:
+            data.update(script_digest=script_digest, input_blobs=json.dumps(inputs))
+            timeout  = SUITE_BASE_TIMEOUT + SUITE_CASE_TIMEOUT * len(inputs)
+            response = run_suite(files=None, data=data, timeout=timeout)
+        else:
+            with ExitStack() as stack:
+                files = [('file', (os.path.basename(script_path), stack.enter_context(open(script_path, 'rb'))))]
+                for path in input_paths:
+                    files.append(('input', (os.path.basename(path), stack.enter_context(open(path, 'rb')))))
+                timeout  = SUITE_BASE_TIMEOUT + SUITE_CASE_TIMEOUT * len(input_paths)
+                response = run_suite(files=files, data=data, timeout=timeout)
+    except requests.RequestException as e:
+        raise retry_with_backoff(self, e)
+
+    # Executor saturado (429): volta para a fila e tenta mais tarde
+    if response.status_code == 429:
+        retry_after = int(response.headers.get('Retry-After', 2))
+        raise self.retry(countdown=retry_after)
+    if response.status_code >= 500:
+        raise retry_with_backoff(self, ExecutorUnavailable(f"{response.status_code}: {response.text}"))
+
+    if response.ok:
+        result = response.json()
+    else:
+        result = {'status': 'error', 'output': f" {response.status_code}: {response.text}", 'results': []}
+    executed_at = time.time()
+
+    # O job só tem sucesso se todos os casos tiverem
+    cases = result.get('results', [])
+    if result.get('status') != 'ok':
+        status = job_status(result)
+    else:
+        statuses = [job_status(case) for case in cases]
+        status = 'succeeded' if all(s == 'succeeded' for s in statuses) else \
+            'timeout' if 'timeout' in statuses else 'failed'
+
+    part_path = out_path + '.part'
+    with open(part_path, 'w') as f:
+        json.dump(result, f)
+    os.replace(part_path, out_path)
+
+    usage = suite_usage(result.get('results', []))
+    trace = job_trace(enqueued_at, dequeued_at, executed_at, result)
+    trace['written'] = time.time()
+    mark_job_finished(job_id, status, None, os.path.getsize(out_path), out_path,
+                      usage=usage, trace=trace)
+    publish_job_done(job_id, out_path, status, usage)
 
-    return {'job_id': job_id, 'output_path': out_path}
+    return {'job_id': job_id, 'output_path': out_path, 'status': status, 'exit_code': None}
@@ -0,0 +1,116 @@
+"""
+Leitura dos blobs (scripts e inputs) endereçados por sha256.
+
+O worker envia só os digests; o executor usa o ficheiro do volume
+partilhado BLOB_DIR (mesma estrutura que backend/blob_store.py) e, se o
+volume não estiver montado ou o blob ainda não estiver lá, descarrega-o
+do backend (BLOB_SOURCE_URL/<digest>, autenticado com BLOB_FETCH_TOKEN),
+verifica o hash e guarda-o em BLOB_CACHE_DIR para os pedidos seguintes.
+
+BLOB_DIR é do backend (só ele apaga blobs); a cache dos descarregados é
+do executor e é podada por LRU (mtime) quando passa de
+BLOB_CACHE_MAX_BYTES, como a compile_cache.
+"""
+import hashlib
+import os
+import re
+import time
+import uuid
+
+import aiohttp
+
+BLOB_DIR             = os.environ.get("BLOB_DIR", "/app/blobs")
+BLOB_SOURCE_URL      = os.environ.get("BLOB_SOURCE_URL", "http://backend:5000/blobs")
+BLOB_FETCH_TOKEN     = os.environ.get("BLOB_FETCH_TOKEN", "")
+BLOB_CACHE_DIR       = os.environ.get("BLOB_CACHE_DIR", "/app/blob-cache")
+BLOB_CACHE_MAX_BYTES = int(os.environ.get("BLOB_CACHE_MAX_BYTES", str(1024 * 1024 * 1024)))
+BLOB_CACHE_TMP_TTL   = 3600   # temporários de descargas interrompidas
+CHUNK_SIZE           = 64 * 1024
+
+DIGEST_RE = re.compile(r"^[0-9a-f]{64}$")
+
+
+class BlobNotFound(Exception):
+    pass
+
+
+def blob_path(digest, root=BLOB_DIR):
+    if not DIGEST_RE.match(digest or ""):
+        raise BlobNotFound(f"digest inválido: {digest!r}")
+    return os.path.join(root, digest[:2], digest)
+
+
+async def fetch(session, digest):
+    """Caminho local do blob, descarregando-o se ainda não existir."""
+    path = blob_path(digest)
+    if os.path.exists(path):
+        return path
+    path = blob_path(digest, BLOB_CACHE_DIR)
+    if os.path.exists(path):
+        os.utime(path)  # marca como usado recentemente (LRU)
+        return path
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+    h = hashlib.sha256()
+    try:
+        async with session.get(f"{BLOB_SOURCE_URL}/{digest}") as response:
+            if response.status != 200:
+                raise BlobNotFound(f"blob {digest} indisponível ({response.status})")
+            with open(tmp_path, "wb") as f:
+                async for chunk in response.content.iter_chunked(CHUNK_SIZE):
+                    h.update(chunk)
+                    f.write(chunk)
+        if h.hexdigest() != digest:
+            raise BlobNotFound(f"blob {digest} corrompido")
+        # Pedidos simultâneos do mesmo blob escrevem o mesmo conteúdo
+        os.replace(tmp_path, path)
+    except aiohttp.ClientError as e:
+        raise BlobNotFound(f"blob {digest} indisponível ({e})")
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    evict()
+    return path
+
+
+def evict(max_bytes=BLOB_CACHE_MAX_BYTES):
+    """Remove os blobs descarregados menos usados até caber em max_bytes."""
+    entries = []
+    total   = 0
+    tmp_cutoff = time.time() - BLOB_CACHE_TMP_TTL
+    for shard in os.scandir(BLOB_CACHE_DIR):
+        if not shard.is_dir():
+            continue
+        for entry in os.scandir(shard.path):
+            try:
+                st = entry.stat()
+                if entry.name.endswith(".tmp"):
+                    if st.st_mtime < tmp_cutoff:
+                        os.remove(entry.path)
+                    continue
+            except FileNotFoundError:
+                continue
+            entries.append((st.st_mtime, st.st_size, entry.path))
+            total += st.st_size
+
+    entries.sort()
+    for _, size, path in entries:
+        if total <= max_bytes:
+            break
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        total -= size
+
+
+async def init_session(app):
+    app["blob_session"] = aiohttp.ClientSession(
+        timeout=aiohttp.ClientTimeout(total=60),
+        headers={"X-Blob-Token": BLOB_FETCH_TOKEN},
+    )
+
+
+async def close_session(app):
+    await app["blob_session"].close()
@@ -0,0 +1,160 @@
+"""
+Cache de binários compilados (C++ e Rust) endereçada por conteúdo.
+
+A chave é o SHA-256 de: compilador, versão do compilador, flags e código
+fonte. Os binários ficam em COMPILE_CACHE_DIR (volume partilhado pelas
+réplicas do executor) e são removidos por LRU (mtime) quando o total passa
+de COMPILE_CACHE_MAX_BYTES.
+
+Escritas são atómicas (ficheiro temporário + os.replace) e cada chave tem
+um lock (flock) para que duas réplicas não compilem o mesmo código ao
+mesmo tempo. A compilação corre como subprocesso asyncio com
+COMPILE_TIMEOUT segundos de limite e rlimits de CPU e memória
+(COMPILE_MEMORY_MB).
+"""
+import asyncio
+import fcntl
+import hashlib
+import os
+import time
+import uuid
+
+from limits import MB, set_rlimits
+
+COMPILE_CACHE_DIR       = os.environ.get("COMPILE_CACHE_DIR", "/cache/compiled")
+COMPILE_CACHE_MAX_BYTES = int(os.environ.get("COMPILE_CACHE_MAX_BYTES", str(512 * 1024 * 1024)))
+COMPILE_TIMEOUT         = int(os.environ.get("COMPILE_TIMEOUT", "30"))
+COMPILE_MEMORY_MB       = int(os.environ.get("COMPILE_MEMORY_MB", "2048"))
+
+# O compilador corre como o executor (escreve na cache), só com rlimits
+COMPILE_LIMITS = {"cpu_seconds": COMPILE_TIMEOUT, "memory_bytes": COMPILE_MEMORY_MB * MB}
+
+_compiler_versions = {}
+
+
+class CompileTimeout(Exception):
+    pass
+
+
+async def compiler_version(compiler):
+    if compiler not in _compiler_versions:
+        proc = await asyncio.create_subprocess_exec(
+            compiler, "--version",
+            stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.DEVNULL
+        )
+        stdout, _ = await proc.communicate()
+        _compiler_versions[compiler] = stdout.decode().strip()
+    return _compiler_versions[compiler]
+
+
+async def _lock(lock_file):
+    """flock exclusivo sem bloquear o event loop."""
+    while True:
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            return
+        except BlockingIOError:
+            await asyncio.sleep(0.05)
+
+
+async def cache_key(compiler, flags, source_path):
+    h = hashlib.sha256()
+    h.update(compiler.encode())
+    h.update(b"\0")
+    h.update((await compiler_version(compiler)).encode())
+    h.update(b"\0")
+    h.update(" ".join(flags).encode())
+    h.update(b"\0")
+    with open(source_path, "rb") as f:
+        for chunk in iter(lambda: f.read(65536), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+class CompileCache:
+    def __init__(self, root=COMPILE_CACHE_DIR, max_bytes=COMPILE_CACHE_MAX_BYTES):
+        self.root      = root
+        self.max_bytes = max_bytes
+        os.makedirs(self.root, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.root, key)
+
+    async def get_or_compile(self, compiler, flags, source_path):
+        """
+        Devolve (caminho_do_binário, None) ou (None, stderr_da_compilação).
+        Levanta CompileTimeout se a compilação exceder COMPILE_TIMEOUT.
+        """
+        key = await cache_key(compiler, flags, source_path)
+        exe_path = self._path(key)
+
+        if os.path.exists(exe_path):
+            os.utime(exe_path)  # marca como usado recentemente (LRU)
+            return exe_path, None
+
+        lock_path = exe_path + ".lock"
+        with open(lock_path, "w") as lock:
+            await _lock(lock)
+            # Outra réplica pode ter compilado enquanto esperávamos
+            if os.path.exists(exe_path):
+                os.utime(exe_path)
+                return exe_path, None
+
+            tmp_path = f"{exe_path}.tmp.{uuid.uuid4().hex}"
+            proc = await asyncio.create_subprocess_exec(
+                compiler, *flags, source_path, "-o", tmp_path,
+                stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE,
+                preexec_fn=lambda: set_rlimits(COMPILE_LIMITS, uid=None)
+            )
+            try:
+                _, stderr = await asyncio.wait_for(proc.communicate(), COMPILE_TIMEOUT)
+            except asyncio.TimeoutError:
+                proc.kill()
+                await proc.wait()
+                stderr = None
+            if proc.returncode != 0 or stderr is None:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+                # Sem binário o evict nunca apagaria o lock desta chave
+                os.remove(lock_path)
+                if stderr is None:
+                    raise CompileTimeout()
+                return None, stderr.decode(errors="replace")
+            os.replace(tmp_path, exe_path)
+
+        self.evict()
+        return exe_path, None
+
+    def evict(self):
+        """
+        Remove os binários menos usados até caber em max_bytes, e os locks
+        e temporários com mais de COMPILE_TIMEOUT s que ficaram sem binário
+        (réplica morta a meio de uma compilação).
+        """
+        entries = []
+        total = 0
+        stale = time.time() - COMPILE_TIMEOUT
+        for name in os.listdir(self.root):
+            path = self._path(name)
+            try:
+                st = os.stat(path)
+                if "." in name:  # locks e temporários
+                    orphan = ".tmp." in name or not os.path.exists(self._path(name.split(".")[0]))
+                    if orphan and st.st_mtime < stale:
+                        os.remove(path)
+                    continue
+            except FileNotFoundError:
+                continue
+            entries.append((st.st_mtime, st.st_size, path))
+            total += st.st_size
+
+        entries.sort()
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            for p in (path, path + ".lock"):
+                try:
+                    os.remove(p)
+                except FileNotFoundError:
+                    pass
+            total -= size
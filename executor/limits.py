@@ -0,0 +1,255 @@
+"""
+Limites de recursos por execução e medição do que cada job gastou.
+
+Cada job corre com rlimits próprios, definidos por linguagem e por plano
+do utilizador (enviado pelo worker no campo "plan"):
+
+- cpu_seconds:  RLIMIT_CPU (SIGXCPU ao atingir; SIGKILL um segundo depois);
+- memory_bytes: RLIMIT_DATA (heap + mapeamentos privados; o RLIMIT_RSS é
+  ignorado pelo Linux e o RLIMIT_AS falha com o V8, que reserva muito
+  espaço de endereçamento à partida);
+- processes:    RLIMIT_NPROC, contado por uid; só tem efeito com JOB_UID
+  (o Linux não o aplica ao root), e conta todos os jobs desse uid;
+- output_bytes: limite do sink (ver output.py) e RLIMIT_FSIZE;
+- wall_seconds: timeout de relógio, como antes.
+
+Os jobs correm numa sessão própria (o grupo inteiro é morto no fim, com
+os netos que o script tenha deixado) e são recolhidos com wait4(), que
+devolve o tempo de CPU e o pico de memória (ru_maxrss). O ru_maxrss
+conta também a memória do processo que fez o fork (o executor, a frio,
+ou o runner Python), por isso em programas pequenos é um majorante.
+"""
+import asyncio
+import math
+import os
+import resource
+import signal
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+from output import MAX_OUTPUT_BYTES, pipe_reader
+
+MB = 1024 * 1024
+
+# uid sem privilégios para os jobs (só aplicado se o executor correr como root)
+JOB_UID = int(os.environ["JOB_UID"]) if os.environ.get("JOB_UID") else None
+
+# Sem pidfd (Linux < 5.3), cada processo vivo ocupa uma thread bloqueada
+# em wait4(): num executor próprio, para os runners node parados à espera
+# de um job não esgotarem o executor por omissão do loop (DNS, ficheiros)
+WAIT4_THREADS = ThreadPoolExecutor(
+    max_workers=int(os.environ.get("WAIT4_THREADS", "256")), thread_name_prefix="wait4"
+)
+CLOCK_TICKS = os.sysconf("SC_CLK_TCK")
+
+DEFAULT_LIMITS = {
+    "wall_seconds": int(os.environ.get("RUN_TIMEOUT", "10")),
+    "cpu_seconds":  int(os.environ.get("LIMIT_CPU_SECONDS", "10")),
+    "memory_bytes": int(os.environ.get("LIMIT_MEMORY_MB", "256")) * MB,
+    "processes":    int(os.environ.get("LIMIT_PROCESSES", "64")),
+    "output_bytes": MAX_OUTPUT_BYTES,
+}
+
+# Ajustes por toolchain (ver TOOLCHAINS em main.py)
+LANGUAGE_LIMITS = {
+    "node": {"memory_bytes": 512 * MB},   # o V8 sozinho já ocupa ~50 MB
+}
+
+# Fator aplicado ao tempo e à memória por plano (ver User.plan no backend)
+PLAN_SCALE = {
+    "free":     1,
+    "basic":    1.5,
+    "standard": 2,
+    "premium":  4,
+}
+SCALED = ("wall_seconds", "cpu_seconds", "memory_bytes")
+
+
+def resolve(toolchain, plan=None):
+    """Limites de um job de `toolchain` para um utilizador do `plan`."""
+    limits = {**DEFAULT_LIMITS, **LANGUAGE_LIMITS.get(toolchain, {})}
+    scale  = PLAN_SCALE.get(plan, 1)
+    for name in SCALED:
+        limits[name] = int(limits[name] * scale)
+    return limits
+
+
+def ceiling(toolchain):
+    """Limites do plano mais alto (processos criados antes de se saber o plano)."""
+    return resolve(toolchain, max(PLAN_SCALE, key=PLAN_SCALE.get))
+
+
+def _rlimits(limits):
+    values = [
+        (resource.RLIMIT_CPU,   limits.get("cpu_seconds"), 1),
+        (resource.RLIMIT_DATA,  limits.get("memory_bytes"), 0),
+        (resource.RLIMIT_NPROC, limits.get("processes"), 0),
+        (resource.RLIMIT_FSIZE, limits.get("output_bytes"), 0),
+    ]
+    # hard um pouco acima do soft no CPU: primeiro SIGXCPU, depois SIGKILL
+    return [(res, (value, value + extra)) for res, value, extra in values if value is not None]
+
+
+def set_rlimits(limits, uid=JOB_UID):
+    """Aplica os limites ao processo atual (no filho, antes do exec)."""
+    resource.setrlimit(resource.RLIMIT_CORE, (0, 0))
+    for res, value in _rlimits(limits):
+        resource.setrlimit(res, value)
+    if uid is not None and os.geteuid() == 0:
+        os.setgroups([])
+        os.setgid(uid)
+        os.setuid(uid)
+
+
+def apply_to_pid(pid, limits, cpu_used=0.0):
+    """
+    Ajusta os limites de um processo já criado (runners node pré-arrancados).
+    O RLIMIT_CPU conta o CPU desde o arranque: soma-se o já gasto
+    (`cpu_used`, s) para o job ter o seu limite inteiro.
+    """
+    if cpu_used and limits.get("cpu_seconds") is not None:
+        limits = dict(limits, cpu_seconds=limits["cpu_seconds"] + math.ceil(cpu_used))
+    for res, value in _rlimits(limits):
+        resource.prlimit(pid, res, value)
+
+
+def cpu_seconds_used(pid):
+    """CPU (utime + stime, s) gasto até agora pelo processo, de /proc/<pid>/stat."""
+    with open(f"/proc/{pid}/stat") as f:
+        fields = f.read().rsplit(")", 1)[1].split()
+    return (int(fields[11]) + int(fields[12])) / CLOCK_TICKS
+
+
+def own_workdir(path):
+    """Dá a pasta de trabalho do job ao JOB_UID, para o script lá poder escrever."""
+    if JOB_UID is not None and os.geteuid() == 0:
+        os.chown(path, JOB_UID, JOB_UID)
+
+
+def rusage_usage(rusage):
+    return {
+        "cpu_ms":            round((rusage.ru_utime + rusage.ru_stime) * 1000, 1),
+        "peak_memory_bytes": rusage.ru_maxrss * 1024,   # ru_maxrss vem em KB
+    }
+
+
+def cpu_exceeded(exit_code, usage, limits):
+    """O processo foi morto por ter gasto o tempo de CPU todo?"""
+    if exit_code == -signal.SIGXCPU:
+        return True
+    return (
+        exit_code == -signal.SIGKILL
+        and usage is not None
+        and usage["cpu_ms"] >= limits["cpu_seconds"] * 1000
+    )
+
+
+class LimitedProcess:
+    """
+    Subprocesso com rlimits, recolhido com wait4() (o asyncio usa waitpid
+    e perde o rusage) quando o pidfd fica legível, ou numa thread de
+    WAIT4_THREADS sem pidfd. Tem a interface de asyncio.subprocess.Process
+    usada por output.communicate().
+    """
+
+    @classmethod
+    async def start(cls, cmd, limits, stdin=None, pipe_stdin=False, pass_fds=(), cwd=None):
+        loop = asyncio.get_running_loop()
+        out_r, out_w = os.pipe()
+        err_r, err_w = os.pipe()
+        in_r, in_w = os.pipe() if pipe_stdin else (None, None)
+        try:
+            popen = subprocess.Popen(
+                cmd,
+                stdin=in_r if pipe_stdin else (stdin or subprocess.DEVNULL),
+                stdout=out_w,
+                stderr=err_w,
+                preexec_fn=lambda: set_rlimits(limits),
+                start_new_session=True,
+                pass_fds=pass_fds,
+                cwd=cwd,
+            )
+        except BaseException:
+            for fd in (out_r, err_r, in_w):
+                if fd is not None:
+                    os.close(fd)
+            raise
+        finally:
+            for fd in (out_w, err_w, in_r):
+                if fd is not None:
+                    os.close(fd)
+
+        proc = cls()
+        proc.pid        = popen.pid
+        proc.returncode = None
+        proc.usage      = None
+        # CPU (ms) gasto antes de receber o job, descontado no usage
+        proc.cpu_offset_ms = 0.0
+        proc._popen     = popen
+        proc._transports = []
+        proc.stdout = await proc._reader(out_r)
+        proc.stderr = await proc._reader(err_r)
+        proc.stdin  = None
+        if in_w is not None:
+            transport, protocol = await loop.connect_write_pipe(
+                lambda: asyncio.StreamReaderProtocol(asyncio.StreamReader()),
+                os.fdopen(in_w, "wb", buffering=0),
+            )
+            proc._transports.append(transport)
+            proc.stdin = asyncio.StreamWriter(transport, protocol, None, loop)
+        proc._waiter = proc._watch_exit(loop)
+        proc._waiter.add_done_callback(proc._exited)
+        return proc
+
+    def _watch_exit(self, loop):
+        """Future com o resultado de wait4(), sem bloquear uma thread por processo."""
+        try:
+            pidfd = os.pidfd_open(self.pid)
+        except (AttributeError, OSError):
+            return loop.run_in_executor(WAIT4_THREADS, os.wait4, self.pid, 0)
+        waiter = loop.create_future()
+
+        def ready():
+            loop.remove_reader(pidfd)
+            os.close(pidfd)
+            try:
+                waiter.set_result(os.wait4(self.pid, 0))   # já terminou: não bloqueia
+            except OSError as e:
+                waiter.set_exception(e)
+
+        loop.add_reader(pidfd, ready)
+        return waiter
+
+    def _exited(self, waiter):
+        _, status, rusage = waiter.result()
+        self.returncode = os.waitstatus_to_exitcode(status)
+        self.usage      = rusage_usage(rusage)
+        self.usage["cpu_ms"] = round(max(self.usage["cpu_ms"] - self.cpu_offset_ms, 0), 1)
+        self._popen.returncode = self.returncode
+        # netos que o job tenha deixado não sobrevivem ao job
+        self._kill_group()
+
+    async def _reader(self, fd):
+        reader, transport = await pipe_reader(fd)
+        self._transports.append(transport)
+        return reader
+
+    async def wait(self):
+        # shield: um timeout em quem espera não pode cancelar o wait4()
+        await asyncio.shield(self._waiter)
+        return self.returncode
+
+    def kill(self):
+        if self.returncode is None:
+            self._kill_group()
+
+    def _kill_group(self):
+        try:
+            os.killpg(self.pid, signal.SIGKILL)
+        except (ProcessLookupError, PermissionError):
+            pass
+
+    def close(self):
+        """Fecha os pipes (o que ficou por ler é descartado)."""
+        for transport in self._transports:
+            transport.close()
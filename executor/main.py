@@ -1,86 +1,540 @@
-from flask import Flask, request, jsonify
+from aiohttp import web
+import asyncio
+import collections
+import json
 import os
-import subprocess
+import shutil
+import tempfile
+import time
 import uuid
 
-app = Flask(__name__)
+import blob_store
+import prometheus
+from blob_store import BlobNotFound
+from compile_cache import CompileCache, CompileTimeout, compiler_version
+from limits import LimitedProcess, cpu_exceeded, own_workdir, resolve as resolve_limits
+from output import STREAM_CONTENT_TYPE, BufferSink, StreamSink, communicate
+from runner_pool import init_pools, pools, run_warm
 
-@app.route("/execute", methods=["POST"])
-def execute_code():
-    file = request.files.get("file")
-    language = request.form.get("language", "python")
-    input_file = request.files.get("input")  # ← input.txt opcional
+# Capacidade por pod: jobs em execução simultânea + jobs à espera de vez.
+# Acima disso respondemos 429 com Retry-After em vez de deixar o pedido
+# pendurado até ao timeout do worker.
+MAX_CONCURRENT_JOBS = int(os.environ.get("MAX_CONCURRENT_JOBS", str(os.cpu_count() or 2)))
+MAX_QUEUED_JOBS     = int(os.environ.get("MAX_QUEUED_JOBS", "16"))
+RETRY_AFTER_SECONDS = int(os.environ.get("RETRY_AFTER_SECONDS", "2"))
+# Espera máxima por um lugar. Tem de ficar bem abaixo do timeout de
+# leitura do worker (60 s): senão o worker desiste e repete o pedido
+# enquanto o original ainda vai correr aqui, e o job corre duas vezes.
+ADMISSION_TIMEOUT   = float(os.environ.get("ADMISSION_TIMEOUT", "20"))
 
-    if not file:
-        return jsonify({"error": "Nenhum ficheiro enviado."}), 400
+# /execute-suite: máximo de inputs por pedido e de output guardado por input
+SUITE_MAX_INPUTS        = int(os.environ.get("SUITE_MAX_INPUTS", "200"))
+SUITE_CASE_OUTPUT_BYTES = int(os.environ.get("SUITE_CASE_OUTPUT_BYTES", str(1024 * 1024)))
 
-    file_ext = language.lower()
-    file_uuid = uuid.uuid4().hex
-    filename = f"/tmp/{file_uuid}.{file_ext}"
-    file.save(filename)
+compile_cache = CompileCache()
 
-    input_path = None
-    if input_file:
-        input_path = f"/tmp/{file_uuid}_input.txt"
-        input_file.save(input_path)
+# Flags de compilação por compilador (fazem parte da chave da cache)
+COMPILE_FLAGS = {
+    "g++":   [],
+    "rustc": [],
+}
+
+
+class Admission:
+    """Semáforo de execução + fila de admissão limitada."""
+
+    def __init__(self, concurrency, queue_size):
+        self.concurrency = concurrency
+        self.capacity    = concurrency + queue_size
+        self.semaphore   = asyncio.Semaphore(concurrency)
+        self.pending     = 0  # a correr + à espera
+        self.rejected    = 0  # pedidos recusados com 429 (fila cheia)
+        self.expired     = 0  # pedidos recusados com 429 (espera > ADMISSION_TIMEOUT)
+        self.finished    = collections.Counter()  # jobs terminados por status
+
+    def full(self):
+        return self.pending >= self.capacity
+
+    def running(self):
+        return min(self.pending, self.concurrency)
+
+
+admission = None
+
+
+async def init_admission(app):
+    # Criado já dentro do event loop do servidor
+    global admission
+    admission = Admission(MAX_CONCURRENT_JOBS, MAX_QUEUED_JOBS)
+
+
+class RunTimeout(Exception):
+    pass
+
+
+class CompileError(Exception):
+    pass
+
+
+async def run_process(cmd, input_path, sink, limits):
+    """Executa `cmd` com os `limits` (ver limits.py), escrevendo o output no
+    sink. Devolve (exit code, uso de CPU/memória)."""
+    # Pasta de trabalho própria, como nos runners quentes
+    workdir = tempfile.mkdtemp(prefix="job_", dir="/tmp")
+    own_workdir(workdir)
+    f_in = open(input_path, "rb") if input_path else None
+    try:
+        proc = await LimitedProcess.start(cmd, limits, stdin=f_in, cwd=workdir)
+    except BaseException:
+        shutil.rmtree(workdir, ignore_errors=True)
+        raise
+    finally:
+        if f_in:
+            f_in.close()
+    try:
+        stderr, timed_out = await communicate(proc, sink, limits["wall_seconds"])
+    finally:
+        proc.close()
+        shutil.rmtree(workdir, ignore_errors=True)
+    if timed_out:
+        raise RunTimeout()
+    await sink.write(stderr)
+    return proc.returncode, proc.usage
+
+
+async def run_interpreted(lang_key, cmd, filename, input_path, sink, limits):
+    """Corre num runner quente se houver um livre; senão arranca a frio."""
+    warm = await run_warm(lang_key, filename, input_path, limits, sink)
+    if warm is not None:
+        if warm.timed_out:
+            raise RunTimeout()
+        await sink.write(warm.stderr)
+        return warm.exit_code, warm.usage
+    return await run_process(cmd, input_path, sink, limits)
 
-    output = ""
 
+async def compile_program(compiler, filename):
+    """Caminho do binário (da cache ou compilado agora)."""
+    exe_file, error = await compile_cache.get_or_compile(compiler, COMPILE_FLAGS[compiler], filename)
+    if exe_file is None:
+        raise CompileError(error)
+    return exe_file
+
+
+async def prepare_compiled(compiler, filename, limits):
+    """Compila uma vez; o executor devolvido pode correr várias vezes."""
+    exe_file = await compile_program(compiler, filename)
+
+    async def run(input_path, sink):
+        nonlocal exe_file
+        try:
+            return await run_process([exe_file], input_path, sink, limits)
+        except FileNotFoundError:
+            # binário removido por LRU entretanto; recompila
+            exe_file = await compile_program(compiler, filename)
+            return await run_process([exe_file], input_path, sink, limits)
+    return run
+
+
+SUPPORTED_LANGUAGES = {"py", "python", "cpp", "c++", "js", "javascript", "rs", "rust"}
+
+# Interpretador/compilador de cada linguagem (a versão entra no "runtime")
+TOOLCHAINS = {
+    "py": "python3", "python": "python3",
+    "cpp": "g++", "c++": "g++",
+    "js": "node", "javascript": "node",
+    "rs": "rustc", "rust": "rustc",
+}
+
+
+def job_limits(language, plan):
+    return resolve_limits(TOOLCHAINS[language], plan)
+
+
+async def runtime_info(language, limits):
+    """
+    Versão da toolchain e limites com que o job corre. Vai no estado
+    final de cada job: o backend usa-o na chave da cache de resultados.
+    """
     try:
-        if language in ["py", "python"]:
-            if input_path:
-                with open(input_path, "rb") as f_in:
-                    result = subprocess.run(["python3", filename], stdin=f_in, capture_output=True, text=True, timeout=10)
-            else:
-                result = subprocess.run(["python3", filename], capture_output=True, text=True, timeout=10)
-            output = result.stdout + result.stderr
-
-        elif language in ["cpp", "c++"]:
-            exe_file = f"/tmp/{file_uuid}_cpp.out"
-            compile_cmd = ["g++", filename, "-o", exe_file]
-            compile = subprocess.run(compile_cmd, capture_output=True, text=True)
-            if compile.returncode != 0:
-                output = " Erro de compilação:\n" + compile.stderr
-            else:
-                with open(input_path, "rb") if input_path else subprocess.DEVNULL as f_in:
-                    run = subprocess.run([exe_file], stdin=f_in if input_path else None, capture_output=True, text=True, timeout=10)
-                output = run.stdout + run.stderr
-                os.remove(exe_file)
-
-        elif language in ["js", "javascript"]:
-            if input_path:
-                with open(input_path, "rb") as f_in:
-                    result = subprocess.run(["node", filename], stdin=f_in, capture_output=True, text=True, timeout=10)
-            else:
-                result = subprocess.run(["node", filename], capture_output=True, text=True, timeout=10)
-            output = result.stdout + result.stderr
-
-        elif language in ["rs", "rust"]:
-            exe_file = f"/tmp/{file_uuid}_rs.out"
-            compile_cmd = ["rustc", filename, "-o", exe_file]
-            compile = subprocess.run(compile_cmd, capture_output=True, text=True)
-            if compile.returncode != 0:
-                output = " Erro de compilação:\n" + compile.stderr
-            else:
-                with open(input_path, "rb") if input_path else subprocess.DEVNULL as f_in:
-                    run = subprocess.run([exe_file], stdin=f_in if input_path else None, capture_output=True, text=True, timeout=10)
-                output = run.stdout + run.stderr
-                os.remove(exe_file)
+        toolchain = await compiler_version(TOOLCHAINS[language])
+    except OSError:
+        toolchain = None
+    return {"toolchain": toolchain, "limits": limits}
+
+
+async def prepare_language(language, filename, limits):
+    """
+    Prepara o script (compilando, se for o caso) e devolve uma função
+    async run(input_path, sink) -> (exit code, uso de CPU/memória).
+    """
+    if language in ["py", "python"]:
+        return lambda input_path, sink: run_interpreted(
+            "python", ["python3", filename], filename, input_path, sink, limits)
+
+    elif language in ["cpp", "c++"]:
+        return await prepare_compiled("g++", filename, limits)
+
+    elif language in ["js", "javascript"]:
+        return lambda input_path, sink: run_interpreted(
+            "js", ["node", filename], filename, input_path, sink, limits)
+
+    elif language in ["rs", "rust"]:
+        return await prepare_compiled("rustc", filename, limits)
+
+
+async def run_language(language, filename, input_path, sink, limits, timings):
+    """
+    Executa o job e devolve (exit code, uso de CPU/memória). Acrescenta a
+    `timings` a duração da compilação e da execução (ms).
+    """
+    started = time.monotonic()
+    try:
+        run = await prepare_language(language, filename, limits)
+    finally:
+        timings["compile_ms"] = elapsed_ms(started)
+    started = time.monotonic()
+    try:
+        return await run(input_path, sink)
+    finally:
+        timings["run_ms"] = elapsed_ms(started)
+
+
+def elapsed_ms(started):
+    return round((time.monotonic() - started) * 1000, 1)
+
+
+async def save_upload(request, file_uuid, inputs=None):
+    """
+    Lê o multipart em streaming para /tmp sem o carregar em memória.
+    Devolve (campos_de_texto, caminho_do_script, caminho_do_input).
+    Se `inputs` for uma lista, cada parte "input" é acrescentada como
+    (nome, caminho) em vez de substituir a anterior.
+    """
+    fields = {}
+    script_tmp = None
+    input_path = None
 
+    reader = await request.multipart()
+    async for part in reader:
+        if part.name == "file":
+            script_tmp = f"/tmp/{file_uuid}.upload"
+            target = script_tmp
+        elif part.name == "input" and inputs is not None:
+            target = f"/tmp/{file_uuid}_input{len(inputs)}.txt"
+            inputs.append((part.filename or str(len(inputs)), target))
+            if len(inputs) > SUITE_MAX_INPUTS:
+                # continua a ler o corpo, mas sem gravar
+                target = os.devnull
+        elif part.name == "input":
+            input_path = f"/tmp/{file_uuid}_input.txt"
+            target = input_path
         else:
-            return jsonify({"error": "Linguagem não suportada."}), 400
+            fields[part.name] = await part.text()
+            continue
+        with open(target, "wb") as f:
+            while True:
+                chunk = await part.read_chunk()
+                if not chunk:
+                    break
+                f.write(chunk)
+    return fields, script_tmp, input_path
+
+
+async def link_blobs(request, fields, file_uuid, script_tmp, input_path, inputs=None):
+    """
+    Pedidos por referência: em vez das partes "file"/"input" chegam os
+    digests (script_digest, input_digest ou, em suites, input_blobs com
+    [[nome, digest], ...]). Os blobs são ligados (symlink) aos mesmos
+    caminhos temporários de um upload, por isso o resto do fluxo não muda
+    e apagar esses caminhos no fim não toca no blob.
+    Levanta BlobNotFound.
+    """
+    session = request.app["blob_session"]
+    if not script_tmp and fields.get("script_digest"):
+        script_tmp = f"/tmp/{file_uuid}.upload"
+        os.symlink(await blob_store.fetch(session, fields["script_digest"]), script_tmp)
+
+    if inputs is None:
+        if not input_path and fields.get("input_digest"):
+            input_path = f"/tmp/{file_uuid}_input.txt"
+            os.symlink(await blob_store.fetch(session, fields["input_digest"]), input_path)
+    elif fields.get("input_blobs"):
+        for name, digest in json.loads(fields["input_blobs"]):
+            target = f"/tmp/{file_uuid}_input{len(inputs)}.txt"
+            inputs.append((name, target))
+            if len(inputs) > SUITE_MAX_INPUTS:
+                break
+            os.symlink(await blob_store.fetch(session, digest), target)
+    return script_tmp, input_path
+
+
+def remove_temp(*paths):
+    for path in paths:
+        if path and path != os.devnull and os.path.lexists(path):
+            os.remove(path)
+
+
+def saturated():
+    return web.json_response(
+        {"error": "Executor saturado, tente novamente."},
+        status=429,
+        headers={"Retry-After": str(RETRY_AFTER_SECONDS)},
+    )
+
+
+async def admit(handler, request):
+    """
+    Corre `handler` com um lugar no semáforo. Responde 429 se a fila
+    estiver cheia ou se o lugar não aparecer em ADMISSION_TIMEOUT s.
+    """
+    if admission.full():
+        admission.rejected += 1
+        return saturated()
+
+    # para o handler medir a espera por um lugar (timings["admission_ms"])
+    request["arrived"] = time.monotonic()
+    admission.pending += 1
+    try:
+        try:
+            await asyncio.wait_for(admission.semaphore.acquire(), ADMISSION_TIMEOUT)
+        except asyncio.TimeoutError:
+            admission.expired += 1
+            return saturated()
+        try:
+            return await handler(request)
+        finally:
+            admission.semaphore.release()
+    finally:
+        admission.pending -= 1
+
+
+async def execute_code(request):
+    return await admit(_execute, request)
+
+
+async def _execute(request):
+    # Fases do pedido no executor (ms), devolvidas no estado final; o
+    # worker junta-lhes as suas (ver trace em tasks.py)
+    started = time.monotonic()
+    timings = {"admission_ms": round((started - request["arrived"]) * 1000, 1)}
+    file_uuid = uuid.uuid4().hex
+    fields, script_tmp, input_path = await save_upload(request, file_uuid)
+    language = fields.get("language", "python")
+    # stream=1: o output segue em frames à medida que é produzido (ver output.py)
+    stream = fields.get("stream") == "1" or request.query.get("stream") == "1"
+
+    try:
+        script_tmp, input_path = await link_blobs(request, fields, file_uuid, script_tmp, input_path)
+    except BlobNotFound as e:
+        remove_temp(script_tmp, input_path, f"/tmp/{file_uuid}.upload")
+        return web.json_response({"error": str(e)}, status=404)
+
+    if not script_tmp or language not in SUPPORTED_LANGUAGES:
+        remove_temp(script_tmp, input_path)
+        if not script_tmp:
+            return web.json_response({"error": "Nenhum ficheiro enviado."}, status=400)
+        return web.json_response({"error": "Linguagem não suportada."}, status=400)
+
+    # A extensão importa (ex.: o g++ decide a linguagem por ela)
+    file_ext = language.lower()
+    filename = f"/tmp/{file_uuid}.{file_ext}"
+    os.rename(script_tmp, filename)
 
-    except subprocess.TimeoutExpired:
-        output = " Tempo limite excedido."
+    # Limites por linguagem e plano do utilizador (ver limits.py)
+    limits = job_limits(language, fields.get("plan"))
+    timings["upload_ms"] = elapsed_ms(started)
+
+    if stream:
+        response = web.StreamResponse(headers={"Content-Type": STREAM_CONTENT_TYPE})
+        response.enable_chunked_encoding()
+        await response.prepare(request)
+        sink = StreamSink(response, limits["output_bytes"])
+    else:
+        sink = BufferSink(limits["output_bytes"])
+
+    # status: ok | output_limit | cpu_limit | timeout | compile_error | compile_timeout | error
+    result = {"status": "ok", "exit_code": None, "usage": None,
+              "runtime": await runtime_info(language, limits), "timings": timings}
+    try:
+        result["exit_code"], result["usage"] = await run_language(
+            language, filename, input_path, sink, limits, timings)
+        if cpu_exceeded(result["exit_code"], result["usage"], limits):
+            result["status"] = "cpu_limit"
+            await sink.note("\n Limite de tempo de CPU excedido.")
+        elif sink.exceeded:
+            result["status"] = "output_limit"
+            await sink.note("\n Limite de output excedido.")
+    except RunTimeout:
+        result["status"] = "timeout"
+        await sink.fail(" Tempo limite excedido.")
+    except CompileError as e:
+        result["status"] = "compile_error"
+        await sink.fail(" Erro de compilação:\n" + str(e))
+    except CompileTimeout:
+        result["status"] = "compile_timeout"
+        await sink.fail(" Tempo limite de compilação excedido.")
+    except ConnectionResetError:
+        raise  # cliente desligou-se a meio do streaming
     except Exception as e:
-        output = f" Erro inesperado: {str(e)}"
+        result["status"] = "error"
+        await sink.fail(f" Erro inesperado: {str(e)}")
+    finally:
+        os.remove(filename)
+        if input_path:
+            os.remove(input_path)
+
+    result["output_bytes"] = sink.size
+    admission.finished[result["status"]] += 1
+    if stream:
+        await sink.finish(result)
+        await response.write_eof()
+        return response
+    return web.json_response({"output": sink.text(), **result})
+
+
+async def execute_suite(request):
+    """
+    Corre um script contra vários inputs (partes "input" repetidas),
+    compilando uma só vez. Ocupa um único lugar na admissão e corre os
+    casos em sequência.
+    """
+    return await admit(_execute_suite, request)
+
+
+def suite_error(script_tmp, language, inputs):
+    if not script_tmp:
+        return "Nenhum ficheiro enviado."
+    if language not in SUPPORTED_LANGUAGES:
+        return "Linguagem não suportada."
+    if not inputs:
+        return "Nenhum input enviado."
+    if len(inputs) > SUITE_MAX_INPUTS:
+        return f"Máximo de {SUITE_MAX_INPUTS} inputs por pedido."
+    return None
+
+
+async def _execute_suite(request):
+    started = time.monotonic()
+    timings = {"admission_ms": round((started - request["arrived"]) * 1000, 1)}
+    file_uuid = uuid.uuid4().hex
+    inputs = []
+    fields, script_tmp, _ = await save_upload(request, file_uuid, inputs)
+    language = fields.get("language", "python")
+
+    try:
+        script_tmp, _ = await link_blobs(request, fields, file_uuid, script_tmp, None, inputs)
+        error = suite_error(script_tmp, language, inputs)
+    except BlobNotFound as e:
+        error = str(e)
+    if error:
+        remove_temp(script_tmp, f"/tmp/{file_uuid}.upload", *(path for _, path in inputs))
+        return web.json_response({"error": error}, status=400)
+
+    filename = f"/tmp/{file_uuid}.{language.lower()}"
+    os.rename(script_tmp, filename)
+
+    limits = job_limits(language, fields.get("plan"))
+    limits["output_bytes"] = min(limits["output_bytes"], SUITE_CASE_OUTPUT_BYTES)
+
+    timings["upload_ms"] = elapsed_ms(started)
+
+    result = {"status": "ok", "results": [], "limits": limits, "timings": timings}
+    try:
+        started = time.monotonic()
+        try:
+            run = await prepare_language(language, filename, limits)
+        except CompileError as e:
+            result.update(status="compile_error", output=" Erro de compilação:\n" + str(e))
+            return web.json_response(result)
+        except CompileTimeout:
+            result.update(status="compile_timeout", output=" Tempo limite de compilação excedido.")
+            return web.json_response(result)
+        finally:
+            timings["compile_ms"] = elapsed_ms(started)
+        result["compile_ms"] = timings["compile_ms"]
+
+        for name, input_path in inputs:
+            sink = BufferSink(limits["output_bytes"])
+            case = {"name": name, "status": "ok", "exit_code": None, "usage": None}
+            started = time.monotonic()
+            try:
+                case["exit_code"], case["usage"] = await run(input_path, sink)
+                if cpu_exceeded(case["exit_code"], case["usage"], limits):
+                    case["status"] = "cpu_limit"
+                elif sink.exceeded:
+                    case["status"] = "output_limit"
+            except RunTimeout:
+                case["status"] = "timeout"
+                await sink.fail(" Tempo limite excedido.")
+            except Exception as e:
+                case["status"] = "error"
+                await sink.fail(f" Erro inesperado: {str(e)}")
+            case["duration_ms"]  = elapsed_ms(started)
+            case["output_bytes"] = sink.size
+            case["output"]       = sink.text()
+            result["results"].append(case)
+            admission.finished[case["status"]] += 1
+        timings["run_ms"] = round(sum(case["duration_ms"] for case in result["results"]), 1)
+        return web.json_response(result)
+    finally:
+        os.remove(filename)
+        for _, input_path in inputs:
+            os.remove(input_path)
+
+
+async def health(request):
+    return web.json_response({
+        "running":     admission.running(),
+        "pending":     admission.pending,
+        "concurrency": admission.concurrency,
+        "capacity":    admission.capacity,
+    })
+
+
+async def metrics(request):
+    """
+    Métricas no formato do Prometheus. mycloud_executor_saturation (pedidos
+    admitidos / lugares de execução) é o sinal do HPA do executor: acima
+    de 1 há pedidos à espera de vez.
+    """
+    families = [
+        ("mycloud_executor_inflight", "gauge", "Jobs em execução.",
+         [({}, admission.running())]),
+        ("mycloud_executor_pending", "gauge", "Pedidos admitidos (a correr + à espera).",
+         [({}, admission.pending)]),
+        ("mycloud_executor_concurrency", "gauge", "Jobs em simultâneo (MAX_CONCURRENT_JOBS).",
+         [({}, admission.concurrency)]),
+        ("mycloud_executor_capacity", "gauge", "Pedidos admitidos antes de responder 429.",
+         [({}, admission.capacity)]),
+        ("mycloud_executor_saturation", "gauge", "Pedidos admitidos por lugar de execução.",
+         [({}, admission.pending / admission.concurrency)]),
+        ("mycloud_executor_rejected_total", "counter", "Pedidos recusados com 429.",
+         [({"reason": "queue_full"}, admission.rejected),
+          ({"reason": "admission_timeout"}, admission.expired)]),
+        ("mycloud_executor_jobs_total", "counter", "Jobs (e casos de suites) terminados por status.",
+         [({"status": status}, n) for status, n in admission.finished.items()]),
+        ("mycloud_executor_warm_runners", "gauge", "Runners pré-arrancados livres por linguagem.",
+         [({"language": language}, pool.idle.qsize()) for language, pool in pools.items()]),
+    ]
+    return web.Response(
+        body=prometheus.render(families).encode(),
+        headers={"Content-Type": prometheus.CONTENT_TYPE},
+    )
 
-    os.remove(filename)
-    if input_path:
-        os.remove(input_path)
 
-    return jsonify({"output": output})
+def create_app():
+    app = web.Application()
+    app.router.add_post("/execute", execute_code)
+    app.router.add_post("/execute-suite", execute_suite)
+    app.router.add_get("/health", health)
+    app.router.add_get("/metrics", metrics)
+    app.on_startup.append(init_admission)
+    app.on_startup.append(init_pools)
+    app.on_startup.append(blob_store.init_session)
+    app.on_cleanup.append(blob_store.close_session)
+    return app
 
 
 if __name__ == "__main__":
-    app.run(host="0.0.0.0", port=8000)
+    web.run_app(create_app(), host="0.0.0.0", port=8000)
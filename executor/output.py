@@ -0,0 +1,158 @@
+"""
+Encaminhamento do output dos jobs.
+
+O stdout é copiado para um "sink" à medida que é produzido (em memória para
+respostas JSON, ou diretamente para a resposta HTTP em modo streaming). O
+stderr é recolhido à parte e escrito no fim, mantendo a ordem
+stdout + stderr de sempre. Em ambos os casos há um limite de
+MAX_OUTPUT_BYTES; ao atingi-lo o processo é terminado.
+
+Formato do streaming (STREAM_CONTENT_TYPE): sequência de frames
+`tipo (1 byte) + tamanho (4 bytes, big-endian) + dados`, com tipo
+b"O" para output e um último frame b"S" com o estado final em JSON
+({"status": ..., "exit_code": ..., "output_bytes": ...}).
+"""
+import asyncio
+import json
+import os
+import struct
+
+MAX_OUTPUT_BYTES = int(os.environ.get("MAX_OUTPUT_BYTES", str(10 * 1024 * 1024)))
+CHUNK_SIZE       = 64 * 1024
+
+STREAM_CONTENT_TYPE = "application/x-executor-frames"
+FRAME_HEADER        = struct.Struct(">cI")
+
+
+class OutputSink:
+    """Destino do output de um job, com limite de bytes."""
+
+    def __init__(self, limit=MAX_OUTPUT_BYTES):
+        self.limit    = limit
+        self.size     = 0
+        self.exceeded = False
+
+    async def write(self, data):
+        """Escreve até ao limite; devolve False quando este é atingido."""
+        room = self.limit - self.size
+        if len(data) > room:
+            data = data[:room]
+            self.exceeded = True
+        self.size += len(data)
+        if data:
+            await self._emit(data)
+        return not self.exceeded
+
+    async def note(self, message):
+        """Mensagem do executor (fora do limite)."""
+        await self._emit(message.encode())
+
+    async def fail(self, message):
+        """Erro que substitui o output (ou que o termina, em streaming)."""
+        await self.note(message)
+
+    async def finish(self, result):
+        """Estado final do job (só tem efeito em streaming)."""
+
+    async def _emit(self, data):
+        raise NotImplementedError
+
+
+class BufferSink(OutputSink):
+    def __init__(self, limit=MAX_OUTPUT_BYTES):
+        super().__init__(limit)
+        self.chunks = []
+
+    async def _emit(self, data):
+        self.chunks.append(data)
+
+    async def fail(self, message):
+        self.chunks = []
+        await self.note(message)
+
+    def text(self):
+        return b"".join(self.chunks).decode(errors="replace")
+
+
+class StreamSink(OutputSink):
+    def __init__(self, response, limit=MAX_OUTPUT_BYTES):
+        super().__init__(limit)
+        self.response = response
+
+    async def _emit(self, data):
+        await self.response.write(FRAME_HEADER.pack(b"O", len(data)) + data)
+
+    async def finish(self, result):
+        payload = json.dumps(result).encode()
+        await self.response.write(FRAME_HEADER.pack(b"S", len(payload)) + payload)
+
+
+async def pump(reader, sink):
+    """Copia `reader` para `sink` até EOF; False se o limite foi atingido."""
+    while True:
+        chunk = await reader.read(CHUNK_SIZE)
+        if not chunk:
+            return True
+        if not await sink.write(chunk):
+            return False
+
+
+async def read_capped(reader, limit):
+    """Lê até EOF guardando no máximo `limit` bytes."""
+    kept = []
+    size = 0
+    while True:
+        chunk = await reader.read(CHUNK_SIZE)
+        if not chunk:
+            return b"".join(kept)
+        if size < limit:
+            kept.append(chunk[:limit - size])
+            size += len(kept[-1])
+
+
+async def pipe_reader(fd):
+    """StreamReader asyncio sobre um fd de pipe/FIFO já aberto."""
+    loop = asyncio.get_event_loop()
+    reader = asyncio.StreamReader(limit=CHUNK_SIZE)
+    transport, _ = await loop.connect_read_pipe(
+        lambda: asyncio.StreamReaderProtocol(reader),
+        os.fdopen(fd, "rb", buffering=0),
+    )
+    return reader, transport
+
+
+async def communicate(proc, sink, timeout, stdin_data=None):
+    """
+    Como Process.communicate(), mas com o stdout encaminhado para `sink`.
+    Mata o processo se exceder `timeout` ou o limite de output.
+    Devolve (stderr, timed_out).
+    """
+    async def feed():
+        if stdin_data is None:
+            return
+        try:
+            proc.stdin.write(stdin_data)
+            await proc.stdin.drain()
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+        finally:
+            proc.stdin.close()
+
+    async def forward():
+        if not await pump(proc.stdout, sink):
+            try:
+                proc.kill()
+            except ProcessLookupError:
+                pass
+
+    try:
+        _, stderr, _, _ = await asyncio.wait_for(
+            asyncio.gather(feed(), read_capped(proc.stderr, sink.limit), forward(), proc.wait()),
+            timeout,
+        )
+    except asyncio.TimeoutError:
+        if proc.returncode is None:
+            proc.kill()
+        await proc.wait()
+        return b"", True
+    return stderr, False
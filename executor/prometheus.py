@@ -0,0 +1,40 @@
+"""
+Formato de texto do Prometheus (exposition format 0.0.4) para os
+endpoints /metrics do backend, do worker e do executor.
+
+Cada família é um tuplo (nome, tipo, ajuda, amostras); cada amostra é
+(labels, valor) ou, em histogramas, (sufixo, labels, valor) — ex.:
+("_bucket", {"le": "0.5"}, 12).
+"""
+import math
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in labels.items()) + "}"
+
+
+def _value(value):
+    if value is None:
+        return "NaN"
+    if isinstance(value, float) and math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(value) if isinstance(value, float) else str(int(value))
+
+
+def render(families):
+    lines = []
+    for name, kind, help_text, samples in families:
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {kind}")
+        for sample in samples:
+            suffix, labels, value = sample if len(sample) == 3 else ("", *sample)
+            lines.append(f"{name}{suffix}{_labels(labels)} {_value(value)}")
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,256 @@
+"""
+Pool de runners "quentes" para Python e JavaScript.
+
+Em vez de arrancar um `python3`/`node` a frio por cada pedido a /execute,
+mantemos processos já inicializados prontos a receber jobs:
+
+- Python: runners reutilizáveis (ver runners/python_runner.py) que fazem
+  fork de um filho por job; são reciclados após WARM_POOL_MAX_JOBS jobs.
+- JavaScript: processos node pré-arrancados de uso único
+  (ver runners/node_runner.js); após cada job é criado um substituto.
+
+Se não houver runner livre, `run_warm()` devolve None e o chamador segue
+pelo caminho a frio, tal como antes. O stdout dos jobs é escrito no sink
+recebido (ver output.py) à medida que é produzido.
+
+Os limites do job (ver limits.py) são aplicados pelo runner Python ao
+filho, e aos runners node (criados antes de se saber o plano, com os
+limites mais altos) através de prlimit() quando recebem o job; o CPU
+gasto pelo node a arrancar é descontado do limite e do usage.
+"""
+import asyncio
+import json
+import os
+import shutil
+import signal
+
+import limits as job_limits
+from limits import JOB_UID, LimitedProcess
+from output import communicate, pipe_reader, pump
+
+RUNNERS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "runners")
+
+WARM_POOL_SIZE     = int(os.environ.get("WARM_POOL_SIZE", "2"))
+WARM_POOL_MAX_JOBS = int(os.environ.get("WARM_POOL_MAX_JOBS", "100"))
+
+
+class RunResult:
+    """Resultado de um job; o stdout já foi escrito no sink."""
+
+    def __init__(self, stderr, exit_code, timed_out, usage=None):
+        self.stderr    = stderr
+        self.exit_code = exit_code
+        self.timed_out = timed_out
+        self.usage     = usage   # {"cpu_ms", "peak_memory_bytes"}
+
+
+class PythonRunner:
+    """Um processo python_runner.py; executa um job de cada vez."""
+
+    @classmethod
+    async def start(cls):
+        runner = cls()
+        runner.proc = await asyncio.create_subprocess_exec(
+            "python3", os.path.join(RUNNERS_DIR, "python_runner.py"),
+            stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE,
+        )
+        runner.jobs_done = 0
+        return runner
+
+    def alive(self):
+        return self.proc.returncode is None
+
+    async def _read_reply(self, timeout):
+        try:
+            line = await asyncio.wait_for(self.proc.stdout.readline(), timeout)
+        except asyncio.TimeoutError:
+            return None
+        return json.loads(line) if line else None
+
+    async def run(self, script, input_path, workdir, limits, sink):
+        # O stdout do filho é um FIFO lido aqui em streaming; `keepalive`
+        # evita EOF antes de o filho o abrir e é fechado quando ele termina.
+        out_path = os.path.join(workdir, ".stdout")
+        err_path = os.path.join(workdir, ".stderr")
+        os.mkfifo(out_path, 0o600)
+        reader, transport = await pipe_reader(os.open(out_path, os.O_RDONLY | os.O_NONBLOCK))
+        keepalive = os.open(out_path, os.O_WRONLY | os.O_NONBLOCK)
+
+        job = {
+            "script":  script,
+            "stdin":   input_path,
+            "stdout":  out_path,
+            "stderr":  err_path,
+            "cwd":     workdir,
+            "timeout": limits["wall_seconds"],
+            "limits":  limits,
+            "uid":     JOB_UID,
+        }
+        try:
+            self.proc.stdin.write((json.dumps(job) + "\n").encode())
+            await self.proc.stdin.drain()
+            self.jobs_done += 1
+
+            # O runner aplica o timeout ao filho; o prazo extra só protege
+            # contra um runner bloqueado.
+            started = await self._read_reply(5)
+            if started is None:
+                await self.close()
+                return RunResult(b"", None, True)
+
+            forward = asyncio.ensure_future(pump(reader, sink))
+            finished = asyncio.ensure_future(self._read_reply(limits["wall_seconds"] + 5))
+            await asyncio.wait({forward, finished}, return_when=asyncio.FIRST_COMPLETED)
+            if forward.done() and not forward.result():
+                # Limite de output atingido: termina o job já
+                try:
+                    os.killpg(started["pid"], signal.SIGKILL)
+                except ProcessLookupError:
+                    pass
+            reply = await finished
+
+            os.close(keepalive)
+            keepalive = None
+            await forward
+        finally:
+            if keepalive is not None:
+                os.close(keepalive)
+            transport.close()
+
+        if reply is None:
+            await self.close()
+            return RunResult(b"", None, True)
+
+        with open(err_path, "rb") as f:
+            stderr = f.read(sink.limit)
+        return RunResult(stderr, reply["exit_code"], reply["timed_out"], reply.get("usage"))
+
+    async def close(self):
+        if self.alive():
+            self.proc.kill()
+        await self.proc.wait()
+
+
+class NodeRunner:
+    """Processo node pré-arrancado à espera de um único job no fd de controlo."""
+
+    @classmethod
+    async def start(cls):
+        runner = cls()
+        ctl_read, ctl_write = os.pipe()
+        try:
+            runner.proc = await LimitedProcess.start(
+                ["node", os.path.join(RUNNERS_DIR, "node_runner.js"), str(ctl_read)],
+                job_limits.ceiling("node"),
+                pipe_stdin=True,
+                pass_fds=(ctl_read,),
+            )
+        except OSError:
+            os.close(ctl_write)
+            raise
+        finally:
+            os.close(ctl_read)
+        runner.control = os.fdopen(ctl_write, "wb")
+        return runner
+
+    def alive(self):
+        return self.proc.returncode is None
+
+    async def run(self, script, input_path, workdir, limits, sink):
+        # o arranque do node não conta para o limite nem para o usage do job
+        cpu_used = job_limits.cpu_seconds_used(self.proc.pid)
+        self.proc.cpu_offset_ms = cpu_used * 1000
+        job_limits.apply_to_pid(self.proc.pid, limits, cpu_used)
+        self.control.write((json.dumps({"script": script, "cwd": workdir}) + "\n").encode())
+        self.control.close()
+
+        data = b""
+        if input_path:
+            with open(input_path, "rb") as f_in:
+                data = f_in.read()
+        stderr, timed_out = await communicate(self.proc, sink, limits["wall_seconds"], stdin_data=data)
+        return RunResult(stderr, self.proc.returncode, timed_out, self.proc.usage)
+
+    async def close(self):
+        if not self.control.closed:
+            self.control.close()
+        if self.alive():
+            self.proc.kill()
+        await self.proc.wait()
+        self.proc.close()
+
+
+class RunnerPool:
+    """Pool de runners de uma linguagem, reabastecido em background."""
+
+    def __init__(self, factory, size, max_jobs):
+        self.factory  = factory
+        self.size     = size
+        self.max_jobs = max_jobs
+        self.idle     = asyncio.Queue()
+
+    async def fill(self):
+        await asyncio.gather(*(self._spawn() for _ in range(self.size)))
+
+    async def _spawn(self):
+        try:
+            self.idle.put_nowait(await self.factory.start())
+        except OSError:
+            pass  # interpretador indisponível; fica o caminho a frio
+
+    def _replace(self):
+        asyncio.ensure_future(self._spawn())
+
+    async def run(self, script, input_path, limits, sink):
+        try:
+            runner = self.idle.get_nowait()
+        except asyncio.QueueEmpty:
+            return None
+        if not runner.alive():
+            self._replace()
+            return None
+
+        workdir = os.path.join("/tmp", f"job_{os.urandom(8).hex()}")
+        os.makedirs(workdir)
+        job_limits.own_workdir(workdir)
+        try:
+            result = await runner.run(script, input_path, workdir, limits, sink)
+        except BaseException:
+            # ex.: cliente desligou-se a meio do streaming; o runner fica
+            # num estado desconhecido e é descartado
+            asyncio.ensure_future(runner.close())
+            self._replace()
+            raise
+        finally:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+        reusable = (
+            isinstance(runner, PythonRunner)
+            and runner.alive()
+            and runner.jobs_done < self.max_jobs
+        )
+        if reusable:
+            self.idle.put_nowait(runner)
+        else:
+            await runner.close()
+            self._replace()
+        return result
+
+
+pools = {}
+
+
+async def init_pools(app=None):
+    if WARM_POOL_SIZE <= 0:
+        return
+    pools["python"] = RunnerPool(PythonRunner, WARM_POOL_SIZE, WARM_POOL_MAX_JOBS)
+    pools["js"]     = RunnerPool(NodeRunner, WARM_POOL_SIZE, 1)
+    await asyncio.gather(*(pool.fill() for pool in pools.values()))
+
+
+async def run_warm(language, script, input_path, limits, sink):
+    pool = pools.get(language)
+    if pool is None:
+        return None
+    return await pool.run(script, input_path, limits, sink)
@@ -0,0 +1,30 @@
+// Runner "quente" de JavaScript.
+//
+// O Node não consegue fazer fork, por isso cada processo serve um único job:
+// é arrancado antecipadamente (V8 e módulos base já carregados) e fica à
+// espera de um pedido no fd de controlo indicado em argv. stdin/stdout/stderr
+// já foram ligados pelo executor quando o processo foi criado.
+//
+// Pedido (uma linha JSON no fd de controlo): {"script": ..., "cwd": ...}
+const fs = require('fs');
+const Module = require('module');
+
+let buffer = '';
+const control = fs.createReadStream(null, { fd: Number(process.argv[2]) });
+
+control.on('data', chunk => {
+  buffer += chunk;
+  const newline = buffer.indexOf('\n');
+  if (newline < 0) return;
+
+  control.destroy();
+  const job = JSON.parse(buffer.slice(0, newline));
+  process.chdir(job.cwd);
+  process.argv.splice(1, process.argv.length - 1, job.script);
+  Module.runMain();
+});
+
+control.on('end', () => {
+  // O executor fechou o canal sem enviar job (ex.: pool a encerrar)
+  if (!buffer.includes('\n')) process.exit(0);
+});
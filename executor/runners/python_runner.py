@@ -0,0 +1,167 @@
+"""
+Runner "quente" de Python.
+
+Processo de longa duração que já tem o interpretador carregado e faz fork
+de um filho por job. O filho redireciona stdin/stdout/stderr para os
+ficheiros indicados e corre o script com runpy; o pai nunca executa código
+do utilizador, por isso cada job começa de um estado limpo.
+
+Protocolo (uma linha JSON por pedido no stdin, duas por resposta no stdout):
+    -> {"script": ..., "stdin": ..., "stdout": ..., "stderr": ..., "cwd": ...,
+        "timeout": ..., "limits": {...}, "uid": ...}
+    <- {"pid": ...}                  (filho criado; pode ser morto pelo executor)
+    <- {"exit_code": ..., "timed_out": ..., "duration_ms": ..., "usage": {...}}
+
+`stdout` pode ser um FIFO, para o executor encaminhar o output em streaming.
+`limits` e `uid` são aplicados ao filho depois de abrir esses ficheiros, como
+em limits.set_rlimits(); `usage` traz o tempo de CPU e o pico de memória.
+"""
+import json
+import os
+import resource
+import runpy
+import signal
+import sys
+import time
+import traceback
+
+# Módulos comuns pré-carregados (ficam partilhados com os filhos via fork)
+import collections, functools, heapq, itertools, math, random, re, string  # noqa: E401,F401
+
+_current_child = None
+_timed_out = False
+
+
+def _on_alarm(signum, frame):
+    global _timed_out
+    if _current_child:
+        _timed_out = True
+        try:
+            os.killpg(_current_child, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+
+
+def _set_limits(limits, uid):
+    resource.setrlimit(resource.RLIMIT_CORE, (0, 0))
+    values = [
+        (resource.RLIMIT_CPU,   limits.get("cpu_seconds"), 1),
+        (resource.RLIMIT_DATA,  limits.get("memory_bytes"), 0),
+        (resource.RLIMIT_NPROC, limits.get("processes"), 0),
+        (resource.RLIMIT_FSIZE, limits.get("output_bytes"), 0),
+    ]
+    for res, value, extra in values:
+        if value is not None:
+            resource.setrlimit(res, (value, value + extra))
+    if uid is not None and os.geteuid() == 0:
+        os.setgroups([])
+        os.setgid(uid)
+        os.setuid(uid)
+
+
+def _child(job):
+    """Corre dentro do processo filho; nunca retorna."""
+    code = 0
+    try:
+        os.setpgid(0, 0)
+        signal.signal(signal.SIGALRM, signal.SIG_DFL)
+        os.chdir(job["cwd"])
+
+        fd_in = os.open(job.get("stdin") or os.devnull, os.O_RDONLY)
+        fd_out = os.open(job["stdout"], os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        fd_err = os.open(job["stderr"], os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        os.dup2(fd_in, 0)
+        os.dup2(fd_out, 1)
+        os.dup2(fd_err, 2)
+        for fd in (fd_in, fd_out, fd_err):
+            os.close(fd)
+        _set_limits(job.get("limits") or {}, job.get("uid"))
+
+        sys.stdin = sys.__stdin__ = open(0, "r", closefd=False)
+        sys.stdout = sys.__stdout__ = open(1, "w", closefd=False)
+        sys.stderr = sys.__stderr__ = open(2, "w", buffering=1, closefd=False)
+
+        script = job["script"]
+        sys.argv = [script]
+        sys.path[0] = os.path.dirname(script)
+        runpy.run_path(script, run_name="__main__")
+    except SystemExit as e:
+        if e.code is None:
+            code = 0
+        elif isinstance(e.code, int):
+            code = e.code
+        else:
+            print(e.code, file=sys.stderr)
+            code = 1
+    except BaseException:
+        # Omite as frames do runner/runpy, como faria o interpretador
+        etype, value, tb = sys.exc_info()
+        while tb is not None and tb.tb_frame.f_code.co_filename != job["script"]:
+            tb = tb.tb_next
+        traceback.print_exception(etype, value, tb)
+        code = 1
+    finally:
+        try:
+            sys.stdout.flush()
+            sys.stderr.flush()
+        finally:
+            os._exit(code)
+
+
+def run(job):
+    global _current_child, _timed_out
+    _timed_out = False
+    start = time.monotonic()
+
+    pid = os.fork()
+    if pid == 0:
+        _child(job)
+
+    try:
+        os.setpgid(pid, pid)
+    except OSError:
+        pass  # o filho já o fez (ou já terminou)
+    _reply({"pid": pid})
+
+    _current_child = pid
+    signal.setitimer(signal.ITIMER_REAL, float(job.get("timeout", 10)))
+    try:
+        _, status, rusage = os.wait4(pid, 0)
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        _current_child = None
+
+    # Garante que netos deixados pelo script não sobrevivem ao job
+    try:
+        os.killpg(pid, signal.SIGKILL)
+    except ProcessLookupError:
+        pass
+
+    return {
+        "exit_code": os.waitstatus_to_exitcode(status),
+        "timed_out": _timed_out,
+        "duration_ms": round((time.monotonic() - start) * 1000, 3),
+        "usage": {
+            "cpu_ms":            round((rusage.ru_utime + rusage.ru_stime) * 1000, 1),
+            "peak_memory_bytes": rusage.ru_maxrss * 1024,
+        },
+    }
+
+
+def _reply(message):
+    sys.stdout.write(json.dumps(message) + "\n")
+    sys.stdout.flush()
+
+
+def main():
+    signal.signal(signal.SIGALRM, _on_alarm)
+    # Aquece o runpy (pkgutil, importlib) para que os filhos não o façam
+    runpy.run_path(os.devnull, run_name="__warmup__")
+    for line in sys.stdin:
+        if not line.strip():
+            continue
+        _reply(run(json.loads(line)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,151 @@
+"""
+Benchmark de ponta a ponta contra uma stack local (docker-compose ou
+minikube service backend --url).
+
+Submete cada script de exemplo N vezes por /submit-job, com C pedidos em
+simultâneo, espera pelo fim de cada job e lê o /job-trace. No fim mostra
+o throughput e os percentis p50/p95/p99 de cada fase (ms):
+
+    python scripts/benchmark.py --url http://localhost:5000 --jobs 50 --concurrency 8
+
+O /submit-job limita as submissões por utilizador (INTERACTIVE_RATE e
+INTERACTIVE_BURST no backend): os 429 são repetidos após o Retry-After e
+contados à parte; com --users os pedidos são repartidos por vários
+utilizadores.
+"""
+import argparse
+import math
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# nome -> (script, input)
+SAMPLES = {
+    "hello":   ("tests/hello.py", None),
+    "complex": ("tests/complex.py", None),
+    "cpp":     ("tests/test.cpp", "tests/input.txt"),
+    "rust":    ("tests/test.rs", "tests/input.txt"),
+}
+
+PHASES = ("fair_queue", "queue", "executor", "admission", "upload", "compile", "run", "write", "total")
+
+
+def percentile(values, q):
+    """Percentil pelo método nearest-rank."""
+    values = sorted(values)
+    return values[max(math.ceil(q * len(values)) - 1, 0)] if values else None
+
+
+class Bench:
+    def __init__(self, url, usernames, password, timeout):
+        self.url       = url.rstrip("/")
+        self.usernames = usernames
+        self.password  = password
+        self.timeout   = timeout
+        self.local     = threading.local()
+        self.throttled = 0
+        self.lock      = threading.Lock()
+
+    @property
+    def session(self):
+        """Uma sessão HTTP (keep-alive) por thread."""
+        if not hasattr(self.local, "session"):
+            self.local.session = requests.Session()
+        return self.local.session
+
+    def register(self):
+        for username in self.usernames:
+            r = self.session.post(f"{self.url}/register",
+                                  json={"username": username, "password": self.password})
+            if r.status_code not in (201, 409):
+                raise SystemExit(f"registo de {username} falhou: {r.status_code} {r.text}")
+
+    def submit(self, username, script, input_path):
+        while True:
+            files = {"job": open(os.path.join(ROOT, script), "rb")}
+            if input_path:
+                files["input"] = open(os.path.join(ROOT, input_path), "rb")
+            try:
+                r = self.session.post(f"{self.url}/submit-job", data={"username": username}, files=files)
+            finally:
+                for f in files.values():
+                    f.close()
+            if r.status_code != 429:
+                break
+            with self.lock:
+                self.throttled += 1
+            time.sleep(float(r.headers.get("Retry-After", 1)))
+        r.raise_for_status()
+        return r.json()["job_id"]
+
+    def wait_trace(self, username, job_id):
+        deadline = time.monotonic() + self.timeout
+        while time.monotonic() < deadline:
+            # long-poll pelo fim do job; depois o trace (gravado antes do evento)
+            self.session.get(f"{self.url}/job-result",
+                             params={"username": username, "job_id": job_id, "wait": 10})
+            r = self.session.get(f"{self.url}/job-trace/{job_id}", params={"username": username})
+            if r.status_code == 200:
+                return r.json()
+            if r.status_code != 202:
+                r.raise_for_status()
+        raise TimeoutError(f"job {job_id} não terminou em {self.timeout} s")
+
+    def run_one(self, i, script, input_path):
+        username = self.usernames[i % len(self.usernames)]
+        return self.wait_trace(username, self.submit(username, script, input_path))
+
+    def run_sample(self, script, input_path, jobs, concurrency):
+        started = time.monotonic()
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            traces = list(pool.map(lambda i: self.run_one(i, script, input_path), range(jobs)))
+        return traces, time.monotonic() - started
+
+
+def report(name, traces, elapsed):
+    statuses = {}
+    for trace in traces:
+        statuses[trace["status"]] = statuses.get(trace["status"], 0) + 1
+    print(f"\n== {name}: {len(traces)} jobs em {elapsed:.1f} s "
+          f"({len(traces) / elapsed:.2f} jobs/s) {statuses}")
+    print(f"{'fase':<12}{'p50':>10}{'p95':>10}{'p99':>10}{'max':>10}")
+    for phase in PHASES:
+        values = [t["phases_ms"][phase] for t in traces if phase in t["phases_ms"]]
+        if not values:
+            continue
+        row = [percentile(values, q) for q in (0.5, 0.95, 0.99)] + [max(values)]
+        print(f"{phase:<12}" + "".join(f"{v:>10.1f}" for v in row))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default=os.environ.get("BACKEND_URL", "http://localhost:5000"))
+    parser.add_argument("--jobs", type=int, default=20, help="jobs por script")
+    parser.add_argument("--concurrency", type=int, default=4, help="jobs em simultâneo")
+    parser.add_argument("--users", type=int, default=1, help="utilizadores por onde repartir os jobs")
+    parser.add_argument("--username", default="bench")
+    parser.add_argument("--password", default="bench")
+    parser.add_argument("--timeout", type=float, default=300, help="espera máxima por job (s)")
+    parser.add_argument("--samples", default=",".join(SAMPLES), help="scripts a correr, separados por vírgula")
+    args = parser.parse_args()
+
+    usernames = [args.username] if args.users <= 1 else \
+        [f"{args.username}{i}" for i in range(args.users)]
+    bench = Bench(args.url, usernames, args.password, args.timeout)
+    bench.register()
+
+    for name in args.samples.split(","):
+        script, input_path = SAMPLES[name]
+        traces, elapsed = bench.run_sample(script, input_path, args.jobs, args.concurrency)
+        report(name, traces, elapsed)
+    if bench.throttled:
+        print(f"\n{bench.throttled} submissões recusadas com 429 (repetidas)")
+
+
+if __name__ == "__main__":
+    main()
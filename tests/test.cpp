@@ -0,0 +1,31 @@
+#include <iostream>
+
+int main() {
+    std::cout << "Por favor, introduz um número:" << std::endl;
+
+    // Lê a entrada do utilizador da consola
+    int numero;
+    if (!(std::cin >> numero)) {
+        std::cout << "Não foi introduzido um número válido." << std::endl;
+        return 0;
+    }
+
+    // Soma dos números primos até ao número introduzido (algum trabalho de CPU)
+    long long soma = 0;
+    for (int x = 2; x <= numero; x++) {
+        bool primo = true;
+        for (int d = 2; d * d <= x; d++) {
+            if (x % d == 0) {
+                primo = false;
+                break;
+            }
+        }
+        if (primo) {
+            soma += x;
+        }
+    }
+
+    std::cout << "O número que introduziste foi: " << numero << std::endl;
+    std::cout << "Soma dos primos até " << numero << ": " << soma << std::endl;
+    return 0;
+}
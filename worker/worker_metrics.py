@@ -0,0 +1,83 @@
+"""
+/metrics do worker Celery (formato Prometheus), servido por uma thread
+do processo principal na porta WORKER_METRICS_PORT.
+
+As tasks correm nos processos filhos do pool prefork: os contadores ficam
+em memória partilhada (multiprocessing.Value, criada no import, antes do
+fork) para o processo principal os poder reportar. Com a concorrência do
+pool dá a ocupação do worker; a fila à espera é exportada pelo backend
+(/metrics) a partir do Redis.
+"""
+import multiprocessing
+import os
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from celery.signals import task_postrun, task_prerun, worker_init
+
+from prometheus import CONTENT_TYPE, render
+
+WORKER_METRICS_PORT = int(os.environ.get("WORKER_METRICS_PORT", "9808"))
+
+TASK_STATES = ("SUCCESS", "FAILURE", "RETRY")
+
+_inflight    = multiprocessing.Value("i", 0)
+_finished    = {state: multiprocessing.Value("q", 0) for state in TASK_STATES}
+_concurrency = None
+
+
+def _add(counter, n):
+    with counter.get_lock():
+        counter.value += n
+
+
+@task_prerun.connect
+def _task_started(**kwargs):
+    _add(_inflight, 1)
+
+
+@task_postrun.connect
+def _task_finished(state=None, **kwargs):
+    _add(_inflight, -1)
+    if state in _finished:
+        _add(_finished[state], 1)
+
+
+def metrics_text():
+    return render([
+        ("mycloud_worker_inflight_tasks", "gauge",
+         "Tasks em execução neste worker.",
+         [({}, _inflight.value)]),
+        ("mycloud_worker_concurrency", "gauge",
+         "Processos do pool (tasks em simultâneo).",
+         [({}, _concurrency)]),
+        ("mycloud_worker_tasks_total", "counter",
+         "Tasks terminadas por estado.",
+         [({"state": state}, counter.value) for state, counter in _finished.items()]),
+    ])
+
+
+class _Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path != "/metrics":
+            self.send_error(404)
+            return
+        body = metrics_text().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass   # sem uma linha de log por scrape
+
+
+@worker_init.connect
+def start_metrics_server(sender=None, **kwargs):
+    global _concurrency
+    _concurrency = getattr(sender, "concurrency", None)
+    if WORKER_METRICS_PORT <= 0:
+        return
+    server = ThreadingHTTPServer(("0.0.0.0", WORKER_METRICS_PORT), _Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()